@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compares the formula lexer with the former regular expression pipeline on adversarial descriptions.
+
+The descriptions consist of many letters and digits which look like the beginning of a formula, but never form a
+complete coordinate dimension, so that the regular expressions have to backtrack. Run from the repository root:
+
+    python benchmarks/bench_formula_lexer.py
+'''
+
+import re
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from caspr.formula import FormulaLexer  # noqa: E402
+
+_VARIABLES = 'ABCDEFGHIJ'
+_REPETITIONS = (250, 500, 1000, 2000, 4000)
+_TIMEOUT = 10  # seconds, the regular expressions are not measured anymore once they take longer
+
+# The grammar of the formulas as regular expressions, as FormulaConverter used it before the lexer.
+_WS = r'[ \t]'
+_OPENING_BRACES = r'[([{]'
+_CLOSING_BRACES = r'[)\]}]'
+_BRACES = '{opening}|{closing}'.format(opening=_OPENING_BRACES, closing=_CLOSING_BRACES)
+_MATH_OPS = r'[+\-/*]'  # Note: escape '-', otherwise it would be a character range!
+_CASUAL_MATH_OPS = '[:x]'
+# Beware: as the variables are only known at runtime need to format them before using _FORMULA
+_FORMULA = (r'((?:\d|{braces}|{math_ops}|{casual_math_ops}|{variables})'
+            r'(?:{ws}|\d|{braces}|{math_ops}|{casual_math_ops}|{variables})+)')
+_DEGREE = '[°]'
+_DECIMAL_SEPARATOR = '[.,]'
+_MASK = '({orientation})({ws}*{formula}{ws}*{degree})'
+_FIX_MASK = '[|]({orientation})[|](?!{ws}*{formula}{ws}*{degree})'
+_DYNAMIC_DIMENSION = (
+    '[|]{orientation}[|]{ws}*{formula}{ws}*{degree}{ws}*{formula}{ws}*(?:{formula}{ws}*)?{separator}'
+    '{ws}*{formula}(?:{ws}*{formula})*')
+
+
+def _compile_regex_pipeline(variables):
+    ''' Returns the mask, fix mask and dimension expressions FormulaConverter used before the lexer. '''
+
+    formula = _FORMULA.format(ws=_WS, braces=_BRACES, math_ops=_MATH_OPS, casual_math_ops=_CASUAL_MATH_OPS,
+                              variables='[{0}]'.format(variables))
+    orientation = '[NSOE]'
+    mask = re.compile(_MASK.format(orientation=orientation, ws=_WS, formula=formula, degree=_DEGREE))
+    fix_mask = re.compile(_FIX_MASK.format(orientation=orientation, ws=_WS, formula=formula, degree=_DEGREE))
+    dimension = re.compile(_DYNAMIC_DIMENSION.format(orientation=orientation, ws=_WS, formula=formula, degree=_DEGREE,
+                                                     separator=_DECIMAL_SEPARATOR))
+    return mask, fix_mask, dimension
+
+
+def _extract_with_regex(patterns, description):
+    mask, fix_mask, dimension = patterns
+    description = fix_mask.sub(r'\1', mask.sub(r'|\1|\2', mask.sub(r'|\1|\2', description)))
+    return [match.group() for match in dimension.finditer(description)]
+
+
+def _extract_with_lexer(lexer, description):
+    return list(lexer.dimensions(description))
+
+
+def _measure(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    patterns = _compile_regex_pipeline(_VARIABLES)
+    lexer = FormulaLexer(_VARIABLES)
+    print('{0:>10} {1:>12} {2:>12}'.format('length', 'regex [s]', 'lexer [s]'))
+    regex_too_slow = False
+    for repetitions in _REPETITIONS:
+        # a dimension without decimal separator, so that the regular expressions try each split of the minutes
+        description = 'N 1A°' + ' 2B' * repetitions
+        regex = None
+        if not regex_too_slow:
+            regex = _measure(_extract_with_regex, patterns, description)
+            regex_too_slow = regex > _TIMEOUT
+        lexer_duration = _measure(_extract_with_lexer, lexer, description)
+        print('{0:>10} {1:>12} {2:>12.6f}'.format(len(description), '-' if regex is None else '{0:.6f}'.format(regex),
+                                                  lexer_duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compares preparing a batch of caches in a single process with preparing them in a pool of processes.
+
+All caches are copies of the sample page of the tests, which are published to a sheet factory keeping nothing, so
+that only parsing and row generation are measured. Run from the repository root:
+
+    python benchmarks/bench_process_pool.py [pages]
+'''
+
+import os
+import sys
+import tarfile
+import time
+
+sys.path.insert(0, '.')
+
+from caspr.caches import Caches  # noqa: E402
+from caspr.geocachingdotcom import DescriptionParser, PageParser, TableParser  # noqa: E402
+from caspr.page import Page  # noqa: E402
+
+_SAMPLES = os.path.join('tests', 'sample_data', 'samples.tar.bz2')
+_SAMPLE_PAGE = ('GC2A62B Seepromenade Luzern [DE_EN] (Multi-cache) in Zentralschweiz (ZG_SZ_LU_UR_OW_NW), '
+                'Switzerland created by Worlddiver.html')
+_CHUNKSIZES = (1, 10, 50)
+
+
+class _Site:
+    def __init__(self, page):
+        self._page = page
+
+    def fetch(self, code):
+        return self._page
+
+
+class _Sheet:
+    def update(self, range_name, values, raw):
+        pass
+
+
+class _Factory:
+    def create(self, name):
+        return _Sheet()
+
+
+def _measure(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tarfile.open(_SAMPLES) as samples:
+        page = Page(content=samples.extractfile(_SAMPLE_PAGE).read(), encoding=None)
+    caches = Caches(site=_Site(page),
+                    parser=PageParser(table_parser=TableParser(), description_parser=DescriptionParser(),
+                                      streaming=True),
+                    factory=_Factory())
+    codes = ['GC{0}'.format(i) for i in range(pages)]
+    print('{0} pages on {1} cores'.format(pages, os.cpu_count()))
+    print('{0:>24} {1:>10.3f} s'.format('single process', _measure(caches.prepare, codes)))
+    for chunksize in _CHUNKSIZES:
+        duration = _measure(caches.prepare_parallel, codes, chunksize=chunksize)
+        print('{0:>24} {1:>10.3f} s'.format('processes, chunksize {0}'.format(chunksize), duration))
+
+
+if __name__ == '__main__':
+    main()
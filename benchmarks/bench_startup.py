@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measures the start-up time of caspr, i.e. the time importing its modules takes before any work is done.
+
+Each measurement imports caspr.main in a fresh interpreter with -X importtime and reads the cumulative import times
+from its output. The shortest of several runs is reported, together with the slowest modules imported directly or
+indirectly by caspr. Run from the repository root:
+
+    python benchmarks/bench_startup.py [modules]
+'''
+
+import subprocess
+import sys
+
+_MODULE = 'caspr.main'
+_REPETITIONS = 5
+
+
+def _import_times(module):
+    ''' Returns the cumulative import times in microseconds of the given module and all modules imported by it. '''
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # modules are listed after the modules they import, nested ones indented, e.g. site before the given module
+        if not name.startswith('  ') and name.strip() != module:
+            times = {}
+            continue
+        times.setdefault(name.strip(), int(cumulative))
+    return times
+
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    runs = [_import_times(_MODULE) for _ in range(_REPETITIONS)]
+    fastest = min(runs, key=lambda times: times[_MODULE])
+    print('{0:>40} {1:>10.1f} ms'.format('import ' + _MODULE, fastest[_MODULE] / 1000))
+    slowest = sorted((item for item in fastest.items() if item[0] != _MODULE), key=lambda item: -item[1])
+    for name, cumulative in slowest[:modules]:
+        print('{0:>40} {1:>10.1f} ms'.format(name, cumulative / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compares parsing geocache pages entirely with parsing them in streaming mode.
+
+The sample page of the tests is extended by a growing number of logs, like the pages of popular caches. Each
+measurement runs in a fresh process, so that its peak memory can be told apart. Run from the repository root:
+
+    python benchmarks/bench_streaming_parser.py
+'''
+
+import os
+import resource
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+from caspr.geocachingdotcom import DescriptionParser, PageParser, TableParser  # noqa: E402
+from caspr.page import Page  # noqa: E402
+
+_SAMPLES = os.path.join('tests', 'sample_data', 'samples.tar.bz2')
+_SAMPLE_PAGE = ('GC2A62B Seepromenade Luzern [DE_EN] (Multi-cache) in Zentralschweiz (ZG_SZ_LU_UR_OW_NW), '
+                'Switzerland created by Worlddiver.html')
+_LOGS = (0, 1000, 10000, 50000)
+_REPETITIONS = 5
+
+_LOG = ('<tr><td><p class="logOwnerProfileName"><a href="/profile/?guid={0}">cacher {0}</a></p>'
+        '<img src="/images/icons/icon_smile.gif" title="Found it"/><span class="LogDate">10/02/2015</span>'
+        '<div class="LogText"><p>Found it with {0} friends, thanks for the cache!</p></div></td></tr>'
+        '<script type="text/javascript">var log{0} = {{"id": {0}}};</script>')
+
+
+def _page(logs):
+    ''' Returns the content of the sample page with the given number of logs added. '''
+
+    with tarfile.open(_SAMPLES) as samples:
+        content = samples.extractfile(_SAMPLE_PAGE).read()
+    end = content.rindex(b'</body>')
+    table = '<table class="LogsTable">{0}</table>'.format(''.join(_LOG.format(i) for i in range(logs)))
+    return content[:end] + table.encode('utf-8') + content[end:]
+
+
+def _measure(streaming, path):
+    ''' Prints the shortest duration of parsing the page and the peak memory of this process. '''
+
+    with open(path, 'rb') as file:
+        page = Page(content=file.read(), encoding=None)
+    parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser(), streaming=streaming)
+    durations = []
+    for _ in range(_REPETITIONS):
+        start = time.perf_counter()
+        list(parser.parse(page)['stages'])
+        durations.append(time.perf_counter() - start)
+    print(min(durations), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _run(streaming, path):
+    output = subprocess.check_output([sys.executable, __file__, 'streaming' if streaming else 'entire', path])
+    duration, memory = output.split()
+    return float(duration), int(memory) // 1024
+
+
+def main():
+    print('{0:>8} {1:>10} {2:>12} {3:>12} {4:>12} {5:>12}'.format('logs', 'size [KB]', 'entire [s]', 'stream [s]',
+                                                                  'entire [MB]', 'stream [MB]'))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'page.html')
+        for logs in _LOGS:
+            with open(path, 'wb') as file:
+                file.write(_page(logs))
+            entire, entire_memory = _run(False, path)
+            streaming, streaming_memory = _run(True, path)
+            print('{0:>8} {1:>10} {2:>12.6f} {3:>12.6f} {4:>12} {5:>12}'.format(
+                logs, os.path.getsize(path) // 1024, entire, streaming, entire_memory, streaming_memory))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        _measure(sys.argv[1] == 'streaming', sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compares the row-wise waypoint table parser with the former three column queries on pages with many waypoints.
+
+The pages are built like the waypoint table of geocaching.com, where each waypoint row is followed by a row holding
+its note. Run from the repository root:
+
+    python benchmarks/bench_table_parser.py
+'''
+
+import sys
+import time
+
+from lxml import html
+
+sys.path.insert(0, '.')
+
+from caspr.geocachingdotcom import get_multi_line_texts, get_single_line_texts, TableParser  # noqa: E402
+
+_WAYPOINTS = (100, 300, 1000, 3000)
+_REPETITIONS = 5
+
+_ROW = ('<tr><td></td><td><img src="x"/></td><td><img src="x"/></td><td>{0:02d}</td><td>Stage</td>'
+        '<td><a href="#">Stage {0}</a> (Virtuelle Station)</td>'
+        '<td>\n    N 47° 03.{1:03d} E 008° 18.557\xa0\n    \n</td><td></td></tr>'
+        '<tr><td></td><td>Note:</td><td>A = number of spikes<br/>N 47° [ B - C ].[ B x F ]</td></tr>')
+
+
+def _page(waypoints):
+    rows = ''.join(_ROW.format(index, index % 1000) for index in range(waypoints))
+    return ('<html><head><title>GC0000 Benchmark</title></head><body>'
+            '<table id="ctl00_ContentBody_Waypoints"><thead><tr><th>Name</th></tr></thead>'
+            '<tbody>{0}</tbody></table></body></html>'.format(rows))
+
+
+def _parse_by_columns(root):
+    ''' The former TableParser.parse, querying each column of the whole table on its own. '''
+
+    names = get_single_line_texts(root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[6]"))
+    coordinates = root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[7]/text()")
+    descriptions = get_multi_line_texts(root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[3]"))
+    return list(TableParser._generate(names=names, coordinates=coordinates, descriptions=descriptions))
+
+
+def _parse_by_rows(root):
+    return list(TableParser().parse(root))
+
+
+def _measure(function, text):
+    ''' Returns the shortest duration of parsing the text and calling function on its root. '''
+
+    durations = []
+    for _ in range(_REPETITIONS):
+        root = html.fromstring(text)  # parsed anew, as the parsers modify the line breaks of the notes
+        start = time.perf_counter()
+        function(root)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main():
+    print('{0:>10} {1:>12} {2:>12}'.format('waypoints', 'columns [s]', 'rows [s]'))
+    for waypoints in _WAYPOINTS:
+        text = _page(waypoints)
+        print('{0:>10} {1:>12.6f} {2:>12.6f}'.format(waypoints, _measure(_parse_by_columns, text),
+                                                     _measure(_parse_by_rows, text)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +0,0 @@
-import pkg_resources
-
-# __version__ = pkg_resources.get_distribution(__name__).version
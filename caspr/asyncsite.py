@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from caspr.casprexception import CasprException
+from caspr.page import Page, Validators
+from caspr.ratelimit import check_status, UNLIMITED
+
+# Number of requests in flight to a host at the same time, like browsers do.
+DEFAULT_CONNECTIONS_PER_HOST = 4
+# Seconds a single page may take.
+DEFAULT_TIMEOUT = 60
+
+_BASE_URL = 'http://www.geocaching.com'
+
+
+class AsyncGeocachingSite:
+    '''
+    Fetches the pages of geocaches from www.geocaching.com like GeocachingSite, but with coroutines.
+
+    All requests share a pool of keep-alive connections holding at most connections_per_host connections per host, so
+    that at most as many requests are in flight to a host at the same time, while further requests wait for a free
+    connection. The site does not log in itself, but takes the session cookies of a logged in GeocachingSite.
+
+    Use the site as asynchronous context manager, which closes its connections on exit. Cancelling a fetch aborts its
+    request.
+    '''
+
+    def __init__(self, cookies=None, connections_per_host=DEFAULT_CONNECTIONS_PER_HOST, timeout=DEFAULT_TIMEOUT,
+                 base_url=_BASE_URL, limiter=None):
+        '''
+        Initializes the site sending the given cookies {name: value} with each request to base_url, where fetching is
+        throttled and retried by the limiter, an Endpoint of caspr.ratelimit, if given.
+        '''
+
+        if connections_per_host < 1:
+            raise CasprException('at least one connection per host is required')
+        self._cookies = cookies or {}
+        self._connections_per_host = connections_per_host
+        self._timeout = timeout
+        self._base_url = base_url.rstrip('/')
+        self._limiter = limiter or UNLIMITED
+        self._session = None
+
+    async def __aenter__(self):
+        self._open()
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    async def close(self):
+        ''' Closes all connections, which are opened again by the next fetch. '''
+
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def fetch(self, code):
+        ''' Returns the page of the geocache with the given code. '''
+
+        page, _ = await self.fetch_if_modified(code=code)
+        return page
+
+    async def fetch_if_modified(self, code, etag=None, last_modified=None):
+        '''
+        Returns the page of the geocache with the given code and its validators.
+
+        If the validators of a previously fetched page are passed and the page did not change since, None is returned
+        instead of the page.
+        '''
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        async def get():
+            async with self._open().get('{0}/geocache/{1}'.format(self._base_url, code), headers=headers) as response:
+                check_status(response.status, retry_after=response.headers.get('Retry-After'))
+                validators = Validators(etag=response.headers.get('ETag'),
+                                        last_modified=response.headers.get('Last-Modified'))
+                if response.status == 304:
+                    return None, validators
+                # without a declared charset the parser detects the encoding, like for GeocachingSite
+                return Page(content=await response.read(), encoding=response.charset), validators
+
+        return await self._limiter.call_async(get)
+
+    def _open(self):
+        ''' Returns the HTTP session, which is created on first use, as it must be created by a running event loop. '''
+
+        if self._session is None:
+            import aiohttp  # only needed when fetching asynchronously, and it takes long to import
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self._connections_per_host),
+                cookies=self._cookies,
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
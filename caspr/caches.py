@@ -1,7 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import collections
+import logging
+import os
+import threading
+
+from caspr.casprexception import CasprException
 from caspr.googledotcom import FormulaConverter, publish_as_sheet
+from caspr.journal import FAILED, FETCHED, page_digest, PARSED, PUBLISHED
+from caspr.pipeline import Pipeline
+
+# Number of caches fetched at the same time by prepare_pipelined() and prepare_async().
+DEFAULT_FETCHERS = 4
+
+_logger = logging.getLogger(__name__)
 
 
 # TODO(KNR): is there some existing mechanism we can use instead?
@@ -29,15 +42,164 @@ class Caches:
         self._parser = parser
         self._factory = factory
 
-    def prepare(self, codes):
-        ''' Fetches the page for each geocaching code, parses it, and generates a sheet. '''
+    def prepare(self, codes, journal=None):
+        '''
+        Fetches the page for each geocaching code, parses it, and generates a sheet.
+
+        If a journal is given, the caches published according to it are skipped and the progress of the others is
+        recorded in it. Each cache then succeeds or fails on its own, and a CasprException naming the failed caches is
+        raised at the end. Without a journal, the first failing cache aborts the preparation.
+        '''
+
+        progress = _Progress(journal)
+        steps = [progress.step(FETCHED, self._fetch), progress.step(PARSED, lambda page: self._parser.parse(page=page)),
+                 progress.step(PUBLISHED, self._publish_cache)]
+        for item in progress.items(codes):
+            for step in steps:
+                item = step(item)
+        progress.check()
+
+    def prepare_pipelined(self, codes, fetchers=DEFAULT_FETCHERS, parsers=1, publishers=1, queue_size=4, journal=None):
+        '''
+        Like prepare(), but fetches, parses, and publishes different caches concurrently.
+
+        Each step runs in its own pool of worker threads, connected by queues holding at most queue_size caches. The
+        caches are completed in the order of the codes and without journal the first failing cache aborts the
+        preparation.
+        '''
+
+        progress = _Progress(journal)
+        pipeline = Pipeline(stages=[(progress.step(FETCHED, self._fetch), fetchers),
+                                    (progress.step(PARSED, self._parse), parsers),
+                                    (progress.step(PUBLISHED, self._publish_cache), publishers)],
+                            queue_size=queue_size)
+        for _ in pipeline.run(progress.items(codes)):
+            pass
+        progress.check()
+
+    def prepare_parallel(self, codes, processes=None, chunksize=1, journal=None):
+        '''
+        Like prepare(), but parses the pages and generates the rows of their sheets in a pool of processes.
+
+        Parsing and formula extraction are pure CPU work, which threads cannot spread across cores. The pages are
+        fetched and the sheets published by this process, while up to processes worker processes (default: one per
+        core) each receive chunksize pages at once. Larger chunks reduce the overhead of passing pages to the workers
+        for large batches, e.g. reprocessing cached pages offline. The parser must be picklable.
+
+        At most two chunks per process are fetched ahead of publishing, so that fetching overlaps with parsing and
+        only few pages are held at once. If fetching fails without journal, the caches fetched before are published
+        like by prepare().
+        '''
+
+        from concurrent.futures import ProcessPoolExecutor  # only imported when needed, like multiprocessing
+
+        progress = _Progress(journal)
+        fetch = progress.step(FETCHED, self._fetch)
+        publish = progress.step(PUBLISHED, self._publish_rows)
+        window = 2 * (processes or os.cpu_count() or 1)
+
+        def publish_chunk(future):
+            for code, cache in future.result():
+                if isinstance(cache, Exception):  # raised by the worker
+                    progress.fail(code, cache)
+                    continue
+                if cache is not _FAILED:
+                    progress.record(code, PARSED, cache)
+                publish((code, cache))
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parsing = collections.deque()
 
-        pages = (self._site.fetch(code=code) for code in codes)
-        caches = (self._parser.parse(page=page) for page in pages)
+            def submit(chunk):
+                parsing.append(executor.submit(_parse_chunk, self._parser, journal is not None, chunk))
 
-        # TODO(KNR): how to call _publish() without explicitly iterating over names and stages?
-        for cache in caches:
-            Caches._publish(name=cache['name'], stages=cache['stages'], factory=self._factory)
+            try:
+                chunk = []
+                for item in progress.items(codes):
+                    try:
+                        chunk.append(fetch(item))
+                    except Exception:
+                        if chunk:
+                            submit(chunk)
+                        while parsing:
+                            publish_chunk(parsing.popleft())
+                        raise
+                    if len(chunk) == chunksize:
+                        submit(chunk)
+                        chunk = []
+                        if len(parsing) >= window:
+                            publish_chunk(parsing.popleft())
+                if chunk:
+                    submit(chunk)
+                while parsing:
+                    publish_chunk(parsing.popleft())
+            finally:
+                for future in parsing:  # left over by a failure
+                    future.cancel()
+        progress.check()
+
+    async def prepare_async(self, codes, fetchers=DEFAULT_FETCHERS, journal=None):
+        '''
+        Like prepare(), but with a site whose fetch() is a coroutine, e.g. AsyncGeocachingSite, which fetches up to
+        fetchers pages at the same time.
+
+        The caches are parsed and published in the order of the codes by a worker thread, while the event loop keeps
+        fetching the following pages. Without journal the first failing cache aborts the preparation. Cancelling the
+        preparation cancels all pending fetches, but completes the cache being published.
+        '''
+
+        import asyncio  # only imported when needed, as it takes long
+
+        if fetchers < 1:
+            raise CasprException('at least one fetcher is required')
+        progress = _Progress(journal)
+        parse, publish = progress.step(PARSED, self._parse), progress.step(PUBLISHED, self._publish_cache)
+
+        async def fetch(code):
+            try:
+                page = await self._site.fetch(code=code)
+            except Exception as exception:
+                return progress.fail(code, exception)
+            progress.record(code, FETCHED, page)
+            return code, page
+
+        def parse_and_publish(item):
+            publish(parse(item))
+
+        loop = asyncio.get_running_loop()
+        fetches = collections.deque()
+        try:
+            for code, _ in progress.items(codes):
+                fetches.append(asyncio.ensure_future(fetch(code)))
+                if len(fetches) >= fetchers:
+                    item = await fetches.popleft()
+                    await loop.run_in_executor(None, parse_and_publish, item)
+            while fetches:
+                item = await fetches.popleft()
+                await loop.run_in_executor(None, parse_and_publish, item)
+        finally:
+            for pending in fetches:
+                pending.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)  # so that no fetch is left running
+        progress.check()
+
+    def _fetch(self, code):
+        ''' Fetches the page of a single geocache. '''
+        return self._site.fetch(code=code)
+
+    def _parse(self, page):
+        ''' Parses a single page including all of its stages, so that the parsing work is done by the caller. '''
+
+        cache = self._parser.parse(page=page)
+        return {'name': cache['name'], 'stages': list(cache['stages'])}
+
+    def _publish_cache(self, cache):
+        ''' Publishes a single parsed cache. '''
+        Caches._publish(name=cache['name'], stages=cache['stages'], factory=self._factory)
+
+    def _publish_rows(self, cache):
+        ''' Publishes the rows of a single cache generated by a worker process. '''
+        publish_as_sheet(name=cache['name'], rows=cache['rows'], factory=self._factory)
 
     @staticmethod
     def _merge_tasks(stage, descriptions):
@@ -90,8 +252,8 @@ class Caches:
             yield row
 
     @staticmethod
-    def _publish(name, stages, factory):
-        ''' Generates a Google Docs Sheet with the passed name from the given stages. '''
+    def _generate_rows(stages):
+        ''' Returns the rows of the sheet of the given stages as list of lists. '''
 
         # cannot use generator expression for _merge_tasks because we need to iterate over all tasks before
         # preparing the rows
@@ -103,5 +265,110 @@ class Caches:
                                                descriptions=descriptions,
                                                variable_addresses=variable_addresses,
                                                row_counter=counter)
-        rows = Caches._generate_row_counters(rows=rows, row_counter=counter)
-        publish_as_sheet(name=name, rows=rows, factory=factory)
+        return [list(row) for row in Caches._generate_row_counters(rows=rows, row_counter=counter)]
+
+    @staticmethod
+    def _publish(name, stages, factory):
+        ''' Generates a Google Docs Sheet with the passed name from the given stages and returns the write calls. '''
+        return publish_as_sheet(name=name, rows=Caches._generate_rows(stages=stages), factory=factory)
+
+
+def _parse_rows(parser, page):
+    ''' Parses a page and returns the name and the sheet rows of its cache, run by the worker processes. '''
+
+    cache = parser.parse(page=page)
+    return {'name': cache['name'], 'rows': Caches._generate_rows(stages=cache['stages'])}
+
+
+def _parse_rows_of(parser, isolated, item):
+    '''
+    Like _parse_rows(), but for the (code, page) item of a cache, where the error is returned as CasprException
+    instead of raised if isolated, so that the other caches of the worker's chunk are still parsed. Only its message is
+    kept, as not all exceptions can be passed back, e.g. those of lxml.
+    '''
+
+    code, page = item
+    if page is _FAILED:
+        return item
+    try:
+        return code, _parse_rows(parser, page)
+    except Exception as exception:
+        if not isolated:
+            raise
+        return code, CasprException('{0}: {1}'.format(type(exception).__name__, exception))
+
+
+def _parse_chunk(parser, isolated, items):
+    ''' Returns the results of _parse_rows_of() for a chunk of items, run by the worker processes. '''
+    return [_parse_rows_of(parser, isolated, item) for item in items]
+
+
+class _Failed:
+    ''' Replaces the value of a cache which failed in an earlier step. '''
+
+    def __reduce__(self):
+        return '_FAILED'  # stays the same object when passed to and from worker processes
+
+
+_FAILED = _Failed()
+
+
+class _Progress:
+    '''
+    Tracks the caches of a batch through the steps as (code, value) items and records their progress in a journal.
+
+    With a journal, a failing cache is recorded and skipped by the following steps, so that each cache succeeds or
+    fails on its own. Without journal, failures are raised right away.
+    '''
+
+    def __init__(self, journal):
+        self._journal = journal
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()  # steps may run in several threads
+
+    def items(self, codes):
+        ''' Returns the (code, code) items of the codes, skipping caches published according to the journal. '''
+
+        codes = self._journal.pending(codes) if self._journal else codes
+        return ((code, code) for code in codes)
+
+    def step(self, state, function):
+        ''' Returns a step calling the function with the value of an item and recording the state reached by it. '''
+
+        def run(item):
+            code, value = item
+            if value is _FAILED:
+                return item
+            try:
+                result = function(value)
+            except Exception as exception:
+                return self.fail(code, exception)
+            self.record(code, state, result)
+            return code, result
+
+        return run
+
+    def record(self, code, state, result):
+        ''' Records that the cache with the given code reached the state with the given result. '''
+
+        if self._journal:
+            self._journal.record(code, state, digest=page_digest(result) if state == FETCHED else None)
+
+    def fail(self, code, exception):
+        ''' Records the failure of the cache with the given code and returns its item, or raises the exception. '''
+
+        if not self._journal:
+            raise exception
+        _logger.error('preparing cache %s failed: %s', code, exception)
+        with self._lock:
+            self._failures[code] = exception
+        self._journal.record(code, FAILED, error=str(exception))
+        return code, _FAILED
+
+    def check(self):
+        ''' Raises a CasprException naming the failed caches, if any. '''
+
+        if self._failures:
+            raise CasprException('{0} cache(s) failed, rerun the batch to retry them: {1}'.format(
+                len(self._failures), ', '.join('{0} ({1})'.format(code, exception)
+                                               for code, exception in self._failures.items())))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import math
+import numpy
+
+from caspr import formula
+from caspr.casprexception import CasprException
+
+# Brute forcing more unknown variables would require too much memory for the arrays of all digit combinations.
+MAX_UNKNOWNS = 7
+
+_LATITUDES = 'NS'
+_NEGATIVE = 'SW'
+
+# A part of a section of a coordinate dimension, where width is the number of digits it is written with at least.
+_Part = namedtuple('part', ['node', 'width'])
+
+
+class DimensionFormula:
+    '''
+    A coordinate dimension like |N| 47° AB.CDE as returned by FormulaConverter.extract_formulae, compiled for
+    evaluation with NumPy.
+
+    Like in the generated sheet, the results of the formulas of the degrees, minutes, and decimals are concatenated as
+    digits, e.g. 4 and 7 make 47. Unlike in the sheet, multi-digit variables and numbers keep their leading zeros, so
+    that AB with A=0 and B=5 is 05.
+    '''
+
+    def __init__(self, text, variables):
+        ''' Compiles the given dimension, where variables are the names of all variables which may occur in it. '''
+
+        if len(text) < 3 or text[1] not in formula.ORIENTATIONS:
+            raise CasprException('{0} is not a coordinate dimension'.format(text))
+        self.orientation = text[1]
+        sections = [[]]
+        for token in formula.FormulaLexer(variables).tokenize(text[3:], orientations=False):
+            if token.kind in (formula.DEGREE, formula.SEPARATOR):
+                sections.append([])
+            else:
+                sections[-1].append(token)
+        if len(sections) != 3:
+            raise CasprException('{0} does not consist of degrees, minutes, and decimals'.format(text))
+        self._sections = [DimensionFormula._compile_section(tokens, text) for tokens in sections]
+        self.variables = frozenset(variable for section in self._sections for part in section
+                                   for variable in _variables(part.node))
+
+    def evaluate(self, values):
+        '''
+        Returns the decimal degrees of the dimension for the given variable values.
+
+        The values map each variable to a number or an array of numbers, which are broadcast against each other.
+        Assignments resulting in an invalid dimension, e.g. with negative or fractional digits or with 60 or more
+        minutes, result in NaN.
+        '''
+
+        missing = self.variables - set(values)
+        if missing:
+            raise CasprException('missing values of variables {0}'.format(', '.join(sorted(missing))))
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            (degrees, _, degrees_valid), (minutes, _, minutes_valid), (decimals, width, decimals_valid) = (
+                DimensionFormula._evaluate_section(section, values) for section in self._sections)
+            limit = 90 if self.orientation in _LATITUDES else 180
+            valid = degrees_valid & minutes_valid & decimals_valid & (minutes < 60)
+            result = degrees + (minutes + decimals / 10.0 ** width) / 60
+            valid &= result <= limit
+            if self.orientation in _NEGATIVE:
+                result = -result
+            return numpy.where(valid, result, numpy.nan)
+
+    def bounds(self, ranges):
+        '''
+        Returns the lowest and the highest decimal degrees of the dimension, if each variable is within its inclusive
+        range (low, high), or None if no valid dimension is possible at all.
+
+        The bounds are not necessarily tight, but no valid dimension is outside of them.
+        '''
+
+        sections = [DimensionFormula._bound_section(section, ranges) for section in self._sections]
+        if None in sections:
+            return None
+        (degrees_low, degrees_high, _, _), (minutes_low, minutes_high, _, _), (decimals_low, decimals_high,
+                                                                               width_low, width_high) = sections
+        limit = 90 if self.orientation in _LATITUDES else 180
+        if minutes_low >= 60 or degrees_low > limit:
+            return None
+        minutes_high = min(minutes_high, 59)
+        if width_low == width_high:
+            fraction_low, fraction_high = decimals_low / 10.0 ** width_low, decimals_high / 10.0 ** width_high
+        else:  # the decimals are not monotonic anymore, e.g. 9 is .9 but 10 is .10
+            fraction_low, fraction_high = 0, 1
+        low = degrees_low + (minutes_low + fraction_low) / 60
+        high = min(degrees_high + (minutes_high + fraction_high) / 60, limit)
+        if self.orientation in _NEGATIVE:
+            return -high, -low
+        return low, high
+
+    @staticmethod
+    def _compile_section(tokens, text):
+        ''' Returns the parts of the degrees, minutes, or decimals, which are concatenated when evaluated. '''
+
+        try:
+            expressions = formula.parse_concatenation(tokens)
+        except CasprException as exception:
+            raise CasprException('cannot evaluate {0}: {1}'.format(text, exception))
+        if not expressions:
+            raise CasprException('missing degrees, minutes, or decimals in {0}'.format(text))
+        return [_Part(node=expression, width=_width(expression)) for expression in expressions]
+
+    @staticmethod
+    def _evaluate_section(parts, values):
+        ''' Returns the concatenated value, its number of digits, and whether the parts are valid digits. '''
+
+        value = numpy.zeros(())
+        width = numpy.zeros(())
+        valid = numpy.ones((), dtype=bool)
+        for part in parts:
+            result = numpy.asarray(evaluate(part.node, values), dtype=float)
+            digits = numpy.rint(result)
+            valid = valid & numpy.isfinite(result) & (result >= 0) & numpy.isclose(result, digits)
+            digits = numpy.where(valid, digits, 0)
+            part_width = numpy.maximum(part.width, numpy.floor(numpy.log10(numpy.maximum(digits, 1))) + 1)
+            value = value * 10.0 ** part_width + digits
+            width = width + part_width
+        return value, width, valid
+
+    @staticmethod
+    def _bound_section(parts, ranges):
+        '''
+        Returns the bounds of the concatenated value and of its number of digits as tuple (value low, value high,
+        width low, width high), or None if the parts cannot be valid digits.
+
+        Concatenating non-negative integers is monotonic, so that the bounds of the parts yield the bounds of the
+        concatenation.
+        '''
+
+        value_low, value_high, width_low, width_high = 0, 0, 0, 0
+        for part in parts:
+            low, high = bounds(part.node, ranges)
+            if low == math.inf:
+                return None
+            low = max(math.ceil(low), 0) if math.isfinite(low) else 0
+            high = math.floor(high) if math.isfinite(high) else math.inf
+            if low > high:
+                return None
+            part_width_low = max(part.width, _digit_count(low))
+            part_width_high = max(part.width, _digit_count(high))
+            value_low = value_low * 10 ** part_width_low + low
+            value_high = math.inf if math.isinf(high) else value_high * 10 ** part_width_high + high
+            width_low += part_width_low
+            width_high += part_width_high
+        return value_low, value_high, width_low, width_high
+
+
+class PositionFormula:
+    ''' The latitude and longitude of a coordinate, compiled for evaluation with NumPy. '''
+
+    def __init__(self, latitude, longitude):
+        ''' Initializes the position with the dimension formulas of latitude and longitude. '''
+
+        if latitude.orientation not in _LATITUDES or longitude.orientation in _LATITUDES:
+            raise CasprException('a position requires a latitude and a longitude')
+        self.latitude = latitude
+        self.longitude = longitude
+        self.variables = latitude.variables | longitude.variables
+
+    def evaluate(self, values):
+        ''' Returns the arrays of latitudes and longitudes for the given variable values. '''
+        return self.latitude.evaluate(values), self.longitude.evaluate(values)
+
+    def bounds(self, ranges):
+        '''
+        Returns the bounds ((latitude low, latitude high), (longitude low, longitude high)) of the position, if each
+        variable is within its inclusive range (low, high), or None if no valid position is possible at all.
+        '''
+
+        latitude = self.latitude.bounds(ranges)
+        longitude = self.longitude.bounds(ranges) if latitude else None
+        if not longitude:
+            return None
+        return latitude, longitude
+
+    def brute_force(self, known=None):
+        '''
+        Evaluates the position for all digit combinations of the variables which are not known.
+
+        Returns the values of the unknown variables as arrays of all 10^k combinations together with the arrays of the
+        resulting latitudes and longitudes.
+        '''
+
+        known = known or {}
+        unknowns = sorted(self.variables - set(known))
+        if len(unknowns) > MAX_UNKNOWNS:
+            raise CasprException('cannot brute force more than {0} unknown variables'.format(MAX_UNKNOWNS))
+        values = digit_combinations(unknowns)
+        latitudes, longitudes = self.evaluate(dict(known, **values))
+        size = 10 ** len(unknowns)
+        return values, numpy.broadcast_to(latitudes, size), numpy.broadcast_to(longitudes, size)
+
+
+def positions(formulae, variables):
+    '''
+    A generator returning a position formula for each latitude which is directly followed by a longitude in the
+    dimensions returned by FormulaConverter.extract_formulae.
+    '''
+
+    latitude = None
+    for text in formulae:
+        dimension = DimensionFormula(text, variables)
+        if dimension.orientation in _LATITUDES:
+            latitude = dimension
+        elif latitude:
+            yield PositionFormula(latitude, dimension)
+            latitude = None
+
+
+def digit_combinations(variables, ranges=None):
+    '''
+    Returns a dictionary mapping each variable to an array, such that the arrays hold all digit combinations.
+
+    The optional ranges map variables to inclusive ranges (low, high) to be used instead of all digits.
+    '''
+
+    if not variables:
+        return {}
+    ranges = ranges or {}
+    lows, highs = zip(*(ranges.get(variable, (0, 9)) for variable in variables))
+    grid = numpy.indices([high - low + 1 for low, high in zip(lows, highs)]).reshape(len(variables), -1)
+    return {variable: values + low for variable, values, low in zip(variables, grid, lows)}
+
+
+def evaluate(node, values):
+    ''' Returns the value of the given syntax tree of a formula for the variable values, which may be arrays. '''
+
+    kind = type(node)
+    if kind is formula.Formula:
+        return evaluate(node.expression, values)
+    if kind is formula.Number:
+        return float(node.text)
+    if kind is formula.Reference:
+        return values[node.variable]
+    if kind is formula.Digits:
+        power = len(node.variables) - 1
+        return sum(10 ** (power - index) * values[variable] for index, variable in enumerate(node.variables))
+    if kind is formula.Group:
+        return evaluate(node.expression, values)
+    if kind is formula.UnaryOperation:
+        operand = evaluate(node.operand, values)
+        return -operand if node.operator == '-' else operand
+    if kind is formula.BinaryOperation:
+        left = evaluate(node.left, values)
+        right = evaluate(node.right, values)
+        operator = formula.OPERATORS[node.operator]
+        if operator == '+':
+            return left + right
+        if operator == '-':
+            return left - right
+        if operator == '*':
+            return left * right
+        return numpy.true_divide(left, right)
+    raise CasprException('cannot evaluate {0}'.format(node))
+
+
+def bounds(node, ranges):
+    '''
+    Returns the bounds (low, high) of the value of the given syntax tree of a formula, if each variable is within its
+    inclusive range (low, high).
+    '''
+
+    kind = type(node)
+    if kind is formula.Formula or kind is formula.Group:
+        return bounds(node.expression, ranges)
+    if kind is formula.Number:
+        return float(node.text), float(node.text)
+    if kind is formula.Reference:
+        return ranges[node.variable]
+    if kind is formula.Digits:
+        power = len(node.variables) - 1
+        terms = [(10 ** (power - index) * ranges[variable][0], 10 ** (power - index) * ranges[variable][1])
+                 for index, variable in enumerate(node.variables)]
+        return sum(low for low, _ in terms), sum(high for _, high in terms)
+    if kind is formula.UnaryOperation:
+        low, high = bounds(node.operand, ranges)
+        return (-high, -low) if node.operator == '-' else (low, high)
+    if kind is formula.BinaryOperation:
+        (left_low, left_high), (right_low, right_high) = bounds(node.left, ranges), bounds(node.right, ranges)
+        operator = formula.OPERATORS[node.operator]
+        if operator == '+':
+            return left_low + right_low, left_high + right_high
+        if operator == '-':
+            return left_low - right_high, left_high - right_low
+        if operator == '/':
+            if right_low <= 0 <= right_high:
+                return -math.inf, math.inf
+            right_low, right_high = 1 / right_high, 1 / right_low
+        products = [left * right for left in (left_low, left_high) for right in (right_low, right_high)]
+        if any(math.isnan(product) for product in products):  # infinity times zero
+            return -math.inf, math.inf
+        return min(products), max(products)
+    raise CasprException('cannot bound {0}'.format(node))
+
+
+def _digit_count(value):
+    ''' Returns the number of digits of the given non-negative integer, which may be infinite. '''
+    return math.inf if math.isinf(value) else len(str(int(value)))
+
+
+def _width(node):
+    ''' Returns the number of digits the given formula is written with at least, keeping leading zeros. '''
+
+    if isinstance(node, formula.Number):
+        return len(node.text)
+    if isinstance(node, formula.Digits):
+        return len(node.variables)
+    return 1
+
+
+def _variables(node):
+    ''' A generator returning the names of all variables referenced by the given syntax tree. '''
+
+    if isinstance(node, formula.Reference):
+        yield node.variable
+    elif isinstance(node, formula.Digits):
+        yield from node.variables
+    else:
+        for child in node:
+            if isinstance(child, (tuple, list)):
+                yield from _variables(child)
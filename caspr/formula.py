@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from caspr.casprexception import CasprException
+
+
+# Token kinds
+ORIENTATION = 'orientation'
+DEGREE = 'degree'
+SEPARATOR = 'separator'
+VARIABLE = 'variable'
+NUMBER = 'number'
+OPEN = 'open'
+CLOSE = 'close'
+OPERATOR = 'operator'
+SPACE = 'space'
+TEXT = 'text'
+
+# Kinds of tokens a formula consists of.
+FORMULA_KINDS = frozenset([VARIABLE, NUMBER, OPEN, CLOSE, OPERATOR])
+
+Token = namedtuple('token', ['kind', 'text', 'start', 'end'])
+
+ORIENTATIONS = 'NSOEW'  # O is the German abbreviation for east
+_DEGREES = '°'
+_SEPARATORS = '.,'
+_DIGITS = '0123456789'
+_OPENING_BRACES = '([{'
+_CLOSING_BRACES = ')]}'
+_OPERATORS = '+-/*:x'  # ':' and 'x' are casual notations of division and multiplication
+_SPACES = ' \t'
+
+
+class FormulaLexer:
+    '''
+    Splits texts into the tokens of coordinate formulas like N 47° [A + 1].[B x 3] in a single pass.
+
+    As orientations are single letters, they cannot be distinguished from variables by looking at them alone. The
+    orientation of a coordinate dimension is the last orientation letter in front of the degree sign, which is followed
+    by at least one formula token. To find it, the lexer keeps the tokens since the last token which cannot be part of
+    a formula. As each token is looked at at most twice, the lexer runs in linear time regardless of the input.
+    '''
+
+    def __init__(self, variables):
+        ''' Initializes a lexer recognizing the given variable names. '''
+
+        self._variables = frozenset(variables)
+        self._kinds = {}
+        for characters, kind in ((_SPACES, SPACE), (_DEGREES, DEGREE), (_SEPARATORS, SEPARATOR), (_DIGITS, NUMBER),
+                                 (_OPENING_BRACES, OPEN), (_CLOSING_BRACES, CLOSE), (_OPERATORS, OPERATOR)):
+            self._kinds.update(dict.fromkeys(characters, kind))
+        self._kinds.update(dict.fromkeys(self._variables, VARIABLE))
+
+    def tokenize(self, text, orientations=True):
+        '''
+        Returns the list of tokens of the given text.
+
+        Consecutive digits, spaces, and other characters are merged into a single token, while all other tokens consist
+        of a single character. Unless orientations is False, the orientation letters of coordinate dimensions are
+        marked as ORIENTATION tokens.
+        '''
+
+        tokens = []
+        run_start = 0  # index of the first token which might be part of a formula in front of a degree sign
+        position = 0
+        length = len(text)
+        while position < length:
+            character = text[position]
+            kind = self._kinds.get(character, TEXT)
+            end = position + 1
+            if kind in (NUMBER, SPACE, TEXT):
+                # Orientation letters always start a token of their own, so that they can be marked later on.
+                while end < length and self._kinds.get(text[end], TEXT) == kind and text[end] not in ORIENTATIONS:
+                    end += 1
+            if kind == DEGREE and orientations:
+                self._mark_orientation(tokens, run_start)
+            tokens.append(Token(kind=kind, text=text[position:end], start=position, end=end))
+            if kind not in FORMULA_KINDS and kind != SPACE:
+                run_start = len(tokens)
+            position = end
+        return tokens
+
+    def dimensions(self, text):
+        '''
+        A generator returning the coordinate dimensions like N 47° [A + 1].[B x 3] found in the given text.
+
+        Each dimension is returned as tuple of the orientation token and the text following it up to the next token
+        which is neither part of a formula nor a space, e.g. the next orientation.
+        '''
+
+        tokens = self.tokenize(text)
+        index = 0
+        while index < len(tokens):
+            if tokens[index].kind != ORIENTATION:
+                index += 1
+                continue
+            orientation = tokens[index]
+            index += 1
+            while tokens[index].kind != DEGREE:  # guaranteed by the way orientations are marked
+                index += 1
+            index, minutes = FormulaLexer._skip_formula(tokens, index + 1)
+            if not minutes or index == len(tokens) or tokens[index].kind != SEPARATOR:
+                continue
+            index, decimals = FormulaLexer._skip_formula(tokens, index + 1)
+            if decimals:
+                yield orientation, text[orientation.end:tokens[index - 1].end]
+
+    def _mark_orientation(self, tokens, run_start):
+        ''' Marks the orientation of the dimension whose degree sign follows the given tokens, if there is one. '''
+
+        confirmed = None
+        pending = None
+        # The orientation is either the last token in front of the formula or a variable within the formula.
+        for index in range(max(run_start - 1, 0), len(tokens)):
+            token = tokens[index]
+            if token.kind in FORMULA_KINDS and index >= run_start:
+                if pending is not None:
+                    confirmed = pending
+                    pending = None
+            if token.text in ORIENTATIONS and token.kind in (VARIABLE, TEXT):
+                pending = index
+        if confirmed is not None:
+            tokens[confirmed] = tokens[confirmed]._replace(kind=ORIENTATION)
+
+    @staticmethod
+    def _skip_formula(tokens, index):
+        ''' Returns the index after the formula starting at index and whether there was a formula at all. '''
+
+        found = False
+        while index < len(tokens) and (tokens[index].kind in FORMULA_KINDS or tokens[index].kind == SPACE):
+            found = found or tokens[index].kind != SPACE
+            index += 1
+        return index, found
+
+
+def split(tokens):
+    '''
+    A generator returning the text of the given tokens as alternating literals and formulas.
+
+    Returns tuples (is_formula, text). A formula starts with a formula token and includes all following formula and
+    space tokens, while everything else is literal.
+    '''
+
+    literal = []
+    formula = []
+    for token in tokens:
+        if token.kind in FORMULA_KINDS or (formula and token.kind == SPACE):
+            if literal:
+                yield False, ''.join(literal)
+                literal = []
+            formula.append(token.text)
+        else:
+            if formula:
+                yield True, ''.join(formula)
+                formula = []
+            literal.append(token.text)
+    if literal:
+        yield False, ''.join(literal)
+    if formula:
+        yield True, ''.join(formula)
+
+
+# Nodes of the syntax tree of a formula. Each node keeps the spaces in front of it, so that the formula can be emitted
+# exactly as it was written apart from the variable references.
+Formula = namedtuple('formula', ['expression', 'space'])  # root, space is trailing
+Number = namedtuple('number', ['space', 'text'])
+Reference = namedtuple('reference', ['space', 'variable'])
+Digits = namedtuple('digits', ['space', 'variables'])  # multi-digit variables like AB meaning 10*A+B
+Literal = namedtuple('literal', ['space', 'text'])  # text without meaning in a formula, e.g. unknown variables
+UnaryOperation = namedtuple('unary_operation', ['space', 'operator', 'operand'])
+BinaryOperation = namedtuple('binary_operation', ['left', 'space', 'operator', 'right'])
+Group = namedtuple('group', ['space', 'open', 'expression', 'closing_space', 'close'])
+Sequence = namedtuple('sequence', ['items'])  # tokens which do not form a valid expression
+
+# Maps the operators to their mathematical meaning.
+OPERATORS = {'+': '+', '-': '-', '*': '*', '/': '/', 'x': '*', ':': '/'}
+_ADDITIVE = frozenset('+-')
+_MULTIPLICATIVE = frozenset('*/x:')
+
+
+def parse(tokens):
+    '''
+    Returns the syntax tree of the formula consisting of the given tokens.
+
+    Tokens which do not form a valid expression, e.g. because of unbalanced braces, are kept as Sequence of leaves, so
+    that they can still be emitted.
+    '''
+
+    parser = _Parser(tokens)
+    try:
+        expression = parser.expression()
+        space = parser.space()
+        if parser.peek() is not None:
+            raise CasprException('unexpected {0} in formula'.format(parser.peek().text))
+    except CasprException:
+        return Formula(expression=_parse_leaves(tokens), space='')
+    return Formula(expression=expression, space=space)
+
+
+def parse_concatenation(tokens):
+    '''
+    Returns the list of syntax trees of the formulas written next to each other without operator, e.g. 1 and (A+2) and
+    B in 1(A+2)B, which means that their digits are concatenated.
+
+    Raises a CasprException if the tokens do not consist of valid formulas.
+    '''
+
+    parser = _Parser(tokens)
+    expressions = []
+    while parser.peek() is not None:
+        expressions.append(parser.expression())
+    return expressions
+
+
+def _parse_leaves(tokens):
+    ''' Returns the tokens as a sequence of leaves, merging adjacent variables into digits. '''
+
+    items = []
+    space = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.kind == SPACE:
+            space.append(token.text)
+            index += 1
+            continue
+        if token.kind == VARIABLE:
+            index, leaf = _variables(tokens, index, ''.join(space))
+        else:
+            leaf = (Number if token.kind == NUMBER else Literal)(space=''.join(space), text=token.text)
+            index += 1
+        items.append(leaf)
+        space = []
+    if space:
+        items.append(Literal(space=''.join(space), text=''))
+    return Sequence(items=items)
+
+
+def _variables(tokens, index, space):
+    ''' Returns the index after the adjacent variables starting at index and their reference or digits node. '''
+
+    end = index + 1
+    while end < len(tokens) and tokens[end].kind == VARIABLE:
+        end += 1
+    if end - index == 1:
+        return end, Reference(space=space, variable=tokens[index].text)
+    return end, Digits(space=space, variables=tuple(token.text for token in tokens[index:end]))
+
+
+class _Parser:
+    ''' Recursive descent parser of formulas, where multiplications bind stronger than additions. '''
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._index = 0
+
+    def peek(self):
+        ''' Returns the next token which is not a space or None at the end. '''
+
+        index = self._index
+        while index < len(self._tokens) and self._tokens[index].kind == SPACE:
+            index += 1
+        return self._tokens[index] if index < len(self._tokens) else None
+
+    def space(self):
+        ''' Skips and returns the spaces in front of the next token. '''
+
+        start = self._index
+        while self._index < len(self._tokens) and self._tokens[self._index].kind == SPACE:
+            self._index += 1
+        return ''.join(token.text for token in self._tokens[start:self._index])
+
+    def expression(self):
+        return self._binary(self._term, _ADDITIVE)
+
+    def _term(self):
+        return self._binary(self._unary, _MULTIPLICATIVE)
+
+    def _binary(self, operand, operators):
+        left = operand()
+        while self._is_operator(operators):
+            space = self.space()
+            operator = self._next().text
+            left = BinaryOperation(left=left, space=space, operator=operator, right=operand())
+        return left
+
+    def _unary(self):
+        if self._is_operator(_ADDITIVE):
+            space = self.space()
+            return UnaryOperation(space=space, operator=self._next().text, operand=self._unary())
+        return self._primary()
+
+    def _primary(self):
+        space = self.space()
+        token = self.peek()
+        if token is None:
+            raise CasprException('unexpected end of formula')
+        if token.kind == NUMBER:
+            self._index += 1
+            return Number(space=space, text=token.text)
+        if token.kind == VARIABLE:
+            self._index, node = _variables(self._tokens, self._index, space)
+            return node
+        if token.kind == OPEN:
+            self._index += 1
+            expression = self.expression()
+            closing_space = self.space()
+            if self.peek() is None or self.peek().kind != CLOSE:
+                raise CasprException('missing closing brace in formula')
+            return Group(space=space, open=token.text, expression=expression, closing_space=closing_space,
+                         close=self._next().text)
+        raise CasprException('unexpected {0} in formula'.format(token.text))
+
+    def _is_operator(self, operators):
+        token = self.peek()
+        return token is not None and token.kind == OPERATOR and token.text in operators
+
+    def _next(self):
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
+
+
+def emit(node, reference):
+    '''
+    Returns the text of the given syntax tree, where variables are replaced by what the reference function returns.
+
+    Multi-digit variables are expanded, e.g. AB to (10*A+1*B). Variables for which reference returns None are kept.
+    '''
+
+    parts = []
+    _emit(node, reference, parts)
+    return ''.join(parts)
+
+
+def _emit(node, reference, parts):
+    kind = type(node)
+    if kind is Formula:
+        _emit(node.expression, reference, parts)
+        parts.append(node.space)
+    elif kind is Number or kind is Literal:
+        parts.extend((node.space, node.text))
+    elif kind is Reference:
+        parts.extend((node.space, _resolve(node.variable, reference)))
+    elif kind is Digits:
+        power = len(node.variables) - 1
+        parts.extend((node.space, '(', '+'.join('{0}*{1}'.format(10 ** (power - index), _resolve(variable, reference))
+                                                for index, variable in enumerate(node.variables)), ')'))
+    elif kind is UnaryOperation:
+        parts.extend((node.space, node.operator))
+        _emit(node.operand, reference, parts)
+    elif kind is BinaryOperation:
+        _emit(node.left, reference, parts)
+        parts.extend((node.space, node.operator))
+        _emit(node.right, reference, parts)
+    elif kind is Group:
+        parts.extend((node.space, node.open))
+        _emit(node.expression, reference, parts)
+        parts.extend((node.closing_space, node.close))
+    elif kind is Sequence:
+        for item in node.items:
+            _emit(item, reference, parts)
+    else:
+        raise CasprException('unknown formula node {0}'.format(node))
+
+
+def _resolve(variable, reference):
+    resolved = reference(variable)
+    return variable if resolved is None else resolved
+
+
+def to_a1(node, addresses, column='C'):
+    ''' Returns the formula as sheet formula in A1 notation, referencing the rows of the variables in the column. '''
+    return emit(node, _lookup(addresses, '{column}{row}', column))
+
+
+def to_r1c1(node, addresses, column=3):
+    ''' Returns the formula as sheet formula in R1C1 notation, referencing the rows of the variables in the column. '''
+    return emit(node, _lookup(addresses, 'R{row}C{column}', column))
+
+
+def _lookup(addresses, template, column):
+    ''' Returns a reference function formatting the addresses of known variables with the template. '''
+    return lambda variable: template.format(row=addresses[variable], column=column) if variable in addresses else None
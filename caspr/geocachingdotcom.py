@@ -1,39 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from lxml import html
+from lxml import etree, html
+import copy
+import json
+import os
 import re
-import requests
-import tempfile
+import time
 
 from caspr.casprexception import CasprException
+from caspr.page import Page, Validators
+from caspr.ratelimit import check_status, UNLIMITED
 from caspr.staticcoordinate import StaticCoordinate
 from caspr.stage import Stage, Task
 
 
+# Queries compiled once, as each page is queried the same way.
+_TITLE = etree.XPath("//title[position()=1]/text()")
+_POSITION = etree.XPath("//span[@id='uxLatLon']")
+_LONG_DESCRIPTION_PARAGRAPHS = etree.XPath("//span[@id='ctl00_ContentBody_LongDescription']//p")
+_WAYPOINT_ROWS = etree.XPath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr")
+_TEXTS = etree.XPath("text()")
+_BREAKS = etree.XPath(".//br")
+
+# The sections of a page used by PageParser by tag and id, apart from the title.
+_SECTIONS = {('span', 'uxLatLon'), ('span', 'ctl00_ContentBody_LongDescription'),
+             ('table', 'ctl00_ContentBody_Waypoints')}
+
+# Size of the parts a page is fed to the parser in when streaming.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def get_single_line_text(node):
+    ''' Returns the text of the given node including its children's texts as single line. '''
+
+    return ' '.join(c.strip() for c in node.itertext()).strip()
+
+
 def get_single_line_texts(nodes):
     ''' Returns the texts of the given nodes including their children's texts as single lines. '''
 
-    return list(filter(None, [' '.join(c.strip() for c in n.itertext()).strip() for n in nodes]))
+    return list(filter(None, [get_single_line_text(n) for n in nodes]))
 
 
 def flatten(iterables):
     return (item for sublist in iterables for item in sublist)
 
 
-def get_multi_line_texts(nodes):
-    ''' Returns the texts of the given nodes including their children's texts as multiple lines. '''
+def get_multi_line_text(node):
+    ''' Returns the text of the given node including its children's texts as multiple lines. '''
 
-    breaks = (n.xpath('.//br') for n in nodes)
-    breaks = flatten(breaks)
-    for br in breaks:
+    for br in _BREAKS(node):
         br.tail = '\n' + br.tail if br.tail else '\n'
-    texts = (n.text_content() for n in nodes)
-    texts = (t.strip() for t in texts)
-    texts = (re.sub(r'[ \t]*[\n\r]+[ \t]*', '\n', t) for t in texts)
-    texts = (text for text in texts if text.strip())
+    return re.sub(r'[ \t]*[\n\r]+[ \t]*', '\n', node.text_content().strip())
 
-    return list(filter(None, texts))
+
+def get_multi_line_texts(nodes):
+    ''' Returns the texts of the given nodes including their children's texts as multiple lines. '''
+
+    texts = (get_multi_line_text(n) for n in nodes)
+    return list(text for text in texts if text.strip())
 
 
 class GeocachingSite:
@@ -42,14 +68,29 @@ class GeocachingSite:
     _LOGIN_FAILED_MESSAGE = ("Uh oh. Either your username or password is incorrect. Please try again. If you've "
                              "forgotten your information")
 
-    def __init__(self, user, password):
-        ''' Initializes a session with the given credentials used by all following fetch() calls. '''
+    # A page only accessible when logged in, used to check whether restored session cookies are still valid.
+    _SESSION_CHECK_URL = 'https://www.geocaching.com/my/default.aspx'
 
-        self._prepare_session(user, password)
+    def __init__(self, user, password, cookie_file=None, limiter=None):
+        '''
+        Initializes a session with the given credentials used by all following fetch() calls.
+
+        If a cookie file is given, the session cookies of the last login are reused as long as they are valid, so that
+        logging in is only required once the session expired. Fetching is throttled and retried by the limiter, an
+        Endpoint of caspr.ratelimit, if given.
+        '''
+
+        self._cookie_file = cookie_file
+        self._limiter = limiter or UNLIMITED
+        if not self._restore_session(user):
+            self._prepare_session(user, password)
+            self._save_session(user)
 
     def _prepare_session(self, user, password):
         ''' Initializes an authentication session, so that following fetch() calls get the full page. '''
 
+        import requests  # only needed online, and it takes long to import
+
         login_page = requests.get('https://www.geocaching.com/login/default.aspx')
         login_root = html.fromstring(html=login_page.text)
         viewstate = login_root.xpath("//input[@name='__VIEWSTATE']")
@@ -70,15 +111,92 @@ class GeocachingSite:
             raise CasprException('Logging in to www.geocaching.com as {0} failed.'.format(user))
         self._session = session
 
+    def _restore_session(self, user):
+        ''' Restores the session of the last login of the given user and returns whether it is still valid. '''
+
+        if not self._cookie_file or not os.path.exists(self._cookie_file):
+            return False
+
+        import requests
+
+        session = requests.Session()
+        try:
+            with open(self._cookie_file) as file:
+                stored = json.load(file)
+            now = time.time()
+            if stored.get('user') != user or any(c['expires'] and c['expires'] < now for c in stored['cookies']):
+                return False
+            for cookie in stored['cookies']:
+                session.cookies.set(cookie['name'], cookie['value'],
+                                    domain=cookie['domain'],
+                                    path=cookie['path'],
+                                    expires=cookie['expires'],
+                                    secure=cookie['secure'])
+        except (ValueError, KeyError, TypeError, AttributeError):  # a broken cookie file requires a fresh login
+            return False
+        # Without a valid session the site redirects to the login page.
+        check = session.get(GeocachingSite._SESSION_CHECK_URL, allow_redirects=False)
+        if check.status_code != 200:
+            return False
+        self._session = session
+        return True
+
+    def _save_session(self, user):
+        ''' Stores the session cookies of the given user, so that the next start-up can skip logging in. '''
+
+        if not self._cookie_file:
+            return
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'expires': c.expires,
+                    'secure': c.secure} for c in self._session.cookies]
+        # The cookies grant access to the account, so keep them private.
+        descriptor = os.open(self._cookie_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(descriptor, 'w') as file:
+            json.dump({'user': user, 'cookies': cookies}, file)
+
+    def cookies(self):
+        ''' Returns the cookies {name: value} of the session, e.g. to fetch pages with AsyncGeocachingSite. '''
+
+        return {cookie.name: cookie.value for cookie in self._session.cookies}
+
     def fetch(self, code):
-        ''' Returns the page text of the geocache with the given code. '''
+        ''' Returns the page of the geocache with the given code. '''
+
+        page, _ = self.fetch_if_modified(code=code)
+        return page
+
+    def fetch_if_modified(self, code, etag=None, last_modified=None):
+        '''
+        Returns the page of the geocache with the given code and its validators.
+
+        If the validators of a previously fetched page are passed and the page did not change since, None is returned
+        instead of the page.
+        '''
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
 
-        page = self._session.get('http://www.geocaching.com/geocache/{0}'.format(code))
-        # TODO(KNR): why the heck does it not work when passing page.text to the lxml.html parser?!
-        #            Probably some encoding issue
-        with tempfile.NamedTemporaryFile(delete=False) as file:
-            file.write(bytes(page.text, 'UTF-8'))
-            return file.name
+        def get():
+            response = self._session.get('http://www.geocaching.com/geocache/{0}'.format(code), headers=headers)
+            check_status(response.status_code, retry_after=response.headers.get('Retry-After'))
+            return response
+
+        response = self._limiter.call(get)
+        validators = Validators(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+        if response.status_code == 304:
+            return None, validators
+        return Page(content=response.content, encoding=GeocachingSite._get_encoding(response)), validators
+
+    @staticmethod
+    def _get_encoding(response):
+        ''' Returns the encoding declared in the response header or None to let the parser detect it. '''
+
+        # Without a declared charset requests falls back to ISO-8859-1, which breaks UTF-8 pages.
+        if 'charset' not in response.headers.get('Content-Type', ''):
+            return None
+        return response.encoding
 
 
 class DescriptionParser:
@@ -93,14 +211,13 @@ class DescriptionParser:
     def parse(self, description):
         ''' Parses the given description and returns an iterable list of tasks. '''
 
-        self._description = description
-        return self._generator()
+        return self._generator(description)
 
-    def _generator(self):
+    def _generator(self, description):
         ''' A generator returning tasks created from the parsed description. '''
 
         variables = ''
-        items = filter(None, self._assignment_re.split(self._description))
+        items = filter(None, self._assignment_re.split(description))
         for item in items:
             if self._assignment_re.match(item):
                 variables = item.replace('=', '').strip()
@@ -112,24 +229,35 @@ class DescriptionParser:
 class TableParser:
     ''' Parses the table of a geocache page. '''
 
+    # Each waypoint row has a cell per column and is followed by a row holding the note of the waypoint.
+    _NAME_COLUMN = 5
+    _COORDINATES_COLUMN = 6
+    _NOTE_COLUMN = 2
+
     def parse(self, root):
         '''
         Returns an iterable list of stage data.
 
-        input can be either a filename or an URL of the page to be parsed.
+        root is the root element of the parsed page, whose waypoint table is walked row by row, so that the name,
+        coordinates, and description of a waypoint stay together even if one of them is empty.
         '''
 
-        stage_name_nodes = root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[position()=6]")
-        self._names = get_single_line_texts(stage_name_nodes)
-        self._coordinates = root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[position()=7]/text()")
-        description_nodes = root.xpath("//table[@id='ctl00_ContentBody_Waypoints']/tbody/tr/td[position()=3]")
-        self._descriptions = get_multi_line_texts(description_nodes)
-        return self._generator()
-
-    def _generator(self):
-        ''' A generator returning a dictionary created from the parsed page data. '''
-
-        for name, coordinates, description in zip(self._names, self._coordinates, self._descriptions):
+        names, coordinates, descriptions = [], [], []
+        for row in _WAYPOINT_ROWS(root):
+            # only the needed cells are accessed, as lxml creates an object for each accessed element
+            if len(row) > TableParser._COORDINATES_COLUMN:
+                names.append(get_single_line_text(row[TableParser._NAME_COLUMN]))
+                coordinates.append(''.join(_TEXTS(row[TableParser._COORDINATES_COLUMN])))
+                descriptions.append('')
+            elif len(row) > TableParser._NOTE_COLUMN and names:
+                descriptions[-1] = get_multi_line_text(row[TableParser._NOTE_COLUMN])
+        return TableParser._generate(names=names, coordinates=coordinates, descriptions=descriptions)
+
+    @staticmethod
+    def _generate(names, coordinates, descriptions):
+        ''' A generator returning a dictionary created from the given page data. '''
+
+        for name, coordinates, description in zip(names, coordinates, descriptions):
             yield {
                 'name': name.strip(),
                 'coordinates': StaticCoordinate.match(coordinates),
@@ -146,31 +274,114 @@ class PageParser:
     Later on will be able to parse the text section, and even to combine the text and table results.
     '''
 
-    def __init__(self, table_parser, description_parser):
-        ''' Initializes a new object as empty and links it to the given sub-parsers. '''
+    def __init__(self, table_parser, description_parser, streaming=False):
+        '''
+        Initializes a new object as empty and links it to the given sub-parsers.
+
+        If streaming is set, pages are parsed incrementally and only the sections used by the parser are kept, instead
+        of building the tree of the entire page with its logs, scripts, and ads.
+        '''
 
         self._table_parser = table_parser
         self._description_parser = description_parser
+        self._streaming = streaming
         self._stages = iter([])
 
     def parse(self, page):
         '''
         Returns a generator to iterate over all stages.
 
-        page can be either a filename or an URL of the page to be parsed.
+        page can be either a fetched Page, or a filename or an URL of the page to be parsed.
         '''
 
         # TODO(KNR): does defusedxml also work?
-        root = html.parse(filename_or_url=page).getroot()  # Apparently lxml.html does not provide iterparse().
-        description_nodes = root.xpath("//span[@id='ctl00_ContentBody_LongDescription']//p")
-        self._description = '\n'.join(get_multi_line_texts(description_nodes))
-        pos_nodes = root.xpath("//span[@id='uxLatLon']")
-        self._position = pos_nodes[0].text_content().strip()
-        cache_name_nodes = root.xpath("//title[position()=1]/text()")
-        self._name = cache_name_nodes[0].strip() or ''
-
-        self._stages = self._table_parser.parse(root=root)
-        return {'name': self._name, 'stages': self._generator()}
+        # Keep the per-page state on a copy, so that a single parser can serve several threads.
+        parser = copy.copy(self)
+        root = PageParser._stream_root(page) if self._streaming else PageParser._get_root(page)
+        parser._description = '\n'.join(get_multi_line_texts(_LONG_DESCRIPTION_PARAGRAPHS(root)))
+        pos_nodes = _POSITION(root)
+        parser._position = pos_nodes[0].text_content().strip() if pos_nodes else None
+        cache_name_nodes = _TITLE(root)
+        parser._name = cache_name_nodes[0].strip() if cache_name_nodes else ''
+
+        parser._stages = self._table_parser.parse(root=root)
+        return {'name': parser._name, 'stages': parser._generator()}
+
+    @staticmethod
+    def _get_root(page):
+        ''' Returns the root element of the given page. '''
+
+        if isinstance(page, Page):
+            parser = html.HTMLParser(encoding=page.encoding)
+            return html.document_fromstring(page.content, parser=parser)
+        return html.parse(filename_or_url=page).getroot()  # Apparently lxml.html does not provide iterparse().
+
+    @staticmethod
+    def _stream_root(page):
+        '''
+        Returns the root element of a document holding only the title and the sections of the given page.
+
+        The page is fed to the parser in chunks. Each section is moved to the document once it is complete, while all
+        other complete elements are dropped after each chunk, so that the tree of the entire page never exists. Pages
+        neither fetched nor stored in a file, i.e. URLs, are parsed entirely.
+        '''
+
+        if isinstance(page, Page):
+            chunks = (page.content[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(page.content), STREAM_CHUNK_SIZE))
+            encoding = page.encoding
+        elif os.path.isfile(page):
+            chunks = PageParser._read_chunks(page)
+            encoding = None
+        else:
+            return PageParser._get_root(page)
+
+        root = html.Element('html')
+        head = etree.SubElement(root, 'head')
+        body = etree.SubElement(root, 'body')
+        parser = etree.HTMLPullParser(events=('end',), tag=('title', 'span', 'table'), encoding=encoding)
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+        page_root = None
+        has_title = False
+        for chunk in chunks:
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                page_root = element.getroottree().getroot()
+                is_title = element.tag == 'title' and not has_title
+                if not is_title and not PageParser._is_section(element):
+                    continue
+                has_title = has_title or is_title
+                # sections within sections stay where they are, as they are part of the outer section's content
+                if not any(PageParser._is_section(ancestor) for ancestor in element.iterancestors()):
+                    (head if is_title else body).append(element)
+            if page_root is not None:
+                PageParser._prune(page_root)
+        parser.close()
+        return root
+
+    @staticmethod
+    def _read_chunks(path):
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b''):
+                yield chunk
+
+    @staticmethod
+    def _is_section(element):
+        return (element.tag, element.get('id')) in _SECTIONS
+
+    @staticmethod
+    def _prune(root):
+        '''
+        Removes all complete elements of the partially parsed page, which are all but the last child of each element
+        on the path to the element currently parsed.
+
+        Sections are moved out of the page once they are complete, so only the content of an incomplete section must
+        be kept.
+        '''
+
+        element = root
+        while len(element) and not PageParser._is_section(element):
+            del element[:-1]
+            element = element[-1]
 
     def _generator(self):
         ''' A generator returning stages created from the parsed page data. '''
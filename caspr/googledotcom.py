@@ -1,22 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from apiclient import discovery
-from oauth2client import client
-from oauth2client import tools
-import gspread
-import httplib2
-import oauth2client
-import oauth2client.file
+import functools
+import json
+import logging
 import os
-import re
+import threading
 
+from caspr import formula as formula_syntax
 from caspr.casprexception import CasprException
+from caspr.gridstore import digest
+from caspr.ratelimit import check_status, UNLIMITED
 from caspr.staticcoordinate import StaticCoordinate
 
 # NOTE: when changing the scope delete ~/.caspr/drive.json
 SCOPES = "https://docs.google.com/feeds/ https://docs.googleusercontent.com/ https://spreadsheets.google.com/feeds/"
 APPLICATION_NAME = 'caspr'
+# Very large sheets are written in several calls to keep the size of a single request reasonable.
+MAX_ROWS_PER_CALL = 500
+# Empty rows and columns added to each new sheet, e.g. for own calculations. Small sheets keep the Sheets apps fast.
+HEADROOM_ROWS = 20
+HEADROOM_COLUMNS = 2
+# Number of variable sets whose formula lexer is kept.
+PATTERN_CACHE_SIZE = 64
+
+# The Google client libraries take most of the start-up time, so they are only imported when connecting. Building the
+# Drive client needs no request, as the client library ships the discovery document of the Drive API.
+_CASPR_DIRECTORY = os.path.join(os.path.expanduser('~'), '.caspr')  # TODO(KNR): is this portable to Windows?
+
+_logger = logging.getLogger(__name__)
 
 
 class FormulaConverter:
@@ -26,60 +38,19 @@ class FormulaConverter:
     Currently only supports WGS84 with floating point minutes in EN or DE.
     '''
 
-    _WS = '[ \t]'
-    _OPENING_BRACES = '[([{]'
-    _CLOSING_BRACES = '[)\]}]'
-    _BRACES = '{opening}|{closing}'.format(opening=_OPENING_BRACES, closing=_CLOSING_BRACES)
-    _MATH_OPS = '[+\-/*]'  # Note: escape '-', otherwise it would be a character range!
-    _CASUAL_MATH_OPS = '[:x]'
-    # Beware: as the variables are only known at runtime need to format them before using _FORMULA
-    _FORMULA = ('((?:\d|{braces}|{math_ops}|{casual_math_ops}|{variables})'
-                '(?:{ws}|\d|{braces}|{math_ops}|{casual_math_ops}|{variables})+)')
-    _ORIENTATION = '[NSOE]'  # TODO(KNR): a bit sloppy to accept all 4 orientations independet of longitude/lattitude
-    _DEGREE = '[°]'
-    _DECIMAL_SEPARATOR = '[.,]'
-    _MASK = '({orientation})({ws}*{formula}{ws}*{degree})'
-    _FIX_MASK = '[|]({orientation})[|](?!{ws}*{formula}{ws}*{degree})'
-    # Beware: as the variables are only known at runtime need to format them before using _DYNAMIC_DIMENSION
-    # Note: would like to replace last '*' by '{0,2}', but this results in a key error...
-    _DYNAMIC_DIMENSION = (
-        '[|]{orientation}[|]{ws}*{formula}{ws}*{degree}{ws}*{formula}{ws}*(?:{formula}{ws}*)?{separator}'
-        '{ws}*{formula}(?:{ws}*{formula})*')
-    _DYNAMIC_COORDINATE = (
-        '[|]{orientation}[|]{ws}*{formula}{ws}*{degree}{ws}*{formula}{ws}*(?:{formula}{ws}*)?{separator}'
-        '{ws}*{formula}{ws}*(?:{formula}{ws}*)*[|]{orientation}[|]{ws}*{formula}{ws}*{degree}{ws}*'
-        '{formula}{ws}*(?:{formula}{ws}*)?{separator}{ws}*{formula}{ws}*(?:{formula}{ws}*)*')
-    _DYNAMIC_POSITION = '({dimension})({dimension})?'.format(dimension=_DYNAMIC_DIMENSION)
-
     def __init__(self, variable_addresses):
         ''' Initializes a formula converter with the variable addresses to be found in the formulas. '''
 
-        if not variable_addresses:  # otherwise _FORMULA cannot be properly compiled
+        if not variable_addresses:  # otherwise there is nothing to resolve formulas with
             raise CasprException('variable addresses dictionary must not be empty')
 
         self._variable_addresses = variable_addresses
-        formula = FormulaConverter._FORMULA.format(
-            ws=FormulaConverter._WS,
-            braces=FormulaConverter._BRACES,
-            math_ops=FormulaConverter._MATH_OPS,
-            casual_math_ops=FormulaConverter._CASUAL_MATH_OPS,
-            variables='[{0}]'.format(''.join(self._variable_addresses.keys())))
-        self._formula_re = re.compile(formula)
-        self._dynamic_dimension = FormulaConverter._DYNAMIC_DIMENSION.format(
-            ws=FormulaConverter._WS,
-            orientation=FormulaConverter._ORIENTATION,
-            formula=formula,
-            degree=FormulaConverter._DEGREE,
-            separator=FormulaConverter._DECIMAL_SEPARATOR)
-        self._dynamic_dimension_re = re.compile(self._dynamic_dimension)
-        self._mask_re = re.compile(FormulaConverter._MASK.format(ws=FormulaConverter._WS,
-                                                                 orientation=FormulaConverter._ORIENTATION,
-                                                                 formula=formula,
-                                                                 degree=FormulaConverter._DEGREE))
-        self._fix_mask_re = re.compile(FormulaConverter._FIX_MASK.format(ws=FormulaConverter._WS,
-                                                                         orientation=FormulaConverter._ORIENTATION,
-                                                                         formula=formula,
-                                                                         degree=FormulaConverter._DEGREE))
+        self._lexer = _create_lexer(frozenset(variable_addresses.keys()))
+
+    @staticmethod
+    def cache_info():
+        ''' Returns the hits and misses of the cache of lexers shared by all converters. '''
+        return _create_lexer.cache_info()
 
     def extract_formulae(self, description):
         '''
@@ -89,39 +60,20 @@ class FormulaConverter:
         assert 'x' not in self._variable_addresses, "'x' as variable name is currently not supported"
 
         description = StaticCoordinate.filter(description)
-        description = self._mask_orientation(description)
 
-        for match in re.finditer(self._dynamic_dimension_re, string=description):
-            normalized_coordinates = self._normalize(match.group())
-            yield normalized_coordinates
+        for orientation, dimension in self._lexer.dimensions(description):
+            yield self._normalize('|{0}|{1}'.format(orientation.text, dimension))
 
     def get_orientation(self, formula):
-        assert formula[1] in FormulaConverter._ORIENTATION
+        assert formula[1] in formula_syntax.ORIENTATIONS
         return formula[1]
 
     def split(self, formula):
-        for group in self._formula_re.split(formula[3:]):
-            if group:
-                if self._formula_re.match(group):
-                    yield self._resolve_formula(text=group)
-                else:
-                    yield '"{0}"'.format(group)
-
-    def _mask_orientation(self, description):
-        '''
-        Hack to mask the orientation, e.g. replacing N by |N|.
-
-        Required to:
-        - properly terminate combined lattitude & longitude.
-        - avoid accidental replacement of orientation if there are descriptions with names like orientations (e.g. N or E).
-        '''
-
-        # TODO(KNR): there has to be a simpler way, this is really cheesy
-        # Repeat masking to cover concatenated lattitude and longitude.
-        # Because the lattitude might contain a variable named like an orientation the mask is possibly inserted at a
-        # wrong place. That's why we need to remove all wrong masks again.
-        return re.sub(self._fix_mask_re, r'\1', re.sub(self._mask_re, r'|\1|\2', re.sub(self._mask_re, r'|\1|\2',
-                                                                                        description)))
+        for is_formula, text in formula_syntax.split(self._lexer.tokenize(formula[3:], orientations=False)):
+            if is_formula:
+                yield self._resolve_formula(text=text)
+            else:
+                yield '"{0}"'.format(text)
 
     def _normalize(self, text):
         ''' Cleans the given text from all characters screwing up Google Docs Sheet formulas. '''
@@ -149,35 +101,62 @@ class FormulaConverter:
         if not text:
             return ''
 
-        # Resolve multi-digit descriptions like AB to (10*A+B).
-        text = self._replace_multi_digit_descriptions(text=text)
-
-        # Special treatment for 'C', as we need it to reference other cells.
-        # TODO(KNR): can be avoided when using addressing scheme R1C1
-        if 'C' in self._variable_addresses:
-            text = text.replace('C', 'C{0}'.format(self._variable_addresses['C']))
-
-        # References for all other descriptions.
-        for variable, index in self._variable_addresses.items():
-            if variable != 'C':  # TODO(KNR): can be avoided when using addressing scheme R1C1
-                text = text.replace(variable, 'C{0}'.format(index))
-        return '{0}'.format(text)
-
-    def _replace_multi_digit_descriptions(self, text):
-        ''' Resolve multi-digit descriptions like AB to (10*A+B). '''
-
-        multi_digits = re.compile('([{alternatives}][{alternatives}]+)'.format(
-            alternatives=''.join(self._variable_addresses.keys())))
-        for match in re.findall(pattern=multi_digits, string=text):
-            resolved = '('
-            max_power = len(match) - 1
-            for index, variable in enumerate(match):
-                if index > 0:
-                    resolved += '+'
-                resolved += '{0}*{1}'.format(10 ** (max_power - index), variable)
-            resolved += ')'
-            text = text.replace(match, resolved)
-        return text
+        syntax_tree = formula_syntax.parse(self._lexer.tokenize(text, orientations=False))
+        return formula_syntax.to_a1(syntax_tree, self._variable_addresses)
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _create_lexer(variables):
+    ''' Creates the formula lexer of a formula converter for the given frozen set of variables. '''
+    return formula_syntax.FormulaLexer(variables)
+
+
+class SheetIndex:
+    '''
+    Keeps the IDs of the spreadsheets by their names in a JSON file.
+
+    Opening a spreadsheet by its ID is a single request, while opening it by its name lists all spreadsheets of the
+    account, which gets slower with each cache prepared.
+    '''
+
+    def __init__(self, path):
+        ''' Initializes the index stored in the given file, which is created when the first ID is added. '''
+
+        self._path = path
+        self._lock = threading.Lock()  # the sheets of several caches may be published concurrently
+        try:
+            with open(path) as file:
+                self._ids = json.load(file)
+        except (OSError, ValueError):  # a missing or broken index is rebuilt on the fly
+            self._ids = {}
+
+    def get(self, name):
+        ''' Returns the ID of the spreadsheet with the given name, or None if unknown. '''
+
+        with self._lock:
+            return self._ids.get(name)
+
+    def put(self, name, key):
+        ''' Stores the ID of the spreadsheet with the given name. '''
+
+        with self._lock:
+            if self._ids.get(name) != key:
+                self._ids[name] = key
+                self._save()
+
+    def remove(self, name):
+        ''' Forgets the ID of the spreadsheet with the given name, e.g. because it is stale. '''
+
+        with self._lock:
+            if self._ids.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self._path, 'w') as file:
+            json.dump(self._ids, file)
 
 
 class WorksheetFactory:
@@ -185,16 +164,51 @@ class WorksheetFactory:
     Sets up a connection to Google Drive and provides a worksheet factory.
     '''
 
-    def __init__(self, keyfile):
-        ''' Authenticates with Google. '''
-
-        self._credentials = WorksheetFactory._get_credentials(keyfile)
-        self._http = self._credentials.authorize(httplib2.Http())
-        self._service = discovery.build('drive', 'v2', http=self._http)
-        self._spreadsheets = gspread.authorize(self._credentials)
+    # The store of the cells last published to each sheet, which allows to publish only the changed cells.
+    grid_store = None
+    # The IDs of the spreadsheets by name, which allows to open them without listing all spreadsheets.
+    sheet_index = None
+    # The Endpoint of caspr.ratelimit throttling and retrying the writes to the sheets.
+    limiter = None
+    # The gspread client, set when connected.
+    _spreadsheets = None
+    # Serialises the calls of the Drive client, as its httplib2.Http is not thread-safe.
+    _drive_lock = threading.Lock()
+
+    def __init__(self, keyfile, grid_store=None, sheet_index=None, limiter=None):
+        '''
+        Prepares the connection to Google, which is only established by connect() or when the first sheet is needed,
+        and keeps the cells of the published sheets in grid_store and the IDs of the spreadsheets in sheet_index if
+        given. The writes to the sheets are throttled and retried by the limiter if given.
+        '''
 
-    def create(self, name):
-        ''' Either returns the sheet for the given name or creates one if not found. '''
+        self.grid_store = grid_store
+        self.sheet_index = sheet_index
+        self.limiter = limiter
+        self._keyfile = keyfile
+        self._connect_lock = threading.Lock()  # the sheets of several caches may be published concurrently
+
+    def connect(self):
+        ''' Authenticates with Google and builds the clients, unless already done. '''
+
+        if self._spreadsheets is not None:
+            return
+        with self._connect_lock:
+            if self._spreadsheets is not None:
+                return
+            from apiclient import discovery
+            import gspread
+            import httplib2
+
+            credentials = WorksheetFactory._get_credentials(self._keyfile)
+            self._http = credentials.authorize(httplib2.Http())
+            self._service = discovery.build('drive', 'v2', http=self._http)
+            self._spreadsheets = gspread.authorize(credentials)
+
+    def create(self, name, rows=1000, columns=26):
+        ''' Either returns the sheet for the given name or creates one if not found, with the given size. '''
+
+        self.connect()
         worksheet = self._get_sheet(name=name)
         if not worksheet:
             worksheet = self._create_new_sheet(name=name)
@@ -202,23 +216,54 @@ class WorksheetFactory:
         # TODO(KNR): Don't know how to rename and Google API rejects adding a sheet with the same name
         #            (even ignoring case).
         sheet_name = ('calculations02' if worksheet.sheet1.title == 'calculations01' else 'calculations01')
-        sheet = worksheet.add_worksheet(title=sheet_name, rows=1000, cols=26)
+        sheet = worksheet.add_worksheet(title=sheet_name, rows=rows, cols=columns)
         worksheet.del_worksheet(old_sheet)
         return sheet
 
+    def open(self, name):
+        ''' Returns the sheet last created for the given name, or None if not found. '''
+
+        self.connect()
+        worksheet = self._get_sheet(name=name)
+        return worksheet.sheet1 if worksheet else None
+
     def _get_sheet(self, name):
-        ''' Either returns the sheet for the given name or None if not found. '''
+        '''
+        Either returns the sheet for the given name or None if not found.
 
+        The sheet is opened by its ID if the index knows it, so that all spreadsheets are only listed for sheets not
+        known yet or whose ID is stale, e.g. because the sheet was deleted or renamed.
+        '''
+
+        import gspread
+
+        index = self.sheet_index
+        key = index.get(name) if index else None
+        if key:
+            try:
+                spreadsheet = self._spreadsheets.open_by_key(key)
+                if spreadsheet.title == name:
+                    return spreadsheet
+            except (gspread.SpreadsheetNotFound, PermissionError):
+                pass
+            _logger.info('ID of sheet %s is stale', name)
+            index.remove(name)
         try:
-            return self._spreadsheets.open(name)
+            spreadsheet = self._spreadsheets.open(name)
         except gspread.SpreadsheetNotFound:
             return None
+        if index:
+            index.put(name, spreadsheet.id)
+        return spreadsheet
 
     def _create_new_sheet(self, name):
         ''' Creates a new sheet and returns it. '''
 
         body = {'mimeType': 'application/vnd.google-apps.spreadsheet', 'title': name}
-        self._service.files().insert(body=body).execute(http=self._http)
+        with self._drive_lock:
+            created = self._service.files().insert(body=body).execute(http=self._http)
+        if self.sheet_index and created.get('id'):
+            self.sheet_index.put(name, created['id'])
         return self._get_sheet(name=name)
 
     @staticmethod
@@ -233,11 +278,13 @@ class WorksheetFactory:
             Credentials, the obtained credential.
         '''
 
-        home_dir = os.path.expanduser('~')  # TODO(KNR): is this portable to Windows?
-        credential_dir = os.path.join(home_dir, '.caspr')  # TODO(KNR): is this portable to Windows?
-        if not os.path.exists(credential_dir):
-            os.makedirs(credential_dir)
-        credential_path = os.path.join(credential_dir, 'drive.json')
+        from oauth2client import client
+        from oauth2client import tools
+        import oauth2client.file
+
+        if not os.path.exists(_CASPR_DIRECTORY):
+            os.makedirs(_CASPR_DIRECTORY)
+        credential_path = os.path.join(_CASPR_DIRECTORY, 'drive.json')
 
         store = oauth2client.file.Storage(credential_path)
         credentials = store.get()
@@ -249,16 +296,134 @@ class WorksheetFactory:
         return credentials
 
 
-def publish_as_sheet(name, rows, factory):
+def publish_as_sheet(name, rows, factory, max_rows=MAX_ROWS_PER_CALL):
     '''
     Generate a Google Docs Sheet from a cell list.
 
     Takes a list of rows, where each row is a list of cells and the position is encoded as row and column index,
     and publishes the cell content to a Google Docs Sheet created by the factory.
+
+    Instead of updating cell by cell, the rows are padded to a rectangular range, which is written in a single call
+    or in chunks of max_rows rows for very large sheets. Returns the number of write calls.
+
+    If the factory has a grid store knowing the cells last published to the sheet, only the blocks of rows with
+    changed cells are written to the existing sheet, and Google is not contacted at all if no cell changed.
+
+    New sheets are sized to the rows plus some headroom. Existing sheets grow when the rows do not fit anymore.
+
+    If the factory has a limiter, the writes are throttled by it and retried when Google answers with 429 or 5xx.
+    '''
+
+    grid = _to_grid(rows)
+    limiter = factory.limiter or UNLIMITED
+    store = factory.grid_store
+    published = store.get(name) if store else None
+    if published and published.digest == digest(grid):
+        _logger.info('sheet %s is unchanged', name)
+        return 0
+    sheet = factory.open(name=name) if published else None
+    if sheet:
+        blocks = _changed_blocks(published.grid, grid)
+    else:
+        sheet = factory.create(name=name, rows=len(grid) + HEADROOM_ROWS,
+                               columns=(len(grid[0]) if grid else 0) + HEADROOM_COLUMNS)
+        blocks = [(1, 1, grid)] if grid else []
+    if store:
+        store.remove(name)  # unknown until written completely
+    calls = 0
+    for first_row, first_column, cells in blocks:
+        for offset in range(0, len(cells), max_rows):
+            chunk = cells[offset:offset + max_rows]
+            _grow(sheet, rows=first_row + offset + len(chunk) - 1, columns=first_column + len(chunk[0]) - 1,
+                  limiter=limiter)
+            _throttled(limiter, sheet.update,
+                       range_name=_to_range(first_row=first_row + offset, rows=len(chunk), columns=len(chunk[0]),
+                                            first_column=first_column),
+                       values=chunk,
+                       raw=False)  # let Google interpret the formulas
+            calls += 1
+    if store:
+        store.put(name, grid)
+    _logger.info('published sheet %s in %d call(s)', name, calls)
+    return calls
+
+
+def _to_grid(rows):
+    ''' Returns the rows as list of equally long lists, where empty cells are represented by empty strings. '''
+
+    grid = [[value or '' for value in columns] for columns in rows]
+    width = max((len(columns) for columns in grid), default=0)
+    return [columns + [''] * (width - len(columns)) for columns in grid]
+
+
+def _grow(sheet, rows, columns, limiter=UNLIMITED):
+    ''' Adds rows and columns to the sheet as far as required to hold the given number of rows and columns. '''
+
+    if rows > sheet.row_count:
+        _throttled(limiter, sheet.add_rows, rows - sheet.row_count + HEADROOM_ROWS, idempotent=False)
+    if columns > sheet.col_count:
+        _throttled(limiter, sheet.add_cols, columns - sheet.col_count + HEADROOM_COLUMNS, idempotent=False)
+
+
+def _throttled(limiter, function, *args, idempotent=True, **kwargs):
+    '''
+    Calls the gspread function by the limiter, which retries calls Google answered with 429 or 5xx.
+
+    Calls which are not idempotent, like adding rows, are only retried if throttled (429), as Google may have applied
+    a call answered with 5xx.
+    '''
+
+    import gspread
+
+    def call():
+        try:
+            return function(*args, **kwargs)
+        except gspread.exceptions.APIError as error:
+            if idempotent or error.response.status_code == 429:
+                check_status(error.response.status_code, retry_after=error.response.headers.get('Retry-After'))
+            raise
+
+    return limiter.call(call)
+
+
+def _changed_blocks(previous, grid):
+    '''
+    Returns the tuples (first row, first column, cells) of the blocks of consecutive rows with changed cells.
+
+    Each block spans the columns from the first to the last changed cell of its rows. Cells only contained in the
+    previous grid are cleared.
     '''
 
-    sheet = factory.create(name=name)
-    for row, columns in enumerate(rows):
-        for column, value in enumerate(columns):
-            if value:
-                sheet.update_cell(row=row + 1, col=column + 1, val=value)
+    width = max(len(previous[0]) if previous else 0, len(grid[0]) if grid else 0)
+    height = max(len(previous), len(grid))
+
+    def row_of(rows, index):
+        row = rows[index] if index < len(rows) else []
+        return row + [''] * (width - len(row))
+
+    blocks = []
+    block = None  # first row, first changed column, last changed column, rows
+    for index in range(height):
+        old, new = row_of(previous, index), row_of(grid, index)
+        changed = [column for column in range(width) if old[column] != new[column]]
+        if not changed:
+            if block:
+                blocks.append(block)
+            block = None
+            continue
+        if block is None:
+            block = [index, changed[0], changed[-1], []]
+        block[1], block[2] = min(block[1], changed[0]), max(block[2], changed[-1])
+        block[3].append(new)
+    if block:
+        blocks.append(block)
+    return [(first + 1, low + 1, [row[low:high + 1] for row in rows]) for first, low, high, rows in blocks]
+
+
+def _to_range(first_row, rows, columns, first_column=1):
+    ''' Returns the A1 notation of the range with the given size starting in first_column of first_row. '''
+
+    import gspread.utils
+
+    return '{0}:{1}'.format(gspread.utils.rowcol_to_a1(first_row, first_column),
+                            gspread.utils.rowcol_to_a1(first_row + rows - 1, first_column + max(columns, 1) - 1))
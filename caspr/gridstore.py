@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+
+# The cells last published to a sheet as list of equally long rows, and their digest.
+Published = namedtuple('Published', ['digest', 'grid'])
+
+
+def digest(grid):
+    ''' Returns a hash of the cells of the given grid. '''
+    return hashlib.sha256(json.dumps(grid, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class GridStore:
+    '''
+    Keeps the cells last published to each sheet on disk, keyed by the name of the sheet.
+
+    Republishing a sheet can then tell the changed cells, or skip the sheet entirely if nothing changed. This assumes
+    that nobody else edits the published cells.
+    '''
+
+    def __init__(self, directory):
+        ''' Initializes a store in the given directory, which is created if needed. '''
+
+        self._directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get(self, name):
+        ''' Returns the cells last published to the sheet with the given name as Published, or None if unknown. '''
+
+        try:
+            with open(self._path(name)) as file:
+                content = json.load(file)
+            return Published(digest=content['digest'], grid=content['grid'])
+        except (OSError, ValueError, KeyError, TypeError):  # missing or broken entries are treated as unknown
+            return None
+
+    def put(self, name, grid):
+        ''' Stores the cells just published to the sheet with the given name. '''
+
+        with open(self._path(name), 'w') as file:
+            json.dump({'name': name, 'digest': digest(grid), 'grid': grid}, file)
+
+    def remove(self, name):
+        ''' Forgets the cells of the sheet with the given name, e.g. because publishing them failed. '''
+
+        try:
+            os.remove(self._path(name))
+        except OSError:  # already unknown
+            pass
+
+    def _path(self, name):
+        # names of sheets are cache titles, which are too long or contain characters not allowed in file names
+        return os.path.join(self._directory, hashlib.sha256(name.encode('utf-8')).hexdigest() + '.json')
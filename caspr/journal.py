@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# The steps completed by a cache, in order, and the state of caches failing in any step.
+FETCHED = 'fetched'
+PARSED = 'parsed'
+PUBLISHED = 'published'
+FAILED = 'failed'
+
+_EXTENSION = '.jsonl'
+
+_logger = logging.getLogger(__name__)
+
+
+def page_digest(page):
+    ''' Returns the hash of the content of the given Page, or None if it is no page. '''
+
+    content = getattr(page, 'content', None)
+    return hashlib.sha256(content).hexdigest() if isinstance(content, bytes) else None
+
+
+class Journal:
+    '''
+    Records the progress of the caches of a batch in an append-only JSON lines file, so that a failed batch resumes
+    where it stopped.
+
+    Each line holds the code of a cache, the step it completed (fetched, parsed, or published) or failed, the hash of
+    its page once fetched, and the error of a failed step. The last line of a code tells its state. The next run of
+    the batch skips the published caches and prepares all others again, where the page cache and the parsed store
+    make the steps completed before cheap.
+    '''
+
+    def __init__(self, path):
+        ''' Initializes the journal in the given file, which is created with the first record. '''
+
+        self._path = path
+        self._lock = threading.Lock()  # the caches of a batch may be prepared concurrently
+        self._states = {}
+        self._digests = {}
+        try:
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self._update(entry['code'], entry['state'], entry.get('hash'))
+                    except (ValueError, KeyError, TypeError):  # e.g. the last line cut short by a crash
+                        continue
+        except OSError:  # no journal yet
+            pass
+
+    @staticmethod
+    def for_batch(directory, batch):
+        ''' Returns the journal in the given directory of the batch described by a JSON serializable value. '''
+
+        name = hashlib.sha256(json.dumps(batch, sort_keys=True).encode('utf-8')).hexdigest()
+        return Journal(os.path.join(directory, name + _EXTENSION))
+
+    def state(self, code):
+        ''' Returns the state of the cache with the given code, or None if unknown. '''
+
+        with self._lock:
+            return self._states.get(code)
+
+    def digest(self, code):
+        ''' Returns the hash of the page of the cache with the given code fetched last, or None if unknown. '''
+
+        with self._lock:
+            return self._digests.get(code)
+
+    def pending(self, codes):
+        ''' Returns an iterator over the given codes, skipping the caches published already. '''
+
+        for code in codes:
+            if self.state(code) == PUBLISHED:
+                _logger.info('skipping cache %s published by the last run', code)
+                continue
+            yield code
+
+    def record(self, code, state, digest=None, error=None):
+        ''' Appends the state of the cache with the given code, with the hash of its page or the error if given. '''
+
+        entry = {'code': code, 'state': state}
+        if digest:
+            entry['hash'] = digest
+        if error:
+            entry['error'] = error
+        with self._lock:
+            directory = os.path.dirname(self._path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self._path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+            self._update(code, state, digest)
+
+    def remove(self):
+        ''' Forgets the progress of all caches, e.g. because the batch is complete. '''
+
+        with self._lock:
+            try:
+                os.remove(self._path)
+            except OSError:  # nothing recorded yet
+                pass
+            self._states.clear()
+            self._digests.clear()
+
+    def _update(self, code, state, digest):
+        self._states[code] = state
+        if digest:
+            self._digests[code] = digest
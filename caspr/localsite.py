@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import os
+import re
+import sys
+import tarfile
+import threading
+import zipfile
+
+from caspr.casprexception import CasprException
+from caspr.page import Page, Validators
+
+# The source reading a single page from STDIN, whose code is STDIN as well.
+STDIN = '-'
+
+# Saved pages are named by the code of their geocache, which may be followed by the title.
+_CODE_RE = re.compile(r'(GC[0-9A-Z]+)(?![0-9A-Z])', re.IGNORECASE)
+_EXTENSIONS = ('.html', '.htm')
+
+
+class LocalSite:
+    '''
+    Serves saved geocache pages instead of www.geocaching.com, e.g. to reprocess archived pages without network access.
+
+    The source is a directory, a tar or zip archive, or '-' for a single page read from STDIN. The pages are files
+    named by the code of their geocache like GC2A62B.html, where the code may be followed by the title of the page,
+    e.g. "GC2A62B Seepromenade Luzern.html". Other files are ignored.
+
+    The pages are only read when fetched. Tar archives, which may be compressed as a whole, are read in a single pass,
+    while the codes are iterated, such that fetching the codes in that order never holds more than a few pages.
+    '''
+
+    def __init__(self, source, stdin=None):
+        ''' Initializes the site reading from the given source, where stdin replaces sys.stdin.buffer if given. '''
+
+        if source != STDIN and not os.path.exists(source):
+            raise CasprException('{0} does not exist.'.format(source))
+        self._source = source
+        self._kind = LocalSite._kind_of(source)
+        self._stdin = stdin
+        self._lock = threading.Lock()
+        self._names = None  # the name of the file or archive member of each code, looked up on demand
+        self._pending = {}  # the content of tar members read while iterating codes but not fetched yet
+        self._zip = None
+
+    def codes(self, patterns=None):
+        '''
+        Returns an iterator over the codes of the pages in the order of the source.
+
+        If patterns are given, only the codes matching any of them are returned, where patterns like GC2* are matched
+        as in fnmatch, but regardless of the case. The single page read from STDIN has no code to match, so it is
+        returned as STDIN regardless of the patterns.
+        '''
+
+        patterns = [pattern.upper() for pattern in patterns or []]
+
+        def matches(code):
+            return not patterns or any(fnmatch.fnmatchcase(code, pattern) for pattern in patterns)
+
+        if self._kind == 'stdin':
+            return iter([STDIN])
+        if self._kind == 'tar':
+            codes = self._stream_tar(matches)
+        else:
+            codes = iter(self._lookup())
+        return (code for code in codes if matches(code))
+
+    def fetch(self, code):
+        ''' Returns the page of the geocache with the given code. '''
+
+        return Page(content=self._read(code.upper()), encoding=None)
+
+    def fetch_if_modified(self, code, etag=None, last_modified=None):
+        ''' Like GeocachingSite.fetch_if_modified(), but saved pages have no validators and are always returned. '''
+
+        return self.fetch(code=code), Validators(etag=None, last_modified=None)
+
+    def _stream_tar(self, matches):
+        ''' A generator returning the matching codes of a tar archive, whose pages are kept until they are fetched. '''
+
+        seen = set()
+        with LocalSite._open_tar(self._source, mode='r|*') as archive:
+            for member in archive:
+                code = LocalSite._code(member.name) if member.isfile() else None
+                if code is None or code in seen or not matches(code):
+                    continue
+                seen.add(code)
+                content = archive.extractfile(member).read()
+                with self._lock:
+                    self._pending[code] = content
+                yield code
+
+    def _read(self, code):
+        ''' Returns the content of the page with the given code. '''
+
+        if self._kind == 'stdin':
+            if code != STDIN:
+                raise CasprException('Geocache {0} is not contained in STDIN.'.format(code))
+            with self._lock:
+                if STDIN not in self._pending:
+                    self._pending[STDIN] = (self._stdin or sys.stdin.buffer).read()
+                return self._pending[STDIN]
+        with self._lock:
+            if code in self._pending:
+                return self._pending.pop(code)
+        name = self._lookup().get(code)
+        if name is None:
+            raise CasprException('Geocache {0} is not contained in {1}.'.format(code, self._source))
+        if self._kind == 'directory':
+            with open(os.path.join(self._source, name), 'rb') as file:
+                return file.read()
+        with self._lock:  # archive files are not thread-safe
+            if self._kind == 'zip':
+                if self._zip is None:
+                    self._zip = zipfile.ZipFile(self._source)
+                return self._zip.read(name)
+            with LocalSite._open_tar(self._source, mode='r:*') as archive:
+                return archive.extractfile(name).read()
+
+    def _lookup(self):
+        ''' Returns the names of the files or archive members of all codes, in the order of the source. '''
+
+        with self._lock:
+            if self._names is None:
+                if self._kind == 'directory':
+                    names = sorted(os.listdir(self._source))
+                elif self._kind == 'zip':
+                    with zipfile.ZipFile(self._source) as archive:
+                        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+                else:
+                    with LocalSite._open_tar(self._source, mode='r:*') as archive:
+                        names = [member.name for member in archive.getmembers() if member.isfile()]
+                self._names = {}
+                for name in names:
+                    code = LocalSite._code(name)
+                    if code is not None:
+                        self._names.setdefault(code, name)
+            return self._names
+
+    @staticmethod
+    def _kind_of(source):
+        if source == STDIN:
+            return 'stdin'
+        if os.path.isdir(source):
+            return 'directory'
+        if zipfile.is_zipfile(source):
+            return 'zip'
+        return 'tar'
+
+    @staticmethod
+    def _open_tar(path, mode):
+        try:
+            return tarfile.open(path, mode=mode)
+        except tarfile.TarError as exception:
+            raise CasprException('{0} is neither a directory nor a tar or zip archive: {1}'.format(path, exception))
+
+    @staticmethod
+    def _code(name):
+        ''' Returns the code of the page with the given file name, or None if it is no page. '''
+
+        directory, base = os.path.split(name)
+        stem, extension = os.path.splitext(base)
+        # browsers save the files referenced by a page in the directory <page name>_files next to it
+        if (extension.lower() not in _EXTENSIONS or base.startswith('.') or
+                any(part.endswith('_files') for part in directory.split('/'))):
+            return None
+        match = _CODE_RE.match(stem)
+        return (match.group(1) if match else stem).upper()
@@ -6,11 +6,21 @@ import argparse
 import json
 import logging
 import os
+import threading
+import time
 import traceback
 
-from caspr.caches import Caches
+from caspr.asyncsite import AsyncGeocachingSite
+from caspr.caches import Caches, DEFAULT_FETCHERS
+from caspr.casprexception import CasprException
 from caspr.geocachingdotcom import DescriptionParser, GeocachingSite, PageParser, TableParser
-from caspr.googledotcom import WorksheetFactory
+from caspr.googledotcom import SheetIndex, WorksheetFactory
+from caspr.gridstore import GridStore
+from caspr.journal import Journal
+from caspr.localsite import LocalSite
+from caspr.pagecache import AsyncCachingSite, CachingSite, PageCache
+from caspr.parsedstore import CachingParser, ParsedStore
+from caspr.ratelimit import RateLimits
 
 __author__ = "Raphael Knaus"
 __copyright__ = "Raphael Knaus"
@@ -18,6 +28,12 @@ __license__ = "gpl3"
 __version__ = "0.0.1"
 
 _SETTINGS = path.expanduser('~/.caspr/settings.json')
+_COOKIES = path.expanduser('~/.caspr/cookies.json')
+_PAGE_CACHE = path.expanduser('~/.caspr/pages')
+_PARSED_STORE = path.expanduser('~/.caspr/parsed')
+_GRID_STORE = path.expanduser('~/.caspr/sheets')
+_SHEET_INDEX = path.expanduser('~/.caspr/sheet_ids.json')
+_JOURNAL = path.expanduser('~/.caspr/journal')
 
 # TODO(KNR): use logging
 _logger = logging.getLogger(__name__)
@@ -37,6 +53,80 @@ def _save_defaults(arguments):
                'keyfile': arguments.keyfile}, open(_SETTINGS, 'w'))
 
 
+def _run_concurrently(tasks, timeout):
+    '''
+    Calls the functions of the given (description, function) tuples concurrently and returns their results in order.
+
+    All functions share a deadline of timeout seconds. If any fails or misses the deadline, a CasprException naming
+    each failed task is raised. Tasks missing the deadline cannot be stopped, but are left behind as daemon threads,
+    so that they do not keep the process alive.
+    '''
+
+    results = [None] * len(tasks)
+    failures = [None] * len(tasks)
+
+    def run(index, function):
+        try:
+            results[index] = function()
+        except Exception as exception:
+            failures[index] = exception
+
+    threads = [threading.Thread(target=run, args=(index, function), name=description, daemon=True)
+               for index, (description, function) in enumerate(tasks)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+    messages = []
+    for thread, failure in zip(threads, failures):
+        if thread.is_alive():
+            messages.append('{0} did not finish within {1} s'.format(thread.name, timeout))
+        elif failure is not None:
+            messages.append('{0} failed: {1}'.format(thread.name, failure))
+    if messages:
+        raise CasprException('; '.join(messages)) from next((failure for failure in failures if failure), None)
+    return results
+
+
+def _journals(arguments):
+    ''' Returns the journal of each batch of cache codes, which are removed first to restart the batches. '''
+
+    journals = [Journal.for_batch(directory=_JOURNAL, batch=[arguments.input, codes])
+                for codes in arguments.cache_codes]
+    if arguments.restart:
+        for journal in journals:
+            journal.remove()
+    return journals
+
+
+def _prepare_batch(prepare, journal):
+    '''
+    Calls prepare, which prepares a batch of caches recording their progress in the journal, and removes the journal
+    once all caches are published. A batch with failed caches is reported, but does not stop the following batches.
+    '''
+
+    try:
+        prepare()
+    except CasprException as exception:
+        _logger.error('%s', exception)
+        return
+    journal.remove()
+
+
+async def _prepare_async(caches, site, batches, journals, fetchers):
+    ''' Prepares the batches of caches with the given AsyncGeocachingSite, whose connections are closed at the end. '''
+
+    async with site:
+        for codes, journal in zip(batches, journals):
+            try:
+                await caches.prepare_async(codes=codes, fetchers=fetchers, journal=journal)
+            except CasprException as exception:
+                _logger.error('%s', exception)
+                continue
+            journal.remove()
+
+
 def _parse_args(args, defaults):
     ''' Well... Parses the arguments.
 
@@ -59,24 +149,135 @@ def _parse_args(args, defaults):
                         default=defaults['keyfile'],
                         required=not bool(defaults['keyfile']),
                         help='Google API key file (see README.rst)')
+    parser.add_argument('--fetchers',
+                        action='store',
+                        type=int,
+                        help='number of caches fetched concurrently (default: {0})'.format(DEFAULT_FETCHERS))
+    parser.add_argument('--parsers',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='number of caches parsed concurrently')
+    parser.add_argument('--publishers',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='number of caches published concurrently')
+    parser.add_argument('--processes',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='number of processes parsing caches, which replace the parsing threads if more than 1')
+    parser.add_argument('--chunksize',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='number of caches passed to a parsing process at once')
+    parser.add_argument('--connections',
+                        action='store',
+                        type=int,
+                        default=0,
+                        help='fetch the cache pages with asyncio over this many keep-alive connections instead of '
+                             'with --fetchers threads')
+    parser.add_argument('--startup-timeout',
+                        action='store',
+                        type=float,
+                        default=300,
+                        help='seconds logging in to geocaching.com and connecting to Google may take, which both '
+                             'happen at the same time and include authorizing caspr in the browser on the first run')
+    parser.add_argument('--restart',
+                        action='store_true',
+                        help='prepare all caches of the batches again instead of resuming where the last run failed')
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--refresh',
+                            action='store_true',
+                            help='download all cache pages again instead of using the page cache')
+    cache_mode.add_argument('--offline',
+                            action='store_true',
+                            help='only use cache pages from the page cache without logging in to geocaching.com')
+    cache_mode.add_argument('--input',
+                            action='store',
+                            help='read cache pages from a directory, a tar or zip archive, or - for STDIN instead of '
+                                 'geocaching.com, where the cache codes may be patterns like GC2*')
+    # saved pages are selected by optional patterns, while geocaching.com requires the codes
+    reading_input = any(arg == '--input' or arg.startswith('--input=') for arg in args)
     parser.add_argument('cache_codes',
                         action='append',
-                        nargs="+",
-                        help="1..N www.geocaching.com cache codes like GC397CZ")
-    return parser.parse_args(args)
+                        nargs="*" if reading_input else "+",
+                        help="1..N www.geocaching.com cache codes like GC397CZ, all saved pages by default with "
+                             "--input")
+    arguments = parser.parse_args(args)
+    if arguments.processes > 1 and (arguments.fetchers is not None or max(arguments.parsers, arguments.publishers) > 1):
+        parser.error('--processes cannot be combined with --fetchers, --parsers, or --publishers')
+    if arguments.fetchers is None:
+        arguments.fetchers = DEFAULT_FETCHERS
+    return arguments
 
 
 def main(args, stdout, stderr):
     ''' Parses the arguments and prepares each cache. '''
     arguments = _parse_args(args, _load_defaults())
+    limits = RateLimits()
     try:
         _save_defaults(arguments)
-        caches = Caches(site=GeocachingSite(user=arguments.user, password=arguments.password),
-                        parser=PageParser(table_parser=TableParser(),
-                                          description_parser=DescriptionParser()),
-                        factory=WorksheetFactory(keyfile=arguments.keyfile))
+        factory = WorksheetFactory(keyfile=arguments.keyfile,
+                                   grid_store=GridStore(directory=_GRID_STORE),
+                                   sheet_index=SheetIndex(path=_SHEET_INDEX),
+                                   limiter=limits.endpoint('sheets.googleapis.com'))
+        async_site = None
+        if arguments.input:
+            site = LocalSite(source=arguments.input)
+            batches = [site.codes(patterns=codes) for codes in arguments.cache_codes]
+        else:
+            site = None
+            if not arguments.offline:
+                # the login and the Google connection are independent, so neither waits for the other
+                site, _ = _run_concurrently([('logging in to geocaching.com',
+                                              lambda: GeocachingSite(user=arguments.user,
+                                                                     password=arguments.password,
+                                                                     cookie_file=_COOKIES,
+                                                                     limiter=limits.endpoint('geocaching.com'))),
+                                             ('connecting to Google', factory.connect)],
+                                            timeout=arguments.startup_timeout)
+                if arguments.connections > 0:
+                    async_site = AsyncGeocachingSite(cookies=site.cookies(), connections_per_host=arguments.connections,
+                                                     limiter=limits.endpoint('geocaching.com'))
+            site = (AsyncCachingSite if async_site else CachingSite)(site=async_site or site,
+                                                                     cache=PageCache(directory=_PAGE_CACHE),
+                                                                     refresh=arguments.refresh,
+                                                                     offline=arguments.offline)
+            batches = arguments.cache_codes
+        caches = Caches(site=site,
+                        parser=CachingParser(parser=PageParser(table_parser=TableParser(),
+                                                               description_parser=DescriptionParser(),
+                                                               streaming=True),
+                                             store=ParsedStore(directory=_PARSED_STORE)),
+                        factory=factory)
+        journals = _journals(arguments)
         # TODO(KNR): can I prevent argparse from returning a list of lists?
-        for codes in arguments.cache_codes:
-            caches.prepare(codes=codes)
+        pipelined = max(arguments.fetchers, arguments.parsers, arguments.publishers) > 1
+        if async_site:
+            import asyncio  # only imported when needed, as it takes long
+
+            asyncio.run(_prepare_async(caches, site=async_site, batches=batches, journals=journals,
+                                       fetchers=arguments.connections))
+            return
+        for codes, journal in zip(batches, journals):
+            if arguments.processes > 1:
+                _prepare_batch(lambda: caches.prepare_parallel(codes=codes,
+                                                               processes=arguments.processes,
+                                                               chunksize=arguments.chunksize,
+                                                               journal=journal), journal)
+            elif pipelined:
+                _prepare_batch(lambda: caches.prepare_pipelined(codes=codes,
+                                                                fetchers=arguments.fetchers,
+                                                                parsers=arguments.parsers,
+                                                                publishers=arguments.publishers,
+                                                                journal=journal), journal)
+            else:
+                _prepare_batch(lambda: caches.prepare(codes=codes, journal=journal), journal)
     except Exception:
         traceback.print_exc()
+    finally:
+        for name, counters in sorted(limits.counters().items()):
+            _logger.info('%s: %s', name, ', '.join('{0} {1}'.format(key, value) for key, value in counters.items()))
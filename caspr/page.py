@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+
+# The raw bytes of a fetched page and their encoding, or None if the parser shall detect it.
+Page = namedtuple('Page', ['content', 'encoding'])
+
+# The validators of a fetched page used to ask the site whether the page changed since.
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
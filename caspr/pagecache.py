@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from urllib.parse import quote
+import json
+import os
+import tempfile
+import threading
+import time
+
+from caspr.casprexception import CasprException
+from caspr.page import Page, Validators
+
+# Pages younger than this are served without asking the site whether they changed.
+DEFAULT_TTL = 12 * 60 * 60  # seconds
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_Entry = namedtuple('entry', ['page', 'validators', 'fetched'])
+
+
+class PageCache:
+    '''
+    Keeps fetched pages on disk, keyed by geocache code.
+
+    Each entry consists of the page content and a small JSON file holding its encoding, validators, and the time of
+    the last fetch, while the modification time of the content tells the last use. If the pages exceed max_bytes in
+    total, the least recently used ones are evicted. Files are replaced atomically, so that concurrent fetchers never
+    read partial entries.
+    '''
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        ''' Initializes a cache stored in the given directory, which is created if needed. '''
+
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._total = None  # the size of all pages, only listed when the first page is stored
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def get(self, code):
+        ''' Returns the entry of the given code and marks it as recently used, or None if not cached. '''
+
+        try:
+            with open(self._metadata_path(code)) as file:
+                metadata = json.load(file)
+            with open(self._content_path(code), 'rb') as file:
+                content = file.read()
+            now = time.time()
+            os.utime(self._content_path(code), times=(now, now))
+            return _Entry(page=Page(content=content, encoding=metadata['encoding']),
+                          validators=Validators(etag=metadata['etag'], last_modified=metadata['last_modified']),
+                          fetched=metadata['fetched'])
+        except (OSError, ValueError, KeyError):  # missing or broken entries are treated as cache misses
+            return None
+
+    def put(self, code, page, validators):
+        ''' Stores the page of the given code and evicts the least recently used pages if the cache is full. '''
+
+        path = self._content_path(code)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        self._write(path, page.content)
+        now = time.time()
+        os.utime(path, times=(now, now))
+        self._write_metadata(code, {'encoding': page.encoding,
+                                    'etag': validators.etag,
+                                    'last_modified': validators.last_modified,
+                                    'fetched': now})
+        with self._lock:
+            if self._total is not None:
+                self._total += len(page.content) - replaced
+            full = self._total is None or self._total > self._max_bytes
+        if full:
+            self._evict()
+
+    def confirm(self, code, validators):
+        '''
+        Records that the cached page of the given code has just been confirmed to be unchanged by the site, and returns
+        whether it is still cached, as it may have been evicted in the meantime.
+        '''
+
+        try:
+            with open(self._metadata_path(code)) as file:
+                metadata = json.load(file)
+        except (OSError, ValueError):
+            return False
+        metadata.update(etag=validators.etag or metadata.get('etag'),
+                        last_modified=validators.last_modified or metadata.get('last_modified'),
+                        fetched=time.time())
+        self._write_metadata(code, metadata)
+        return True
+
+    def _evict(self):
+        ''' Removes the least recently used pages until the total size does not exceed the maximum anymore. '''
+
+        entries = []
+        total = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith('.html'):
+                continue
+            try:
+                status = os.stat(os.path.join(self._directory, name))
+            except OSError:  # removed by a concurrent eviction
+                continue
+            entries.append((status.st_mtime, name[:-len('.html')], status.st_size))
+            total += status.st_size
+        for _, stem, size in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            for path in (os.path.join(self._directory, stem + '.html'), os.path.join(self._directory, stem + '.json')):
+                try:
+                    os.remove(path)
+                except OSError:  # already removed, e.g. by a concurrent eviction
+                    pass
+            total -= size
+        with self._lock:
+            self._total = total
+
+    def _write_metadata(self, code, metadata):
+        self._write(self._metadata_path(code), json.dumps(metadata).encode('utf-8'))
+
+    def _write(self, path, content):
+        ''' Replaces the file at path by a temporary file, so that readers never see partial files. '''
+
+        descriptor, temporary = tempfile.mkstemp(dir=self._directory)
+        try:
+            with open(descriptor, 'wb') as file:
+                file.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def _content_path(self, code):
+        return os.path.join(self._directory, PageCache._file_name(code) + '.html')
+
+    def _metadata_path(self, code):
+        return os.path.join(self._directory, PageCache._file_name(code) + '.json')
+
+    @staticmethod
+    def _file_name(code):
+        ''' Returns a file name for the given code which is safe on all platforms. '''
+        return quote(code.upper(), safe='')
+
+
+class CachingSite:
+    '''
+    Puts a page cache in front of a site.
+
+    Pages younger than ttl seconds are taken from the cache. Older pages are revalidated with their ETag and
+    Last-Modified validators, so that unchanged pages are not downloaded again. With refresh all pages are downloaded
+    again, while offline only cached pages are served and the site is never contacted.
+    '''
+
+    def __init__(self, site, cache, ttl=DEFAULT_TTL, refresh=False, offline=False):
+        ''' Initializes the caching site, where site may be None when working offline. '''
+
+        if refresh and offline:
+            raise CasprException('cannot refresh cached pages while working offline')
+        self._site = site
+        self._cache = cache
+        self._ttl = ttl
+        self._refresh = refresh
+        self._offline = offline
+
+    def fetch(self, code):
+        ''' Returns the page of the geocache with the given code. '''
+
+        entry, validators = self._lookup(code)
+        if validators is None:
+            return entry.page
+        page, validators = self._site.fetch_if_modified(code=code,
+                                                        etag=validators.etag,
+                                                        last_modified=validators.last_modified)
+        return self._update(code, entry, page, validators)
+
+    def _lookup(self, code):
+        ''' Returns the cache entry of the given code and the validators to fetch it with, or None if it is fresh. '''
+
+        entry = self._cache.get(code)
+        if self._offline:
+            if not entry:
+                raise CasprException('Geocache {0} is not cached and cannot be fetched offline.'.format(code))
+            return entry, None
+        if entry and not self._refresh and time.time() - entry.fetched < self._ttl:
+            return entry, None
+        return entry, entry.validators if entry and not self._refresh else Validators(etag=None, last_modified=None)
+
+    def _update(self, code, entry, page, validators):
+        ''' Stores the page fetched for the given code, or confirms the entry if page is None, and returns it. '''
+
+        if page is None:  # not modified
+            if not self._cache.confirm(code, validators):  # evicted since looked up
+                self._cache.put(code, entry.page, Validators(etag=validators.etag or entry.validators.etag,
+                                                             last_modified=validators.last_modified or
+                                                             entry.validators.last_modified))
+            return entry.page
+        self._cache.put(code, page, validators)
+        return page
+
+
+class AsyncCachingSite(CachingSite):
+    ''' Like CachingSite, but in front of a site whose fetch_if_modified() is a coroutine, e.g. AsyncGeocachingSite. '''
+
+    async def fetch(self, code):
+        ''' Returns the page of the geocache with the given code. '''
+
+        entry, validators = self._lookup(code)
+        if validators is None:
+            return entry.page
+        page, validators = await self._site.fetch_if_modified(code=code,
+                                                              etag=validators.etag,
+                                                              last_modified=validators.last_modified)
+        return self._update(code, entry, page, validators)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from caspr.page import Page
+import caspr.geocachingdotcom
+import caspr.page
+import caspr.stage
+import caspr.staticcoordinate
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# The modules whose code determines the result of parsing a page, and the classes therein which do not, like the
+# networking code of GeocachingSite.
+_PARSER_MODULES = (caspr.geocachingdotcom, caspr.page, caspr.stage, caspr.staticcoordinate)
+_NOT_PARSER_CLASSES = (caspr.geocachingdotcom.GeocachingSite,)
+
+_EXTENSION = '.pickle'
+
+
+@functools.lru_cache(maxsize=1)
+def parser_version():
+    ''' Returns a hash of the code of the parser modules, which changes with each change of the parser. '''
+
+    import inspect  # only imported when needed, as it takes long
+
+    version = hashlib.sha256()
+    for module in _PARSER_MODULES:
+        source = inspect.getsource(module)
+        for excluded in _NOT_PARSER_CLASSES:
+            if inspect.getmodule(excluded) is module:
+                source = source.replace(inspect.getsource(excluded), '')
+        version.update(source.encode('utf-8'))
+    return version.hexdigest()
+
+
+class ParsedStore:
+    '''
+    Keeps parsed caches on disk, keyed by the content of their pages and the version of the parser.
+
+    Unchanged pages are therefore never parsed twice, while a change of the parser code leads to new keys, so that
+    the results of the former parser are not found anymore and eventually evicted. If the entries exceed max_bytes in
+    total, the least recently used ones are evicted.
+    '''
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, version=None):
+        ''' Initializes a store in the given directory, which is created if needed. '''
+
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._version = version or parser_version()
+        self._total = None  # the size of all entries, only listed when the first entry is stored
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, page):
+        ''' Returns the key of the given Page. '''
+
+        key = hashlib.sha256(self._version.encode('ascii'))
+        key.update((page.encoding or '').encode('ascii') + b'\0')
+        key.update(page.content)
+        return key.hexdigest()
+
+    def get(self, key):
+        ''' Returns the parsed cache {'name': name, 'stages': list of stages} stored with the key, or None. '''
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                cache = pickle.load(file)
+            os.utime(path)  # the modification time tells the least recently used entries
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None  # missing or broken entries are treated as misses
+        return cache
+
+    def put(self, key, cache):
+        ''' Stores the parsed cache with the key and evicts the least recently used entries if the store is full. '''
+
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        # written to a temporary file first, so that concurrent readers never see partial entries
+        descriptor, temporary = tempfile.mkstemp(dir=self._directory)
+        try:
+            with open(descriptor, 'wb') as file:
+                pickle.dump({'name': cache['name'], 'stages': list(cache['stages'])}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                size = file.tell()
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        with self._lock:
+            if self._total is not None:
+                self._total += size - replaced
+            full = self._total is None or self._total > self._max_bytes
+        if full:
+            self._evict()
+
+    def _evict(self):
+        ''' Removes the least recently used entries until the total size does not exceed the maximum anymore. '''
+
+        entries = []
+        total = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith(_EXTENSION):
+                continue
+            try:
+                status = os.stat(os.path.join(self._directory, name))
+            except OSError:  # removed by a concurrent eviction
+                continue
+            entries.append((status.st_mtime, name, status.st_size))
+            total += status.st_size
+        for _, name, size in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:  # already removed, e.g. by a concurrent eviction
+                pass
+            total -= size
+        with self._lock:
+            self._total = total
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + _EXTENSION)
+
+
+class CachingParser:
+    '''
+    Puts a parsed store in front of a page parser.
+
+    Pages found in the store are not parsed at all, all others are parsed and stored. Pages given as file names or
+    URLs are always parsed.
+    '''
+
+    def __init__(self, parser, store):
+        self._parser = parser
+        self._store = store
+
+    def parse(self, page):
+        ''' Returns the parsed cache like PageParser.parse(), but with the stages as list. '''
+
+        if not isinstance(page, Page):
+            return self._parser.parse(page=page)
+        key = self._store.key(page)
+        cache = self._store.get(key)
+        if cache is None:
+            parsed = self._parser.parse(page=page)
+            cache = {'name': parsed['name'], 'stages': list(parsed['stages'])}
+            self._store.put(key, cache)
+        return cache
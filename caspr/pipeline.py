@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+from caspr.casprexception import CasprException
+
+
+_DONE = object()  # sentinel telling a worker that its input queue has been exhausted
+
+
+class _Failure:
+    ''' Carries the exception raised while processing an item past all remaining stages. '''
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class _Countdown:
+    ''' Thread-safe counter used to detect the last worker leaving a stage. '''
+
+    def __init__(self, count):
+        self._count = count
+        self._lock = threading.Lock()
+
+    def decrement(self):
+        ''' Decrements the count by 1 and returns the new count. '''
+        with self._lock:
+            self._count -= 1
+            return self._count
+
+
+class Pipeline:
+    '''
+    Runs items through a sequence of stages, each served by its own pool of worker threads.
+
+    Neighbouring stages are connected by bounded queues, so a slow stage throttles the stages feeding it. Results are
+    yielded in the order of the input items. Once an item fails, no further items are started and the exception of the
+    first failing item (in input order) is re-raised, just like a sequential loop would do.
+    '''
+
+    def __init__(self, stages, queue_size=4):
+        ''' Initializes the pipeline with a list of (function, worker count) tuples. '''
+
+        if not stages:
+            raise CasprException('a pipeline requires at least one stage')
+        if any(workers < 1 for _, workers in stages):
+            raise CasprException('each pipeline stage requires at least one worker')
+        self._stages = stages
+        self._queue_size = queue_size
+
+    def run(self, items):
+        ''' Returns a generator yielding the result of the last stage for each item in input order. '''
+
+        stopped = threading.Event()
+        inputs = [queue.Queue(maxsize=self._queue_size) for _ in self._stages]
+        results = queue.Queue()  # unbounded, so that the last stage never blocks on a slow consumer
+        outputs = inputs[1:] + [results]
+        successors = [workers for _, workers in self._stages[1:]] + [1]
+
+        threads = [threading.Thread(target=Pipeline._feed, args=(items, inputs[0], self._stages[0][1], stopped))]
+        for (function, workers), source, target, count in zip(self._stages, inputs, outputs, successors):
+            remaining = _Countdown(workers)
+            threads.extend(threading.Thread(target=Pipeline._work,
+                                            args=(function, source, target, remaining, count, stopped))
+                           for _ in range(workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            yield from Pipeline._collect(results, stopped)
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _feed(items, target, successors, stopped):
+        ''' Puts the enumerated items into the queue of the first stage. '''
+
+        index = 0
+        try:
+            for item in items:
+                if stopped.is_set():
+                    break
+                target.put((index, item))
+                index += 1
+        except Exception as exception:
+            target.put((index, _Failure(exception)))
+        finally:
+            for _ in range(successors):
+                target.put(_DONE)
+
+    @staticmethod
+    def _work(function, source, target, remaining, successors, stopped):
+        ''' Applies the function of a stage to each item until the source queue is exhausted. '''
+
+        while True:
+            item = source.get()
+            if item is _DONE:
+                break
+            if stopped.is_set():  # drain the queue, so that no upstream worker blocks forever
+                continue
+            index, value = item
+            if not isinstance(value, _Failure):
+                try:
+                    value = function(value)
+                except Exception as exception:
+                    value = _Failure(exception)
+            target.put((index, value))
+        if remaining.decrement() == 0:  # the last worker leaving a stage closes the next one
+            for _ in range(successors):
+                target.put(_DONE)
+
+    @staticmethod
+    def _collect(results, stopped):
+        ''' Re-orders the results of the last stage and yields them in input order. '''
+
+        pending = {}
+        next_index = 0
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            index, value = item
+            pending[index] = value
+            while next_index in pending:
+                value = pending.pop(next_index)
+                if isinstance(value, _Failure):
+                    stopped.set()
+                    raise value.exception
+                yield value
+                next_index += 1
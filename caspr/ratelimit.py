@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import random
+import threading
+import time
+
+from caspr.casprexception import CasprException
+
+# The limits of the endpoints known by RateLimits, as keyword arguments of Endpoint. Google allows 60 writes per
+# minute and user to the Sheets API, geocaching.com does not publish its limits.
+ENDPOINTS = {
+    'geocaching.com': dict(rate=5.0, burst=10, concurrency=4, max_concurrency=16, latency_target=5.0),
+    'sheets.googleapis.com': dict(rate=1.0, burst=60, concurrency=2, max_concurrency=8, latency_target=10.0),
+}
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds before the first retry, doubled with each further retry
+DEFAULT_MAX_BACKOFF = 60.0
+
+
+def is_retryable(status):
+    ''' Returns whether a request answered with the given HTTP status may succeed when retried later. '''
+    return status == 429 or status >= 500
+
+
+def check_status(status, retry_after=None):
+    ''' Raises RetryableStatus if the given HTTP status is retryable, where retry_after is the Retry-After header. '''
+
+    if is_retryable(status):
+        raise RetryableStatus(status=status, retry_after=retry_after)
+
+
+class RetryableStatus(CasprException):
+    ''' Raised by calls of an endpoint answered with a retryable HTTP status, i.e. 429 or 5xx. '''
+
+    def __init__(self, status, retry_after=None):
+        super().__init__('request failed with HTTP status {0}'.format(status))
+        self.status = status
+        try:
+            # only the delay in seconds is supported, not the HTTP date format
+            self.retry_after = max(float(retry_after), 0.0) if retry_after is not None else None
+        except ValueError:
+            self.retry_after = None
+
+
+class TokenBucket:
+    '''
+    Limits the rate of requests to rate requests per second on average, while allowing bursts of burst requests.
+
+    Each request reserves a token and waits until the token is due, so that waiting requests are served in order and
+    both threads and coroutines can wait in their own way.
+    '''
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise CasprException('a token bucket requires a positive rate and a burst of at least one request')
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        ''' Reserves a token and returns the seconds to wait before the request may be sent. '''
+
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1  # negative while requests wait for their tokens
+            return max(-self._tokens / self._rate, 0.0)
+
+
+class AimdLimit:
+    '''
+    Limits the number of requests in flight, adjusting the limit by additive increase and multiplicative decrease.
+
+    The limit grows by one request per limit requests answered within latency_target seconds and is halved by each
+    throttled or slower request, within minimum and maximum. This finds the concurrency an endpoint sustains, like
+    the congestion control of TCP.
+    '''
+
+    def __init__(self, initial, minimum=1, maximum=16, latency_target=None, decrease=0.5):
+        if not 1 <= minimum <= initial <= maximum:
+            raise CasprException('the initial concurrency must be between minimum and maximum, which are at least 1')
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._latency_target = latency_target
+        self._decrease = decrease
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._waiters = collections.deque()  # the futures of waiting coroutines, with their loops
+
+    @property
+    def limit(self):
+        ''' Returns the current number of requests allowed in flight. '''
+        return int(self._limit)
+
+    def acquire(self):
+        ''' Waits until another request may be sent. '''
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < int(self._limit))
+            self._in_flight += 1
+
+    async def acquire_async(self):
+        ''' Like acquire(), but waits as coroutine. '''
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._condition:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+                    else:  # woken already, so pass the free slot on
+                        self._wake_waiters()
+                raise
+
+    def release(self, latency, throttled=False):
+        ''' Releases a request answered after latency seconds, which was throttled or failed if throttled. '''
+
+        with self._condition:
+            self._in_flight -= 1
+            if throttled or (self._latency_target is not None and latency > self._latency_target):
+                self._limit = max(self._limit * self._decrease, self._minimum)
+            else:
+                self._limit = min(self._limit + 1 / self._limit, self._maximum)
+            self._condition.notify_all()
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        ''' Wakes as many waiting coroutines as requests may be sent, which must be called holding the condition. '''
+
+        free = int(self._limit) - self._in_flight
+        while self._waiters and free > 0:
+            loop, waiter = self._waiters.popleft()
+            loop.call_soon_threadsafe(_wake, waiter)
+            free -= 1
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Endpoint:
+    '''
+    Throttles the calls of an endpoint and retries calls answered with a retryable HTTP status.
+
+    Each call first waits for a token of the token bucket and then for a free slot of the AIMD concurrency limit,
+    which are both optional. Calls raising RetryableStatus are retried up to retries times after a backoff doubling
+    with each retry, but no more than max_backoff seconds, where a random part of the backoff (full jitter) keeps
+    clients from retrying in lockstep. A Retry-After header of the response is honoured. Once all retries failed, the
+    last RetryableStatus is raised.
+    '''
+
+    def __init__(self, name, rate=None, burst=1, concurrency=None, max_concurrency=16, latency_target=None,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 clock=time.monotonic, sleep=time.sleep, randomness=None):
+        '''
+        Initializes the endpoint, which has no token bucket if rate is None and no concurrency limit if concurrency is
+        None.
+        '''
+
+        self.name = name
+        self._bucket = TokenBucket(rate=rate, burst=burst, clock=clock) if rate else None
+        self._limit = (AimdLimit(initial=concurrency, maximum=max(concurrency, max_concurrency),
+                                 latency_target=latency_target) if concurrency else None)
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleep
+        self._random = randomness or random.Random()
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def call(self, function):
+        ''' Returns the result of calling function without arguments, throttled and retried. '''
+
+        for attempt in range(self._retries + 1):
+            self._sleep(self._reserve())
+            if self._limit:
+                self._limit.acquire()
+            start = self._clock()
+            try:
+                return self._succeeded(start, function())
+            except RetryableStatus as status:
+                delay = self._failed(start, status, attempt)
+            except BaseException:
+                self._released(start)
+                raise
+            self._sleep(delay)
+
+    async def call_async(self, function):
+        ''' Like call(), but function returns a coroutine, which is awaited. '''
+
+        import asyncio
+
+        for attempt in range(self._retries + 1):
+            await asyncio.sleep(self._reserve())
+            if self._limit:
+                await self._limit.acquire_async()
+            start = self._clock()
+            try:
+                return self._succeeded(start, await function())
+            except RetryableStatus as status:
+                delay = self._failed(start, status, attempt)
+            except BaseException:
+                self._released(start)
+                raise
+            await asyncio.sleep(delay)
+
+    def counters(self):
+        '''
+        Returns the counters of the endpoint: the number of calls, retries, throttled (429) and failed (5xx) attempts,
+        calls given up, the total seconds waited for tokens and backoffs, and the current concurrency limit.
+        '''
+
+        with self._lock:
+            counters = {key: self._counters[key] for key in ('calls', 'retries', 'throttled', 'failed', 'given_up')}
+            counters['waited'] = round(self._counters['waited'], 3)
+        counters['concurrency'] = self._limit.limit if self._limit else None
+        return counters
+
+    def _count(self, key, increment=1):
+        with self._lock:
+            self._counters[key] += increment
+
+    def _reserve(self):
+        ''' Returns the seconds to wait for a token. '''
+
+        wait = self._bucket.reserve() if self._bucket else 0.0
+        self._count('waited', wait)
+        return wait
+
+    def _succeeded(self, start, result):
+        self._released(start)
+        self._count('calls')
+        return result
+
+    def _released(self, start, throttled=False):
+        if self._limit:
+            self._limit.release(latency=self._clock() - start, throttled=throttled)
+
+    def _failed(self, start, status, attempt):
+        ''' Counts the failed attempt and returns the backoff before retrying it, or raises status if given up. '''
+
+        self._released(start, throttled=status.status == 429 or status.status == 503)
+        self._count('throttled' if status.status == 429 else 'failed')
+        if attempt >= self._retries:
+            self._count('given_up')
+            raise status
+        delay = self._random.uniform(0, min(self._backoff * 2 ** attempt, self._max_backoff))
+        if status.retry_after is not None:
+            delay = max(delay, min(status.retry_after, self._max_backoff))
+        self._count('retries')
+        self._count('waited', delay)
+        return delay
+
+
+class RateLimits:
+    ''' Keeps one Endpoint per name, shared by all users of the endpoint, e.g. all fetching threads. '''
+
+    def __init__(self, endpoints=None, **options):
+        ''' Initializes the endpoints with the given limits by name, defaulting to ENDPOINTS, and further options. '''
+
+        self._limits = ENDPOINTS if endpoints is None else endpoints
+        self._options = options
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, name):
+        ''' Returns the endpoint with the given name, which is not throttled unless its limits are known. '''
+
+        with self._lock:
+            if name not in self._endpoints:
+                self._endpoints[name] = Endpoint(name=name, **dict(self._options, **self._limits.get(name, {})))
+            return self._endpoints[name]
+
+    def counters(self):
+        ''' Returns the counters of all endpoints used so far by name. '''
+
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return {endpoint.name: endpoint.counters() for endpoint in endpoints}
+
+
+# The endpoint of sites and factories without rate limits, which raises RetryableStatus without retrying.
+UNLIMITED = Endpoint(name='unlimited', retries=0)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import math
+
+import numpy
+
+from caspr.casprexception import CasprException
+from caspr.evaluator import digit_combinations
+from caspr.staticcoordinate import Coordinate, EARTH_RADIUS, haversine, StaticCoordinate
+
+# Boxes of the search space with at most this many combinations are evaluated at once instead of being split further.
+LEAF_COMBINATIONS = 4096
+
+# The feasible positions, where values maps each unknown variable to an array of its values.
+Solutions = namedtuple('solutions', ['values', 'latitudes', 'longitudes', 'distances'])
+
+
+def solve(position, known=None, ranges=None, origin=None, max_distance=None):
+    '''
+    Returns all feasible solutions of the given position formula.
+
+    The variables which are not known are searched within their inclusive ranges (low, high), which default to all
+    digits. If origin, a Coordinate or a text like the header coordinate of the cache N 47° 03.204 E 008° 18.557, and
+    max_distance in meters are given, only solutions within max_distance of the origin are feasible.
+
+    Instead of enumerating all combinations, the search space is split into boxes and each box is dropped as soon as
+    the interval bounds of its positions show that it cannot contain a feasible solution.
+    '''
+
+    if (origin is None) != (max_distance is None):
+        raise CasprException('origin and maximum distance are only supported together')
+    known = known or {}
+    ranges = ranges or {}
+    unknowns = sorted(position.variables - set(known))
+    box = {variable: (value, value) for variable, value in known.items()}
+    for variable in unknowns:
+        low, high = ranges.get(variable, (0, 9))
+        if low > high:
+            raise CasprException('empty range of variable {0}'.format(variable))
+        box[variable] = (low, high)
+    center = _to_coordinate(origin) if origin is not None else None
+
+    order = _by_influence(position, box, unknowns)
+    found = []
+    boxes = [box]
+    while boxes:
+        box = boxes.pop()
+        limits = position.bounds(box)
+        if not limits or (center and _min_distance(center, *limits) > max_distance):
+            continue
+        if _combinations(box, unknowns) <= LEAF_COMBINATIONS:
+            found.append(_evaluate_box(position, box, unknowns, known, center, max_distance))
+            continue
+        variable = next(variable for variable in order if box[variable][0] < box[variable][1])
+        low, high = box[variable]
+        middle = (low + high) // 2
+        boxes.append(dict(box, **{variable: (middle + 1, high)}))
+        boxes.append(dict(box, **{variable: (low, middle)}))  # searched first to keep the solutions sorted
+    return _merge(found, unknowns, center is not None)
+
+
+def _by_influence(position, box, unknowns):
+    '''
+    Returns the unknown variables ordered by the size of the area the position may cover when only they vary.
+
+    Splitting the most influential variables first drops the largest parts of the search space early.
+    '''
+
+    def area(variable):
+        fixed = {name: (low, low) for name, (low, _) in box.items()}
+        fixed[variable] = box[variable]
+        limits = position.bounds(fixed)
+        if not limits:
+            return math.inf  # splitting it might lead to valid boxes
+        (latitude_low, latitude_high), (longitude_low, longitude_high) = limits
+        return (latitude_high - latitude_low) + (longitude_high - longitude_low)
+
+    return sorted(unknowns, key=area, reverse=True)
+
+
+def _combinations(box, unknowns):
+    return math.prod(box[variable][1] - box[variable][0] + 1 for variable in unknowns)  # 1 without unknowns
+
+
+def _evaluate_box(position, box, unknowns, known, center, max_distance):
+    ''' Returns the values and positions of the feasible solutions in the given box. '''
+
+    values = digit_combinations(unknowns, box)
+    latitudes, longitudes = position.evaluate(dict(known, **values))
+    size = _combinations(box, unknowns)
+    latitudes, longitudes = numpy.broadcast_to(latitudes, size), numpy.broadcast_to(longitudes, size)
+    feasible = numpy.isfinite(latitudes) & numpy.isfinite(longitudes)
+    distances = None
+    if center:
+        distances = haversine(center.latitude, center.longitude, latitudes, longitudes)
+        feasible &= distances <= max_distance
+        distances = distances[feasible]
+    return ({variable: numpy.broadcast_to(values, size)[feasible] for variable, values in values.items()},
+            latitudes[feasible], longitudes[feasible], distances)
+
+
+def _merge(found, unknowns, with_distances):
+    ''' Concatenates the solutions found in all boxes. '''
+
+    if not found:
+        empty = numpy.empty(0)
+        return Solutions(values={variable: numpy.empty(0, dtype=int) for variable in unknowns},
+                         latitudes=empty, longitudes=empty, distances=empty if with_distances else None)
+    return Solutions(values={variable: numpy.concatenate([values[variable] for values, _, _, _ in found])
+                             for variable in unknowns},
+                     latitudes=numpy.concatenate([latitudes for _, latitudes, _, _ in found]),
+                     longitudes=numpy.concatenate([longitudes for _, _, longitudes, _ in found]),
+                     distances=numpy.concatenate([distances for _, _, _, distances in found]) if with_distances
+                     else None)
+
+
+def _min_distance(center, latitudes, longitudes):
+    '''
+    Returns a lower bound of the distance in meters between the center and any position within the given bounds.
+
+    Uses the haversine formula hav(d) = hav(dlat) + cos(lat1) cos(lat2) hav(dlon), bounding each term on its own.
+    '''
+
+    latitude_difference = math.radians(center.latitude - min(max(center.latitude, latitudes[0]), latitudes[1]))
+    longitude_difference = math.radians(center.longitude - min(max(center.longitude, longitudes[0]), longitudes[1]))
+    # the cosine is smallest at the latitude farthest from the equator, which is always one of the bounds
+    min_cosine = min(math.cos(math.radians(latitudes[0])), math.cos(math.radians(latitudes[1])))
+    haversines = (math.sin(latitude_difference / 2) ** 2 +
+                  math.cos(math.radians(center.latitude)) * max(min_cosine, 0) *
+                  math.sin(longitude_difference / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(haversines), 1))
+
+
+def _to_coordinate(origin):
+    ''' Returns the given origin as Coordinate, parsing it if it is a text. '''
+
+    if isinstance(origin, Coordinate):
+        return origin
+    coordinate = StaticCoordinate.parse(origin)
+    if not coordinate:
+        raise CasprException('{0} is not a coordinate'.format(origin))
+    return coordinate
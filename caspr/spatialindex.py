@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import math
+
+import numpy
+
+from caspr.casprexception import CasprException
+from caspr.staticcoordinate import Coordinate, EARTH_RADIUS, haversine, StaticCoordinate
+
+# About 1.1 km in latitude, so that typical queries for the stages of a multi touch only a few cells.
+DEFAULT_CELL_SIZE = 0.01  # degrees
+
+
+class SpatialIndex:
+    '''
+    Finds items by their position, e.g. the stages of all parsed caches.
+
+    The positions are kept in a grid of cells of cell_size degrees of latitude and longitude. Queries only look at
+    the cells which may contain matching positions and compute the exact distances of those at once. Items can be
+    added at any time and must be JSON serializable to save the index.
+    '''
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        ''' Initializes an empty index with the given size of the grid cells in degrees. '''
+
+        if cell_size <= 0 or cell_size > 180:
+            raise CasprException('the cell size must be within (0, 180] degrees')
+        self._cell_size = cell_size
+        self._columns = int(math.ceil(360 / cell_size))
+        self._cells = {}
+        self._latitudes = []
+        self._longitudes = []
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, coordinate, item):
+        ''' Adds the item at the given Coordinate. '''
+
+        index = len(self._items)
+        self._latitudes.append(coordinate.latitude)
+        self._longitudes.append(coordinate.longitude)
+        self._items.append(item)
+        self._cells.setdefault(self._cell(coordinate.latitude, coordinate.longitude), []).append(index)
+
+    def add_stages(self, name, stages):
+        '''
+        Adds the stages of the cache with the given name as items {'cache': name, 'stage': stage name}.
+
+        Returns the number of added stages, which excludes stages without static coordinates.
+        '''
+
+        added = 0
+        for stage in stages:
+            coordinate = StaticCoordinate.parse(stage.coordinates or '')
+            if coordinate:
+                self.add(coordinate, {'cache': name, 'stage': stage.name})
+                added += 1
+        return added
+
+    def within(self, coordinate, radius):
+        ''' Returns the list of tuples (distance, item) within radius meters of the Coordinate, nearest first. '''
+        return [(distance, self._items[index]) for distance, index in self._within(coordinate, radius)]
+
+    def nearest(self, coordinate, count):
+        ''' Returns the list of tuples (distance, item) of the count items nearest to the Coordinate, nearest first. '''
+
+        if count <= 0 or not self._items:
+            return []
+        if count >= len(self._items):
+            nearest = self._by_distance(coordinate, range(len(self._items)))
+        else:
+            # The farthest of the items in the nearest cells limits a radius query, which then also finds nearer items
+            # in other cells.
+            candidates = self._nearest_cells(coordinate, count)
+            radius = self._by_distance(coordinate, candidates)[count - 1][0]
+            nearest = self._within(coordinate, radius)[:count]
+        return [(distance, self._items[index]) for distance, index in nearest]
+
+    def close_pairs(self, radius):
+        '''
+        A generator returning the tuples (distance, item, other item) of all items within radius meters of each
+        other, e.g. the stages of different caches sharing a parking waypoint.
+        '''
+
+        for index, item in enumerate(self._items):
+            coordinate = Coordinate(self._latitudes[index], self._longitudes[index])
+            for distance, other in self._within(coordinate, radius):
+                if other > index:
+                    yield distance, item, self._items[other]
+
+    def save(self, path):
+        ''' Saves the index as JSON file. '''
+
+        with open(path, 'w') as file:
+            json.dump({'cell_size': self._cell_size,
+                       'entries': [[latitude, longitude, item] for latitude, longitude, item
+                                   in zip(self._latitudes, self._longitudes, self._items)]}, file)
+
+    @staticmethod
+    def load(path):
+        ''' Returns the index saved in the given JSON file. '''
+
+        try:
+            with open(path) as file:
+                content = json.load(file)
+            index = SpatialIndex(cell_size=content['cell_size'])
+            for latitude, longitude, item in content['entries']:
+                index.add(Coordinate(latitude, longitude), item)
+        except (ValueError, KeyError, TypeError) as exception:
+            raise CasprException('{0} is not a valid spatial index: {1}'.format(path, exception))
+        return index
+
+    def _within(self, coordinate, radius):
+        ''' Returns the list of tuples (distance, index) within radius meters of the Coordinate, nearest first. '''
+
+        latitude_span = math.degrees(radius / EARTH_RADIUS)
+        low, high = coordinate.latitude - latitude_span, coordinate.latitude + latitude_span
+        cosine = math.cos(math.radians(min(max(abs(low), abs(high)), 90)))
+        if cosine * EARTH_RADIUS * math.pi <= radius:  # close to a pole, all longitudes are nearby
+            longitude_span = 180
+        else:
+            longitude_span = math.degrees(radius / (EARTH_RADIUS * cosine))
+        indices = self._indices_in(low, high, coordinate.longitude - longitude_span,
+                                   coordinate.longitude + longitude_span)
+        return [result for result in self._by_distance(coordinate, indices) if result[0] <= radius]
+
+    def _by_distance(self, coordinate, indices):
+        ''' Returns the tuples (distance, index) of the given indices sorted by their distance to the coordinate. '''
+
+        indices = numpy.fromiter(indices, dtype=int)
+        if not len(indices):
+            return []
+        distances = haversine(coordinate.latitude, coordinate.longitude,
+                              numpy.take(self._latitudes, indices), numpy.take(self._longitudes, indices))
+        order = numpy.argsort(distances, kind='stable')
+        return [(float(distances[position]), int(indices[position])) for position in order]
+
+    def _nearest_cells(self, coordinate, count):
+        '''
+        Returns the indices of the items in the cells nearest to the coordinate in terms of cells, at least count.
+
+        Looks at growing rings of cells around the coordinate, unless there are fewer occupied cells than cells in the
+        ring, in which case it is cheaper to order the occupied cells by their ring.
+        '''
+
+        row, column = self._cell(coordinate.latitude, coordinate.longitude)
+        indices = []
+        seen = set()  # on coarse grids the rings wrap around
+        ring = 0
+        while len(indices) < count and 8 * ring <= len(self._cells):
+            for key in set(self._ring(row, column, ring)) - seen:
+                indices.extend(self._cells.get(key, []))
+                seen.add(key)
+            ring += 1
+        if len(indices) >= count:
+            return indices
+
+        indices = []
+        ring = None
+        for key in sorted(self._cells, key=lambda key: self._ring_of(key, row, column)):
+            if len(indices) >= count and self._ring_of(key, row, column) != ring:
+                break
+            ring = self._ring_of(key, row, column)
+            indices.extend(self._cells[key])
+        return indices
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self._cell_size)), self._column(longitude) % self._columns
+
+    def _column(self, longitude):
+        return int(math.floor((longitude + 180) / self._cell_size))
+
+    def _indices_in(self, low_latitude, high_latitude, low_longitude, high_longitude):
+        ''' A generator returning the indices of the items in all cells overlapping the given bounds. '''
+
+        low_row, low_column = self._cell(low_latitude, low_longitude)
+        high_row, _ = self._cell(high_latitude, high_longitude)
+        rows = high_row - low_row + 1
+        columns = min(self._column(high_longitude) - self._column(low_longitude) + 1, self._columns)
+        if rows * columns > len(self._cells):  # cheaper to check the occupied cells than to look up all cells
+            for (row, column), indices in self._cells.items():
+                if low_row <= row <= high_row and (column - low_column) % self._columns < columns:
+                    yield from indices
+            return
+        for row in range(low_row, high_row + 1):
+            for offset in range(columns):
+                yield from self._cells.get((row, (low_column + offset) % self._columns), [])
+
+    def _ring(self, row, column, ring):
+        ''' Returns the keys of the cells at the given distance in cells from the cell at row and column. '''
+
+        if ring == 0:
+            return [(row, column)]
+        keys = [(row + offset, column + side) for offset in range(-ring, ring + 1) for side in (-ring, ring)]
+        keys += [(row + side, column + offset) for offset in range(-ring + 1, ring) for side in (-ring, ring)]
+        return [(key_row, key_column % self._columns) for key_row, key_column in keys]
+
+    def _ring_of(self, key, row, column):
+        ''' Returns the distance in cells between the cell with the given key and the cell at row and column. '''
+
+        difference = abs(key[1] - column)
+        return max(abs(key[0] - row), min(difference, self._columns - difference))
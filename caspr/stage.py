@@ -4,6 +4,6 @@
 from collections import namedtuple
 
 
-Task = namedtuple('task', ['description', 'variables'])
+Task = namedtuple('Task', ['description', 'variables'])
 
-Stage = namedtuple('stage', ['name', 'coordinates', 'description', 'tasks'])
+Stage = namedtuple('Stage', ['name', 'coordinates', 'description', 'tasks'])
@@ -1,5 +1,7 @@
 import re
 
+EARTH_RADIUS = 6371000  # mean radius in meters
+
 
 class StaticCoordinate:
     # TODO(KNR): is there a coordinate parser library?
@@ -10,6 +12,8 @@ class StaticCoordinate:
                                                                 lattitude=_LATTITUDE_PATTERN))
     _COORDINATE_RE = re.compile('({longitude}\s+{lattitude})'.format(longitude=_LONGITUDE_PATTERN,
                                                                      lattitude=_LATTITUDE_PATTERN))
+    # Same as _COORDINATE_RE, but capturing the orientation, degrees, and minutes of both dimensions.
+    _PARTS_RE = re.compile(r'([NS])\s*(\d{1,2})[°]?\s+(\d{1,2}[.]\d{3})\s+([EW])\s*(\d{1,3})[°]?\s+(\d{1,2}[.]\d{3})')
 
     @staticmethod
     def match(input):
@@ -28,3 +32,110 @@ class StaticCoordinate:
     @staticmethod
     def filter(input):
         return re.sub(StaticCoordinate._PARTIAL_RE, '', input)
+
+    @staticmethod
+    def parse(input):
+        ''' Returns the first coordinate in the given text as Coordinate, or None if there is none. '''
+
+        match = StaticCoordinate._PARTS_RE.search(input)
+        if not match:
+            return None
+        north, latitude_degrees, latitude_minutes, east, longitude_degrees, longitude_minutes = match.groups()
+        latitude = int(latitude_degrees) + float(latitude_minutes) / 60
+        longitude = int(longitude_degrees) + float(longitude_minutes) / 60
+        return Coordinate(latitude=-latitude if north == 'S' else latitude,
+                          longitude=-longitude if east == 'W' else longitude)
+
+    @staticmethod
+    def parse_all(inputs):
+        '''
+        Returns the arrays of latitudes and longitudes of the first coordinate in each of the given texts, which are
+        NaN for texts without coordinate.
+
+        Only the matching is done per text, the conversion to decimal degrees is done for all coordinates at once.
+        '''
+
+        import numpy  # only imported when needed, as it takes long
+
+        matches = [StaticCoordinate._PARTS_RE.search(input) for input in inputs]
+        found = numpy.array([match is not None for match in matches], dtype=bool)
+        parts = [match.groups() for match in matches if match]
+        latitudes = numpy.full(len(matches), numpy.nan)
+        longitudes = numpy.full(len(matches), numpy.nan)
+        if not parts:
+            return latitudes, longitudes
+        numbers = numpy.array([number for part in parts for number in part[1:3] + part[4:6]], dtype=float)
+        degrees = numbers[0::2] + numbers[1::2] / 60
+        signs = numpy.array([-1 if orientation in 'SW' else 1 for part in parts for orientation in part[0::3]])
+        degrees *= signs
+        latitudes[found] = degrees[0::2]
+        longitudes[found] = degrees[1::2]
+        return latitudes, longitudes
+
+
+class Coordinate:
+    ''' A position in decimal degrees of WGS84, where south and west are negative. '''
+
+    __slots__ = ('latitude', 'longitude')
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def distance(self, other):
+        ''' Returns the great-circle distance to the other coordinate in meters. '''
+        return float(haversine(self.latitude, self.longitude, other.latitude, other.longitude))
+
+    def bearing(self, other):
+        ''' Returns the initial bearing towards the other coordinate in degrees clockwise from north. '''
+        return float(bearing(self.latitude, self.longitude, other.latitude, other.longitude))
+
+    def __eq__(self, other):
+        return (isinstance(other, Coordinate) and
+                (self.latitude, self.longitude) == (other.latitude, other.longitude))
+
+    def __hash__(self):
+        return hash((self.latitude, self.longitude))
+
+    def __repr__(self):
+        return 'Coordinate(latitude={0!r}, longitude={1!r})'.format(self.latitude, self.longitude)
+
+    def __str__(self):
+        ''' Returns the coordinate in the format used by geocaching.com, e.g. N 47° 03.204 E 008° 18.557. '''
+        return '{0} {1}'.format(Coordinate._format(self.latitude, 'NS', 2),
+                                Coordinate._format(self.longitude, 'EW', 3))
+
+    @staticmethod
+    def _format(degrees, orientations, width):
+        thousandths = int(round(abs(degrees) * 60000))  # rounding first avoids minutes like 60.000
+        whole, thousandths = divmod(thousandths, 60000)
+        return '{0} {1:0{2}d}° {3:06.3f}'.format(orientations[degrees < 0], whole, width, thousandths / 1000)
+
+
+def haversine(latitudes, longitudes, other_latitudes, other_longitudes):
+    ''' Returns the great-circle distances in meters between the given positions, which may be arrays. '''
+
+    import numpy
+
+    latitudes, longitudes = numpy.radians(latitudes), numpy.radians(longitudes)
+    other_latitudes, other_longitudes = numpy.radians(other_latitudes), numpy.radians(other_longitudes)
+    haversines = (numpy.sin((other_latitudes - latitudes) / 2) ** 2 +
+                  numpy.cos(latitudes) * numpy.cos(other_latitudes) *
+                  numpy.sin((other_longitudes - longitudes) / 2) ** 2)
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.minimum(numpy.sqrt(haversines), 1))
+
+
+def bearing(latitudes, longitudes, other_latitudes, other_longitudes):
+    '''
+    Returns the initial bearings in degrees clockwise from north from the given positions towards the other positions,
+    which may be arrays.
+    '''
+
+    import numpy
+
+    latitudes, other_latitudes = numpy.radians(latitudes), numpy.radians(other_latitudes)
+    differences = numpy.radians(numpy.subtract(other_longitudes, longitudes))
+    bearings = numpy.arctan2(numpy.sin(differences) * numpy.cos(other_latitudes),
+                             numpy.cos(latitudes) * numpy.sin(other_latitudes) -
+                             numpy.sin(latitudes) * numpy.cos(other_latitudes) * numpy.cos(differences))
+    return numpy.degrees(bearings) % 360
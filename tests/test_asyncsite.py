@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import os
+import tarfile
+import threading
+import time
+import unittest
+
+from caspr.asyncsite import AsyncGeocachingSite
+from caspr.caches import Caches
+from caspr.casprexception import CasprException
+from caspr.geocachingdotcom import DescriptionParser, PageParser, TableParser
+from caspr.ratelimit import Endpoint
+
+_SAMPLES = os.path.join(os.path.dirname(__file__), 'sample_data', 'samples.tar.bz2')
+_SAMPLE_PAGE = ('GC2A62B Seepromenade Luzern [DE_EN] (Multi-cache) in Zentralschweiz (ZG_SZ_LU_UR_OW_NW), '
+                'Switzerland created by Worlddiver.html')
+
+
+class ListingServer(ThreadingHTTPServer):
+    '''
+    Stands in for www.geocaching.com, serving recorded listing pages by their code as /geocache/<code>.
+
+    Records the connections and the greatest number of requests in flight at the same time. Each response is delayed
+    by delay seconds, so that concurrent requests overlap.
+    '''
+
+    daemon_threads = True
+    block_on_close = False  # a cancelled request may still be delayed
+
+    def __init__(self, pages, delay=0.0):
+        super().__init__(('127.0.0.1', 0), ListingHandler)
+        self.pages = pages
+        self.delay = delay
+        self.failures = {}  # the number of requests of each code answered with 503 before serving the page
+        self.connections = set()
+        self.cookies = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keeps connections alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.cookies.append(self.headers.get('Cookie'))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            code = self.path.rsplit('/', 1)[-1]
+            with server.lock:
+                failing = server.failures.get(code, 0) > 0
+                if failing:
+                    server.failures[code] -= 1
+            if failing:
+                self._respond(503, b'unavailable')
+            elif code not in server.pages:
+                self._respond(404, b'not found')
+            elif self.headers.get('If-None-Match') == '"{0}"'.format(code):
+                self._respond(304, b'', {'ETag': '"{0}"'.format(code)})
+            else:
+                self._respond(200, server.pages[code], {'ETag': '"{0}"'.format(code),
+                                                        'Content-Type': 'text/html; charset=utf-8'})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _listing():
+    with tarfile.open(_SAMPLES) as samples:
+        return samples.extractfile(_SAMPLE_PAGE).read()
+
+
+class TestAsyncGeocachingSite(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._listing = _listing()
+
+    def setUp(self):
+        self._server = ListingServer(pages={'GC2A62B': self._listing, 'GC1': b'<html>1</html>'})
+
+    def tearDown(self):
+        self._server.stop()
+
+    def _site(self, **kwargs):
+        return AsyncGeocachingSite(base_url=self._server.url, **kwargs)
+
+    def test_fetch_returns_recorded_page(self):
+        async def fetch():
+            async with self._site() as site:
+                return await site.fetch(code='GC2A62B')
+
+        page = asyncio.run(fetch())
+        self.assertEqual(page.content, self._listing)
+        self.assertEqual(page.encoding, 'utf-8')
+
+    def test_fetch_if_modified_returns_none_if_not_modified(self):
+        async def fetch():
+            async with self._site() as site:
+                return await site.fetch_if_modified(code='GC1', etag='"GC1"')
+
+        page, validators = asyncio.run(fetch())
+        self.assertIsNone(page)
+        self.assertEqual(validators.etag, '"GC1"')
+
+    def test_sends_cookies(self):
+        async def fetch():
+            async with self._site(cookies={'gspkauth': 'secret'}) as site:
+                await site.fetch(code='GC1')
+
+        asyncio.run(fetch())
+        self.assertEqual(self._server.cookies, ['gspkauth=secret'])
+
+    def test_connections_are_kept_alive(self):
+        async def fetch():
+            async with self._site(connections_per_host=1) as site:
+                for _ in range(3):
+                    await site.fetch(code='GC1')
+
+        asyncio.run(fetch())
+        self.assertEqual(len(self._server.connections), 1)
+
+    def test_limits_requests_in_flight_per_host(self):
+        self._server.delay = 0.05
+
+        async def fetch():
+            async with self._site(connections_per_host=2) as site:
+                return await asyncio.gather(*(site.fetch(code='GC1') for _ in range(6)))
+
+        pages = asyncio.run(fetch())
+        self.assertEqual(len(pages), 6)
+        self.assertEqual(self._server.max_in_flight, 2)
+
+    def test_fetch_can_be_cancelled(self):
+        self._server.delay = 2
+
+        async def fetch():
+            async with self._site() as site:
+                task = asyncio.ensure_future(site.fetch(code='GC1'))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        start = time.monotonic()
+        asyncio.run(fetch())
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_retries_unavailable_pages(self):
+        self._server.failures['GC1'] = 2
+        limiter = Endpoint(name='geocaching.com', backoff=0.01, concurrency=2)
+
+        async def fetch():
+            async with self._site(limiter=limiter) as site:
+                return await site.fetch(code='GC1')
+
+        self.assertEqual(asyncio.run(fetch()).content, b'<html>1</html>')
+        self.assertEqual(limiter.counters()['retries'], 2)
+
+    def test_requires_connection(self):
+        with self.assertRaises(CasprException):
+            AsyncGeocachingSite(connections_per_host=0)
+
+
+class WorksheetFake:
+    def __init__(self):
+        self.row_count = 1000
+        self.col_count = 26
+
+    def update(self, range_name, values, raw):
+        pass
+
+
+class WorksheetFactoryFake:
+    grid_store = None
+    limiter = None
+
+    def __init__(self):
+        self.names = []
+
+    def create(self, name, rows=1000, columns=26):
+        self.names.append(name)
+        return WorksheetFake()
+
+
+class TestPrepareAsync(unittest.TestCase):
+    def test_prepares_recorded_pages(self):
+        server = ListingServer(pages={code: _listing() for code in ('GC1', 'GC2', 'GC3')}, delay=0.02)
+        factory = WorksheetFactoryFake()
+
+        async def prepare():
+            async with AsyncGeocachingSite(base_url=server.url) as site:
+                caches = Caches(site=site,
+                                parser=PageParser(table_parser=TableParser(), description_parser=DescriptionParser()),
+                                factory=factory)
+                await caches.prepare_async(codes=['GC1', 'GC2', 'GC3'], fetchers=3)
+
+        try:
+            asyncio.run(prepare())
+        finally:
+            server.stop()
+        self.assertEqual(len(factory.names), 3)
+        self.assertTrue(all(name.startswith('GC2A62B') for name in factory.names))
+        self.assertEqual(server.max_in_flight, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
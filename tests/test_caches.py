@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from gspread.utils import a1_to_rowcol
 from unittest.mock import call, MagicMock, patch
+import asyncio
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
 from caspr.caches import Caches
+from caspr.casprexception import CasprException
+from caspr.geocachingdotcom import DescriptionParser, PageParser, TableParser
 from caspr.googledotcom import WorksheetFactory
+from caspr.journal import FAILED, Journal, PUBLISHED
+from caspr.page import Page
 from caspr.stage import Stage, Task
 
 
@@ -17,6 +27,25 @@ class WorksheetFactoryFake(WorksheetFactory):
         self._spreadsheets = MagicMock()
 
 
+# TODO(KNR): duplicate with test_googledotcom
+class WorksheetFake:
+    ''' Keeps the cells written by range updates. '''
+
+    def __init__(self):
+        self.cells = {}
+        self.calls = 0
+        self.row_count = 1000
+        self.col_count = 26
+
+    def update(self, range_name, values, raw):
+        self.calls += 1
+        first_row, first_column = a1_to_rowcol(range_name.split(':')[0])
+        for row, columns in enumerate(values):
+            for column, value in enumerate(columns):
+                if value:
+                    self.cells[(first_row + row, first_column + column)] = value
+
+
 class TestCaches(unittest.TestCase):
     # TODO(KNR): duplicate with test_googledotcom
     _SAMPLE_ADDRESSES = dict(zip(map(chr, range(ord('A'), ord('Z') + 1)), range(1, 27)))
@@ -46,6 +75,225 @@ class TestCaches(unittest.TestCase):
                                                                      stages=stages_mock,
                                                                      factory=factory_mock)])
 
+    @patch('caspr.caches.Caches._publish')
+    def test_prepares_caches_pipelined_in_order(self, publish_mock):
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=lambda code: 'page of {0}'.format(code))
+        parser_mock = MagicMock()
+        parser_mock.parse = MagicMock(side_effect=lambda page: {'name': page, 'stages': iter(['stage'])})
+        factory_mock = MagicMock()
+
+        caches = Caches(site=site_mock, parser=parser_mock, factory=factory_mock)
+        caches.prepare_pipelined(['A', 'B', 'C'], fetchers=3, parsers=2, publishers=1)
+
+        self.assertEqual(publish_mock.mock_calls, [call(name='page of A', stages=['stage'], factory=factory_mock),
+                                                   call(name='page of B', stages=['stage'], factory=factory_mock),
+                                                   call(name='page of C', stages=['stage'], factory=factory_mock)])
+
+    @patch('caspr.caches.Caches._publish')
+    def test_pipelined_preparation_raises_fetch_errors(self, publish_mock):
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=CasprException('fetch failed'))
+
+        caches = Caches(site=site_mock, parser=MagicMock(), factory=MagicMock())
+        with self.assertRaises(CasprException):
+            caches.prepare_pipelined(['A', 'B'])
+        self.assertFalse(publish_mock.called)
+
+    @patch('caspr.caches.publish_as_sheet')
+    def test_prepares_caches_in_processes_in_order(self, publish_mock):
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=lambda code: Page(
+            content='<html><head><title>{0}</title></head><body><span id="ctl00_ContentBody_LongDescription">'
+                    '<p>A = number of benches</p></span></body></html>'.format(code).encode('utf-8'),
+            encoding='utf-8'))
+        parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser(), streaming=True)
+        factory_mock = MagicMock()
+
+        caches = Caches(site=site_mock, parser=parser, factory=factory_mock)
+        caches.prepare_parallel(['A', 'B', 'C'], processes=2, chunksize=2)
+
+        self.assertEqual(publish_mock.mock_calls, [
+            call(name=code, rows=[[code, None], ['A = number of benches'], ['number of benches', 'A'], []],
+                 factory=factory_mock) for code in 'ABC'])
+
+    @patch('caspr.caches.publish_as_sheet')
+    def test_parallel_preparation_publishes_while_fetching(self, publish_mock):
+        events = []
+
+        def fetch(code):
+            events.append('fetch ' + code)
+            if code == 'F':
+                raise CasprException('fetch failed')
+            return Page(content='<html><head><title>{0}</title></head></html>'.format(code).encode('utf-8'),
+                        encoding='utf-8')
+
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=fetch)
+        publish_mock.side_effect = lambda name, rows, factory: events.append('publish ' + name)
+        parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser(), streaming=True)
+
+        caches = Caches(site=site_mock, parser=parser, factory=MagicMock())
+        with self.assertRaises(CasprException):
+            caches.prepare_parallel(['A', 'B', 'C', 'D', 'E', 'F'], processes=1, chunksize=2)
+        self.assertLess(events.index('publish A'), events.index('fetch F'))  # at most two chunks are fetched ahead
+        self.assertEqual([event for event in events if event.startswith('publish')],
+                         ['publish A', 'publish B', 'publish C', 'publish D', 'publish E'])
+
+    @patch('caspr.caches.Caches._publish')
+    def test_prepares_caches_asynchronously_in_order(self, publish_mock):
+        delays = {'A': 0.03, 'B': 0.01, 'C': 0.0}  # the first page arrives last
+        site = MagicMock()
+
+        async def fetch(code):
+            await asyncio.sleep(delays[code])
+            return 'page of {0}'.format(code)
+
+        site.fetch = fetch
+        parser_mock = MagicMock()
+        parser_mock.parse = MagicMock(side_effect=lambda page: {'name': page, 'stages': iter(['stage'])})
+        factory_mock = MagicMock()
+
+        caches = Caches(site=site, parser=parser_mock, factory=factory_mock)
+        asyncio.run(caches.prepare_async(['A', 'B', 'C'], fetchers=3))
+
+        self.assertEqual(publish_mock.mock_calls, [call(name='page of A', stages=['stage'], factory=factory_mock),
+                                                   call(name='page of B', stages=['stage'], factory=factory_mock),
+                                                   call(name='page of C', stages=['stage'], factory=factory_mock)])
+
+    @patch('caspr.caches.Caches._publish')
+    def test_asynchronous_preparation_cancels_pending_fetches(self, publish_mock):
+        cancelled = []
+        site = MagicMock()
+
+        async def fetch(code):
+            if code == 'A':
+                raise CasprException('fetch failed')
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(code)
+                raise
+
+        site.fetch = fetch
+        caches = Caches(site=site, parser=MagicMock(), factory=MagicMock())
+        with self.assertRaises(CasprException):
+            asyncio.run(caches.prepare_async(['A', 'B', 'C'], fetchers=3))
+        self.assertEqual(sorted(cancelled), ['B', 'C'])
+        self.assertFalse(publish_mock.called)
+
+    def test_asynchronous_preparation_can_be_cancelled(self):
+        started = []
+        cancelled = []
+        site = MagicMock()
+
+        async def fetch(code):
+            started.append(code)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(code)
+                raise
+
+        async def prepare():
+            site.fetch = fetch
+            task = asyncio.ensure_future(Caches(site=site, parser=MagicMock(), factory=MagicMock()).prepare_async(
+                ['A', 'B', 'C'], fetchers=2))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(prepare())
+        self.assertEqual(started, ['A', 'B'])  # at most fetchers pages are fetched at the same time
+        self.assertEqual(sorted(cancelled), ['A', 'B'])
+
+    def _failing_caches(self, failing):
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=lambda code: 'page of {0}'.format(code))
+        parser_mock = MagicMock()
+
+        def parse(page):
+            if page in failing:
+                raise CasprException('cannot parse {0}'.format(page))
+            return {'name': page, 'stages': iter(['stage'])}
+
+        parser_mock.parse = MagicMock(side_effect=parse)
+        return Caches(site=site_mock, parser=parser_mock, factory=MagicMock())
+
+    @patch('caspr.caches.Caches._publish')
+    def test_failing_cache_does_not_stop_others_with_journal(self, publish_mock):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        journal = Journal(path=os.path.join(directory, 'batch.jsonl'))
+        caches = self._failing_caches(failing={'page of B'})
+        for prepare in (caches.prepare, caches.prepare_pipelined):
+            journal.remove()
+            publish_mock.reset_mock()
+            with self.assertRaisesRegex(CasprException, '1 cache'):
+                prepare(['A', 'B', 'C'], journal=journal)
+            self.assertEqual([published[2]['name'] for published in publish_mock.mock_calls],
+                             ['page of A', 'page of C'])
+            self.assertEqual([journal.state(code) for code in 'ABC'], [PUBLISHED, FAILED, PUBLISHED])
+
+    @patch('caspr.caches.Caches._publish')
+    def test_rerun_resumes_from_journal(self, publish_mock):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'batch.jsonl')
+        with self.assertRaises(CasprException):
+            self._failing_caches(failing={'page of B'}).prepare(['A', 'B', 'C'], journal=Journal(path=path))
+        publish_mock.reset_mock()
+
+        caches = self._failing_caches(failing=set())
+        caches.prepare(['A', 'B', 'C'], journal=Journal(path=path))
+        self.assertEqual(caches._site.fetch.mock_calls, [call(code='B')])
+        self.assertEqual([published[2]['name'] for published in publish_mock.mock_calls], ['page of B'])
+
+    @patch('caspr.caches.Caches._publish')
+    def test_failing_fetch_does_not_stop_others_asynchronously_with_journal(self, publish_mock):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        journal = Journal(path=os.path.join(directory, 'batch.jsonl'))
+        site = MagicMock()
+
+        async def fetch(code):
+            if code == 'A':
+                raise CasprException('fetch failed')
+            return 'page of {0}'.format(code)
+
+        site.fetch = fetch
+        parser_mock = MagicMock()
+        parser_mock.parse = MagicMock(side_effect=lambda page: {'name': page, 'stages': iter(['stage'])})
+        caches = Caches(site=site, parser=parser_mock, factory=MagicMock())
+        with self.assertRaisesRegex(CasprException, 'A \\(fetch failed\\)'):
+            asyncio.run(caches.prepare_async(['A', 'B', 'C'], fetchers=2, journal=journal))
+        self.assertEqual([published[2]['name'] for published in publish_mock.mock_calls], ['page of B', 'page of C'])
+        self.assertEqual([journal.state(code) for code in 'ABC'], [FAILED, PUBLISHED, PUBLISHED])
+
+    @patch('caspr.caches.publish_as_sheet')
+    def test_failing_cache_does_not_stop_others_in_processes_with_journal(self, publish_mock):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        journal = Journal(path=os.path.join(directory, 'batch.jsonl'))
+        site_mock = MagicMock()
+        site_mock.fetch = MagicMock(side_effect=lambda code: Page(
+            content='<html><head><title>{0}</title></head></html>'.format(code).encode('utf-8')
+            if code != 'B' else b'', encoding='utf-8'))
+        parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser(), streaming=True)
+
+        caches = Caches(site=site_mock, parser=parser, factory=MagicMock())
+        with self.assertRaises(CasprException):
+            caches.prepare_parallel(['A', 'B', 'C'], processes=2, chunksize=3, journal=journal)
+        self.assertEqual([published[2]['name'] for published in publish_mock.mock_calls], ['A', 'C'])
+        self.assertEqual([journal.state(code) for code in 'ABC'], [PUBLISHED, FAILED, PUBLISHED])
+
+    def test_stages_and_pages_can_be_pickled(self):
+        stage = Stage(name='n', coordinates='c', description='d', tasks=[Task(description='t', variables='AB')])
+        page = Page(content=b'<html></html>', encoding=None)
+        self.assertEqual(pickle.loads(pickle.dumps(stage)), stage)
+        self.assertEqual(pickle.loads(pickle.dumps(page)), page)
+
     def test_generate_creates_new_sheet_if_not_exists(self):
         factory = WorksheetFactoryFake()
         factory._get_sheet = MagicMock(return_value=None)
@@ -61,23 +309,23 @@ class TestCaches(unittest.TestCase):
         self.assertFalse(factory._create_new_sheet.called)
 
     def test_generate_fills_in_a_stage_without_tasks(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='name',
                                       coordinates='coordinates',
                                       description='stage description',
                                       tasks=[])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='name'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='coordinates'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='stage description'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'name')
+        self.assertEqual(worksheet.cells[(1, 2)], 'coordinates')
+        self.assertEqual(worksheet.cells[(2, 1)], 'stage description')
 
     def test_generate_fills_in_two_stages_without_tasks(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='n1',
                                       coordinates='c1',
@@ -87,17 +335,17 @@ class TestCaches(unittest.TestCase):
                                                        description='sd2',
                                                        tasks=[])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='n1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='c1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='sd1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='n2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='c2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=1, val='sd2'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'n1')
+        self.assertEqual(worksheet.cells[(1, 2)], 'c1')
+        self.assertEqual(worksheet.cells[(2, 1)], 'sd1')
+        self.assertEqual(worksheet.cells[(3, 1)], 'n2')
+        self.assertEqual(worksheet.cells[(3, 2)], 'c2')
+        self.assertEqual(worksheet.cells[(4, 1)], 'sd2')
 
     def test_generate_fills_in_a_stage_with_single_task(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='name',
                                       coordinates='coordinates',
@@ -105,16 +353,16 @@ class TestCaches(unittest.TestCase):
                                       tasks=[Task(description='description',
                                                   variables='v')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='name'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='coordinates'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='stage description'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='description'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='v'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'name')
+        self.assertEqual(worksheet.cells[(1, 2)], 'coordinates')
+        self.assertEqual(worksheet.cells[(2, 1)], 'stage description')
+        self.assertEqual(worksheet.cells[(3, 1)], 'description')
+        self.assertEqual(worksheet.cells[(3, 2)], 'v')
 
     def test_generate_fills_in_a_stage_with_two_tasks(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='name',
                                       coordinates='coordinates',
@@ -123,18 +371,18 @@ class TestCaches(unittest.TestCase):
                                                   variables='v'), Task(description='d2',
                                                                        variables='w')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='name'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='coordinates'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='sd'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='d1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='v'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=1, val='d2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=2, val='w'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'name')
+        self.assertEqual(worksheet.cells[(1, 2)], 'coordinates')
+        self.assertEqual(worksheet.cells[(2, 1)], 'sd')
+        self.assertEqual(worksheet.cells[(3, 1)], 'd1')
+        self.assertEqual(worksheet.cells[(3, 2)], 'v')
+        self.assertEqual(worksheet.cells[(4, 1)], 'd2')
+        self.assertEqual(worksheet.cells[(4, 2)], 'w')
 
     def test_generate_fills_in_two_stages_with_two_tasks(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         # from nose.tools import set_trace; set_trace()
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='n1',
@@ -150,25 +398,25 @@ class TestCaches(unittest.TestCase):
                                                   variables='y'), Task(description='d4',
                                                                        variables='z')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='n1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='c1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='sd1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='d1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='v'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=1, val='d2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=2, val='w'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=6, col=1, val='n2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=6, col=2, val='c2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=7, col=1, val='sd2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=8, col=1, val='d3'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=8, col=2, val='y'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=9, col=1, val='d4'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=9, col=2, val='z'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'n1')
+        self.assertEqual(worksheet.cells[(1, 2)], 'c1')
+        self.assertEqual(worksheet.cells[(2, 1)], 'sd1')
+        self.assertEqual(worksheet.cells[(3, 1)], 'd1')
+        self.assertEqual(worksheet.cells[(3, 2)], 'v')
+        self.assertEqual(worksheet.cells[(4, 1)], 'd2')
+        self.assertEqual(worksheet.cells[(4, 2)], 'w')
+        self.assertEqual(worksheet.cells[(6, 1)], 'n2')
+        self.assertEqual(worksheet.cells[(6, 2)], 'c2')
+        self.assertEqual(worksheet.cells[(7, 1)], 'sd2')
+        self.assertEqual(worksheet.cells[(8, 1)], 'd3')
+        self.assertEqual(worksheet.cells[(8, 2)], 'y')
+        self.assertEqual(worksheet.cells[(9, 1)], 'd4')
+        self.assertEqual(worksheet.cells[(9, 2)], 'z')
 
     def test_generate_fills_in_a_stage_with_one_multi_variable_task(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='name',
                                       coordinates='coordinates',
@@ -176,17 +424,17 @@ class TestCaches(unittest.TestCase):
                                       tasks=[Task(description='description',
                                                   variables='vw')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='name'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='coordinates'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='stage description'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='description'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='v'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=2, val='w'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'name')
+        self.assertEqual(worksheet.cells[(1, 2)], 'coordinates')
+        self.assertEqual(worksheet.cells[(2, 1)], 'stage description')
+        self.assertEqual(worksheet.cells[(3, 1)], 'description')
+        self.assertEqual(worksheet.cells[(3, 2)], 'v')
+        self.assertEqual(worksheet.cells[(4, 2)], 'w')
 
     def test_generate_fills_in_complex_stages(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='n1',
                                       coordinates='c1',
@@ -201,31 +449,32 @@ class TestCaches(unittest.TestCase):
                                                   variables='e'), Task(description='d4',
                                                                        variables='fghi')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=1, col=1, val='n1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=1, col=2, val='c1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=2, col=1, val='sd1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=1, val='d1'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='a'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=2, val='b'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=5, col=2, val='c'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=6, col=1, val='d2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=6, col=2, val='d'), worksheet_mock.mock_calls)
-
-        self.assertIn(call.update_cell(row=8, col=1, val='n2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=8, col=2, val='c2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=9, col=1, val='sd2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=10, col=1, val='d3'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=10, col=2, val='e'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=11, col=1, val='d4'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=11, col=2, val='f'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=12, col=2, val='g'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=13, col=2, val='h'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=14, col=2, val='i'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(1, 1)], 'n1')
+        self.assertEqual(worksheet.cells[(1, 2)], 'c1')
+        self.assertEqual(worksheet.cells[(2, 1)], 'sd1')
+        self.assertEqual(worksheet.cells[(3, 1)], 'd1')
+        self.assertEqual(worksheet.cells[(3, 2)], 'a')
+        self.assertEqual(worksheet.cells[(4, 2)], 'b')
+        self.assertEqual(worksheet.cells[(5, 2)], 'c')
+        self.assertEqual(worksheet.cells[(6, 1)], 'd2')
+        self.assertEqual(worksheet.cells[(6, 2)], 'd')
+
+        self.assertEqual(worksheet.cells[(8, 1)], 'n2')
+        self.assertEqual(worksheet.cells[(8, 2)], 'c2')
+        self.assertEqual(worksheet.cells[(9, 1)], 'sd2')
+        self.assertEqual(worksheet.cells[(10, 1)], 'd3')
+        self.assertEqual(worksheet.cells[(10, 2)], 'e')
+        self.assertEqual(worksheet.cells[(11, 1)], 'd4')
+        self.assertEqual(worksheet.cells[(11, 2)], 'f')
+        self.assertEqual(worksheet.cells[(12, 2)], 'g')
+        self.assertEqual(worksheet.cells[(13, 2)], 'h')
+        self.assertEqual(worksheet.cells[(14, 2)], 'i')
+        self.assertEqual(worksheet.calls, 1)
 
     def test_merge_duplicate_variables_per_stage(self):
-        worksheet_mock = MagicMock()
+        worksheet = WorksheetFake()
         factory = WorksheetFactoryFake()
-        factory.create = MagicMock(return_value=worksheet_mock)
+        factory.create = MagicMock(return_value=worksheet)
         Caches._publish(name='irrelevant',
                         stages=[Stage(name='irrelevant',
                                       coordinates='irrelevant',
@@ -234,12 +483,12 @@ class TestCaches(unittest.TestCase):
                                                   variables='abc'), Task(description='d2',
                                                                          variables='abc')])],
                         factory=factory)
-        self.assertIn(call.update_cell(row=3, col=1, val='d1\nd2'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=3, col=2, val='a'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=4, col=2, val='b'), worksheet_mock.mock_calls)
-        self.assertIn(call.update_cell(row=5, col=2, val='c'), worksheet_mock.mock_calls)
-        self.assertNotIn(call.update_cell(row=6, col=1, val='d2'), worksheet_mock.mock_calls)
-        self.assertNotIn(call.update_cell(row=6, col=2, val='a'), worksheet_mock.mock_calls)
+        self.assertEqual(worksheet.cells[(3, 1)], 'd1\nd2')
+        self.assertEqual(worksheet.cells[(3, 2)], 'a')
+        self.assertEqual(worksheet.cells[(4, 2)], 'b')
+        self.assertEqual(worksheet.cells[(5, 2)], 'c')
+        self.assertNotEqual(worksheet.cells.get((6, 1)), 'd2')
+        self.assertNotEqual(worksheet.cells.get((6, 2)), 'a')
 
     def test_resolve_simple_dynamic_dimension(self):
         expected = ['="N"&" "&47&"° "&( C2 - C3 )&"."&( C2 * C6 - C5 * C6 - 3 * C3 )']
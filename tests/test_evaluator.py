@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import unittest
+
+import numpy
+
+from caspr.casprexception import CasprException
+from caspr.evaluator import digit_combinations, DimensionFormula, PositionFormula, positions, MAX_UNKNOWNS
+
+_VARIABLES = 'ABCDEFGHIJ'
+
+
+class TestDimensionFormula(unittest.TestCase):
+    def test_evaluates_constant_dimension(self):
+        dimension = DimensionFormula('|N| 47° 12.345', _VARIABLES)
+        self.assertAlmostEqual(float(dimension.evaluate({})), 47 + 12.345 / 60)
+
+    def test_concatenates_digits(self):
+        dimension = DimensionFormula('|E| 008° 1A.B(C+1)2 ', _VARIABLES)
+        self.assertEqual(dimension.variables, frozenset('ABC'))
+        self.assertAlmostEqual(float(dimension.evaluate({'A': 8, 'B': 3, 'C': 5})), 8 + 18.362 / 60)
+
+    def test_keeps_leading_zeros_of_multi_digit_variables(self):
+        dimension = DimensionFormula('|N| 47° 12.ABC', _VARIABLES)
+        self.assertAlmostEqual(float(dimension.evaluate({'A': 0, 'B': 4, 'C': 5})), 47 + 12.045 / 60)
+
+    def test_south_and_west_are_negative(self):
+        self.assertLess(float(DimensionFormula('|S| 1° 2.3', _VARIABLES).evaluate({})), 0)
+        self.assertLess(float(DimensionFormula('|W| 1° 2.3', _VARIABLES).evaluate({})), 0)
+
+    def test_evaluates_arrays(self):
+        dimension = DimensionFormula('|N| 47° A*2.1', _VARIABLES)
+        expected = 47 + numpy.array([0.1, 2.1, 4.1]) / 60
+        numpy.testing.assert_allclose(dimension.evaluate({'A': numpy.arange(3)}), expected)
+
+    def test_invalid_assignments_are_nan(self):
+        dimension = DimensionFormula('|N| 47° A.(B-1)/2', _VARIABLES)
+        results = dimension.evaluate({'A': numpy.array([61, 1, 1]), 'B': numpy.array([1, 0, 4])})
+        self.assertTrue(all(math.isnan(result) for result in results))
+
+    def test_bounds_contain_all_valid_values(self):
+        dimension = DimensionFormula('|N| 47° 1A.(B+1)C', _VARIABLES)
+        low, high = dimension.bounds({'A': (2, 3), 'B': (0, 9), 'C': (0, 9)})
+        values = dimension.evaluate({'A': numpy.array([[2], [3]]), 'B': numpy.arange(10), 'C': 5})
+        self.assertLessEqual(low, numpy.nanmin(values))
+        self.assertGreaterEqual(high, numpy.nanmax(values))
+        self.assertLess(high - low, 2 / 60.0)
+
+    def test_bounds_are_none_if_invalid(self):
+        self.assertIsNone(DimensionFormula('|N| 47° 6A.1', _VARIABLES).bounds({'A': (0, 9)}))
+        self.assertIsNone(DimensionFormula('|N| 47° A-5.1', _VARIABLES).bounds({'A': (0, 4)}))
+
+    def test_raises_if_value_missing(self):
+        with self.assertRaises(CasprException):
+            DimensionFormula('|N| 47° A.1', _VARIABLES).evaluate({})
+
+    def test_raises_if_not_a_dimension(self):
+        for text in ['47° 1.2', '|N| 47 1.2', '|N| 47° 1.2.3', '|N| 47° (A.1']:
+            with self.assertRaises(CasprException):
+                DimensionFormula(text, _VARIABLES)
+
+
+class TestPositionFormula(unittest.TestCase):
+    def _position(self):
+        return PositionFormula(DimensionFormula('|N| 47° 0A.1B2', _VARIABLES),
+                               DimensionFormula('|E| 008° 1C.345', _VARIABLES))
+
+    def test_raises_if_not_latitude_and_longitude(self):
+        latitude = DimensionFormula('|N| 47° 1.2', _VARIABLES)
+        with self.assertRaises(CasprException):
+            PositionFormula(latitude, latitude)
+
+    def test_brute_force_evaluates_all_combinations(self):
+        values, latitudes, longitudes = self._position().brute_force()
+        self.assertEqual(sorted(values), ['A', 'B', 'C'])
+        self.assertEqual(latitudes.shape, (1000,))
+        self.assertEqual(longitudes.shape, (1000,))
+        index = numpy.flatnonzero((values['A'] == 3) & (values['B'] == 4) & (values['C'] == 5))[0]
+        self.assertAlmostEqual(latitudes[index], 47 + 3.142 / 60)
+        self.assertAlmostEqual(longitudes[index], 8 + 15.345 / 60)
+
+    def test_brute_force_with_known_variables(self):
+        values, latitudes, _ = self._position().brute_force(known={'A': 3, 'B': 4})
+        self.assertEqual(list(values), ['C'])
+        numpy.testing.assert_allclose(latitudes, 47 + 3.142 / 60)
+
+    def test_brute_force_raises_if_too_many_unknowns(self):
+        formula = '|N| 47° {0}.1'.format('+'.join(_VARIABLES[:MAX_UNKNOWNS + 1]))
+        position = PositionFormula(DimensionFormula(formula, _VARIABLES), DimensionFormula('|E| 8° 1.2', _VARIABLES))
+        with self.assertRaises(CasprException):
+            position.brute_force()
+
+
+class TestPositions(unittest.TestCase):
+    def test_pairs_latitudes_with_following_longitudes(self):
+        formulae = ['|E| 1° 2.3', '|N| 47° A.1', '|N| 47° B.1', '|E| 008° C.1']
+        actual = [sorted(position.variables) for position in positions(formulae, _VARIABLES)]
+        self.assertEqual(actual, [['B', 'C']])
+
+    def test_digit_combinations(self):
+        combinations = digit_combinations(['A', 'B'])
+        self.assertEqual(len(set(zip(combinations['A'], combinations['B']))), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from caspr import formula
+from caspr.formula import FormulaLexer
+
+
+class TestFormulaLexer(unittest.TestCase):
+    def setUp(self):
+        self._lexer = FormulaLexer(variables='ABCDE')
+
+    def _kinds(self, text, orientations=True):
+        return [(token.kind, token.text) for token in self._lexer.tokenize(text, orientations=orientations)]
+
+    def test_tokenize_recognizes_all_kinds(self):
+        expected = [(formula.ORIENTATION, 'N'), (formula.SPACE, ' '), (formula.NUMBER, '47'),
+                    (formula.DEGREE, '°'), (formula.SPACE, ' '), (formula.OPEN, '['), (formula.VARIABLE, 'A'),
+                    (formula.OPERATOR, '+'), (formula.NUMBER, '1'), (formula.CLOSE, ']'), (formula.SEPARATOR, '.'),
+                    (formula.VARIABLE, 'B'), (formula.OPERATOR, 'x'), (formula.NUMBER, '3')]
+        self.assertEqual(self._kinds('N 47° [A+1].Bx3'), expected)
+
+    def test_tokenize_merges_text(self):
+        self.assertEqual(self._kinds('hallo welt'), [(formula.TEXT, 'hallo'), (formula.SPACE, ' '),
+                                                     (formula.TEXT, 'welt')])
+
+    def test_tokenize_keeps_positions(self):
+        text = 'bei N 47° 12.345'
+        self.assertEqual(''.join(token.text for token in self._lexer.tokenize(text)), text)
+        self.assertTrue(all(text[token.start:token.end] == token.text for token in self._lexer.tokenize(text)))
+
+    def test_tokenize_without_orientations(self):
+        self.assertEqual(self._kinds('N 47°', orientations=False)[0], (formula.TEXT, 'N'))
+
+    def test_orientation_without_degree_is_text(self):
+        self.assertEqual(self._kinds('N 47')[0], (formula.TEXT, 'N'))
+
+    def test_orientation_named_like_variable(self):
+        lexer = FormulaLexer(variables='ENS')
+        kinds = [token.kind for token in lexer.tokenize('N E7°')]
+        self.assertEqual(kinds, [formula.VARIABLE, formula.SPACE, formula.ORIENTATION, formula.NUMBER, formula.DEGREE])
+
+    def test_dimensions(self):
+        actual = [(orientation.text, dimension)
+                  for orientation, dimension in self._lexer.dimensions('N 47° AB.CDE E 008° 1A.2B3 und so')]
+        self.assertEqual(actual, [('N', ' 47° AB.CDE '), ('E', ' 008° 1A.2B3 ')])
+
+    def test_dimensions_accepts_west(self):
+        self.assertEqual([orientation.text for orientation, _ in self._lexer.dimensions('W 7° 1.A')], ['W'])
+
+    def test_dimensions_accepts_single_character_formulas(self):
+        self.assertEqual(list(dimension for _, dimension in self._lexer.dimensions('N 7° A.B')), [' 7° A.B'])
+
+    def test_dimensions_requires_separator(self):
+        self.assertEqual(list(self._lexer.dimensions('N 47° AB CDE')), [])
+
+    def test_split(self):
+        tokens = self._lexer.tokenize('47° AB.C+1', orientations=False)
+        self.assertEqual(list(formula.split(tokens)), [(True, '47'), (False, '° '), (True, 'AB'), (False, '.'),
+                                                       (True, 'C+1')])
+
+    def test_formulae_are_recognized(self):
+        lexer = FormulaLexer(variables='ABCDEFGHIJKLMNOPQRST')
+        given_formulae = [  # arbitrarily taken from GC2A62B
+            '[ B ]', '[ LR ]', '[ B - C ]', '[ B - G ]', '[ J - A ]', '[ C / E ]', '[ F - A ]', '[ O - L ]',
+            '[ D + K ]', '[ P - I ]', '[ IJ + L ]', '[ 2 x L + I ]', '[ T + K + 1 ]', '[ Q x LO + N ]',
+            '[  IKL - A x E ]', '[ N x B + O + P ]', '[ 3 x Q + N + R ]', '[ 4 + 2 x G x 10 ]', '[ GH x E - 4 + 100 ]',
+            '[ S x R + DR - 813 ]', '[ N x F + B x D - L ]', '[ B x F - E x F - 3 x C ]', '[ 2 x G x H + 2 x G + 8 ]',
+            '[ F x ( J + L + I ) - I ]', '[ F x ( B + D + 2 ) + B + 2 ]', '[ G x M x H + 2 x F + O + I ]',
+            '[ H x ( 2 x T + L ) + Q + K - 212 ]'
+        ]
+        for given in given_formulae:
+            self.assertEqual(list(formula.split(lexer.tokenize(given, orientations=False))), [(True, given)],
+                             'formula {0} not recognized'.format(given))
+
+    def test_dynamic_dimensions_are_recognized(self):
+        lexer = FormulaLexer(variables='ABCDEFGHIJKLMNOPQRST')
+        given_coordinates = [  # arbitrarily taken from GC2A62B
+            'N 47° [ B - C ].[ B x F - E x F - 3 x C ]', 'E 008° [ B ].[ F x ( B + D + 2 ) + B + 2 ]',
+            'N 47° [ B - G ].[ 2 x G x H + 2 x G + 8 ]', 'E 008° [ B ].[ GH x E - 4 + 100 ]',
+            'N 47° [ J - A ].[ 4 + 2 x G x 10 ]', 'E 008° [ IJ + L ].[  IKL - A x E ]',
+            'N 47° [ C / E ].[ F x ( J + L + I ) - I ]', 'E 008° [ F - A ].[ N x F + B x D - L ]',
+            'N 47° [ O - L ].[ N x B + O + P ]', 'E 008° [ D + K ].[ G x M x H + 2 x F + O + I ]',
+            'N 47° [ P - I ].[ 3 x Q + N + R ]', 'E 008° [ LR ].[ Q x LO + N ]',
+            'N 47° [ 2 x L + I ].[ H x ( 2 x T + L ) + Q + K - 212 ]', 'E 008° [ T + K + 1 ].[ S x R + DR - 813 ]'
+        ]
+        for given in given_coordinates:
+            self.assertEqual([(orientation.text, dimension) for orientation, dimension in lexer.dimensions(given)],
+                             [(given[0], given[1:])], 'dynamic coordinates {0} not recognized'.format(given))
+
+    def _masked(self, text):
+        ''' Returns the text with the orientations of the dimensions masked, e.g. N by |N|. '''
+
+        lexer = FormulaLexer(variables='ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        return ''.join('|{0}|'.format(token.text) if token.kind == formula.ORIENTATION else token.text
+                       for token in lexer.tokenize(text))
+
+    def test_orientations_without_degree_are_not_marked(self):
+        given = 'Der Schatz liegt bei N 47 PQ.RST E 008 VW.XYZ, wobei'
+        self.assertEqual(self._masked(given), given)
+
+    def test_orientation_of_single_dimension_is_marked(self):
+        self.assertEqual(self._masked('Der Schatz liegt bei N 47° PQ.RST, wobei'),
+                         'Der Schatz liegt bei |N| 47° PQ.RST, wobei')
+
+    def test_orientations_of_both_dimensions_are_marked(self):
+        self.assertEqual(self._masked('Der Schatz liegt bei N 47° PQ.ABC E 008° VW.XYZ, wobei'),
+                         'Der Schatz liegt bei |N| 47° PQ.ABC |E| 008° VW.XYZ, wobei')
+
+    def test_orientation_is_not_taken_for_variable(self):
+        self.assertEqual(self._masked('Der Schatz liegt bei N 47° PQ.RST E 008° VW.XYZ, wobei'),
+                         'Der Schatz liegt bei |N| 47° PQ.RST |E| 008° VW.XYZ, wobei')
+
+    def test_orientations_of_static_coordinates_are_marked(self):
+        self.assertEqual(self._masked('Der Schatz liegt bei N 47° 12.345 E 008° 12.345, wobei'),
+                         'Der Schatz liegt bei |N| 47° 12.345 |E| 008° 12.345, wobei')
+
+    def test_adversarial_description_takes_linear_time(self):
+        def duration(repetitions):
+            text = 'N 1A 2B ' * repetitions + '°'
+            start = time.perf_counter()
+            list(self._lexer.dimensions(text))
+            return time.perf_counter() - start
+
+        duration(100)  # warm up
+        self.assertLess(duration(8000), 40 * duration(1000) + 0.05)
+
+
+class TestFormulaSyntax(unittest.TestCase):
+    _ADDRESSES = {'A': 0, 'B': 1, 'C': 2}
+
+    def _parse(self, text):
+        return formula.parse(FormulaLexer(variables='ABC').tokenize(text, orientations=False))
+
+    def test_parse_respects_precedence(self):
+        syntax_tree = self._parse('A+B*2').expression
+        self.assertIsInstance(syntax_tree, formula.BinaryOperation)
+        self.assertEqual(syntax_tree.operator, '+')
+        self.assertIsInstance(syntax_tree.right, formula.BinaryOperation)
+        self.assertEqual(syntax_tree.right.operator, '*')
+
+    def test_parse_multi_digit_variables(self):
+        self.assertEqual(self._parse('AB').expression, formula.Digits(space='', variables=('A', 'B')))
+
+    def test_parse_groups_and_unary_operations(self):
+        syntax_tree = self._parse('-(A)').expression
+        self.assertIsInstance(syntax_tree, formula.UnaryOperation)
+        self.assertIsInstance(syntax_tree.operand, formula.Group)
+
+    def test_parse_keeps_invalid_formula_as_sequence(self):
+        for text in ['()', '(A', 'A+', '2A', 'A Q']:
+            self.assertIsInstance(self._parse(text).expression, formula.Sequence, text)
+
+    def test_to_a1(self):
+        self.assertEqual(formula.to_a1(self._parse(' A + BC * [2 - A] '), self._ADDRESSES),
+                         ' C0 + (10*C1+1*C2) * [2 - C0] ')
+
+    def test_to_a1_keeps_invalid_formula(self):
+        self.assertEqual(formula.to_a1(self._parse('(A +'), self._ADDRESSES), '(C0 +')
+
+    def test_to_a1_keeps_unknown_variables(self):
+        self.assertEqual(formula.to_a1(self._parse('A+B'), {'A': 7}), 'C7+B')
+
+    def test_to_r1c1(self):
+        self.assertEqual(formula.to_r1c1(self._parse('AB+C'), self._ADDRESSES), '(10*R0C3+1*R1C3)+R2C3')
+
+    def test_expands_long_multi_digit_variables_once(self):
+        self.assertEqual(formula.to_a1(self._parse('CAAB'), self._ADDRESSES), '(1000*C2+100*C0+10*C0+1*C1)')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,20 +4,26 @@
 from lxml import html
 from unittest.mock import MagicMock, patch
 from urllib.parse import quote_plus
+import json
 import os
 import shutil
 import tarfile
 import tempfile
+import time
 import unittest
 import responses
 
 from caspr.casprexception import CasprException
 from caspr.geocachingdotcom import GeocachingSite, DescriptionParser, PageParser, TableParser
+from caspr.page import Page
+from caspr.ratelimit import Endpoint, RetryableStatus
 from caspr.stage import Stage, Task
 
 _SAMPLE_TABLE_PATH = ('GC2A62B Seepromenade Luzern [DE_EN] (Multi-cache) in Zentralschweiz (ZG_SZ_LU_UR_OW_NW), '
                       'Switzerland created by Worlddiver.html')
 
+_EMPTY_PAGE = '<html><head><title>name</title></head><body></body></html>'
+
 
 def _urlencode_parameter(name, value):
     return '{0}={1}'.format(quote_plus(name), quote_plus(value))
@@ -44,6 +50,10 @@ class TestCaspr(unittest.TestCase):
             self._login_failed_page_content = file.read()
         with open(os.path.join(_SAMPLE_DATA.temp_path, 'cache.html')) as file:
             self._cache_page_content = file.read()
+        self._temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_path)
 
     @responses.activate
     def test_prepare_session_with_correct_password(self):
@@ -67,20 +77,156 @@ class TestCaspr(unittest.TestCase):
             GeocachingSite('Jane Doe', 'wrong_password')
         self.assertIn('Logging in to www.geocaching.com as Jane Doe failed.', context.exception.args[0])
 
+    @responses.activate
+    def test_login_stores_session_cookies(self):
+        cookie_file = os.path.join(self._temp_path, 'cookies.json')
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx',
+                      headers={'Set-Cookie': 'gspkauth=secret; Domain=.geocaching.com; Path=/'})
+        GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        with open(cookie_file) as file:
+            stored = json.load(file)
+        self.assertEqual(stored['user'], 'Jane Doe')
+        self.assertEqual([(c['name'], c['value']) for c in stored['cookies']], [('gspkauth', 'secret')])
+        self.assertEqual(os.stat(cookie_file).st_mode & 0o777, 0o600)
+
+    @responses.activate
+    def test_valid_session_cookies_skip_login(self):
+        cookie_file = self._store_cookies(user='Jane Doe', expires=time.time() + 3600)
+        responses.add(responses.GET, 'https://www.geocaching.com/my/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content)
+        site = GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        site.fetch('ABCDEF')
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[0].request.url, 'https://www.geocaching.com/my/default.aspx')
+        self.assertEqual(responses.calls[1].request.headers['Cookie'], 'gspkauth=secret')
+
+    @responses.activate
+    def test_rejected_session_cookies_require_login(self):
+        cookie_file = self._store_cookies(user='Jane Doe', expires=None)
+        responses.add(responses.GET, 'https://www.geocaching.com/my/default.aspx', status=302,
+                      headers={'Location': 'https://www.geocaching.com/login/default.aspx'})
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(responses.calls[2].request.method, 'POST')
+
+    @responses.activate
+    def test_expired_session_cookies_require_login_without_check(self):
+        cookie_file = self._store_cookies(user='Jane Doe', expires=time.time() - 1)
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        self.assertEqual([call.request.method for call in responses.calls], ['GET', 'POST'])
+        self.assertEqual(responses.calls[0].request.url, 'https://www.geocaching.com/login/default.aspx')
+
+    @responses.activate
+    def test_session_cookies_of_other_user_require_login(self):
+        cookie_file = self._store_cookies(user='John Doe', expires=None)
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_broken_cookie_file_requires_login(self):
+        cookie_file = os.path.join(self._temp_path, 'cookies.json')
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        for broken in ('{', '[]', '{"user": "Jane Doe"}', '{"user": "Jane Doe", "cookies": [{"name": "gspkauth"}]}',
+                       '{"user": "Jane Doe", "cookies": [1]}'):
+            with open(cookie_file, 'w') as file:
+                file.write(broken)
+            GeocachingSite('Jane Doe', 'password', cookie_file=cookie_file)
+        self.assertEqual([call.request.method for call in responses.calls], ['GET', 'POST'] * 5)
+
+    def _store_cookies(self, user, expires):
+        cookie_file = os.path.join(self._temp_path, 'cookies.json')
+        with open(cookie_file, 'w') as file:
+            json.dump({'user': user, 'cookies': [{'name': 'gspkauth', 'value': 'secret', 'domain': '.geocaching.com',
+                                                  'path': '/', 'expires': expires, 'secure': False}]}, file)
+        return cookie_file
+
     @responses.activate
     def test_fetch_returns_cache_page(self):
         responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
         responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
         responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content)
         site = GeocachingSite('Jane Doe', 'password')
-        site.fetch('ABCDEF')
+        page = site.fetch('ABCDEF')
         self.assertEqual(len(responses.calls), 3)
         self.assertEqual(responses.calls[2].request.url, 'http://www.geocaching.com/geocache/ABCDEF')
+        self.assertEqual(page.content, bytes(self._cache_page_content, 'UTF-8'))
+
+    @responses.activate
+    def test_fetch_if_modified_sends_validators(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', status=304, headers={'ETag': '"2"'})
+        site = GeocachingSite('Jane Doe', 'password')
+        page, validators = site.fetch_if_modified('ABCDEF', etag='"1"', last_modified='Mon, 07 Sep 2015 19:54:00 GMT')
+        self.assertIsNone(page)
+        self.assertEqual(validators.etag, '"2"')
+        self.assertEqual(responses.calls[2].request.headers['If-None-Match'], '"1"')
+        self.assertEqual(responses.calls[2].request.headers['If-Modified-Since'], 'Mon, 07 Sep 2015 19:54:00 GMT')
+
+    @responses.activate
+    def test_fetch_if_modified_returns_modified_page(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content,
+                      headers={'Last-Modified': 'Mon, 07 Sep 2015 19:54:00 GMT'})
+        site = GeocachingSite('Jane Doe', 'password')
+        page, validators = site.fetch_if_modified('ABCDEF', etag='"1"')
+        self.assertEqual(page.content, bytes(self._cache_page_content, 'UTF-8'))
+        self.assertEqual(validators.last_modified, 'Mon, 07 Sep 2015 19:54:00 GMT')
+
+    @responses.activate
+    def test_fetch_returns_declared_encoding(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content,
+                      content_type='text/html; charset=utf-8')
+        site = GeocachingSite('Jane Doe', 'password')
+        self.assertEqual(site.fetch('ABCDEF').encoding, 'utf-8')
+
+    @responses.activate
+    def test_fetch_leaves_undeclared_encoding_to_parser(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content,
+                      content_type='text/html')
+        site = GeocachingSite('Jane Doe', 'password')
+        self.assertIsNone(site.fetch('ABCDEF').encoding)
+
+    @responses.activate
+    def test_fetch_retries_throttled_requests(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', status=429,
+                      headers={'Retry-After': '0'})
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', status=503)
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', body=self._cache_page_content)
+        limiter = Endpoint(name='geocaching.com', backoff=0)
+        site = GeocachingSite('Jane Doe', 'password', limiter=limiter)
+        self.assertEqual(site.fetch('ABCDEF').content, bytes(self._cache_page_content, 'UTF-8'))
+        self.assertEqual(limiter.counters()['retries'], 2)
+
+    @responses.activate
+    def test_fetch_raises_throttled_requests_without_limiter(self):
+        responses.add(responses.GET, 'https://www.geocaching.com/login/default.aspx', body=self._login_page_content)
+        responses.add(responses.POST, 'https://www.geocaching.com/login/default.aspx')
+        responses.add(responses.GET, 'http://www.geocaching.com/geocache/ABCDEF', status=429)
+        site = GeocachingSite('Jane Doe', 'password')
+        with self.assertRaises(RetryableStatus):
+            site.fetch('ABCDEF')
 
 
 class TestPageParser(unittest.TestCase):
     @patch('caspr.geocachingdotcom.html')
     def test_parse_calls_html_parse(self, html_mock):
+        html_mock.parse.return_value.getroot.return_value = html.fromstring(_EMPTY_PAGE)
         parser = PageParser(table_parser=MagicMock(), description_parser=None)
         parser.parse(page='irrelevant')
         self.assertTrue(html_mock.parse.called)
@@ -88,11 +234,51 @@ class TestPageParser(unittest.TestCase):
 
     @patch('caspr.geocachingdotcom.html')
     def test_parse_calls_parse_on_table_parser(self, html_mock):
+        html_mock.parse.return_value.getroot.return_value = html.fromstring(_EMPTY_PAGE)
         table_parser_mock = MagicMock()
         parser = PageParser(table_parser=table_parser_mock, description_parser=None)
         parser.parse(page='irrelevant')
         self.assertTrue(table_parser_mock.parse.called)
 
+    def test_parse_page_from_memory_equals_parse_from_file(self):
+        path = os.path.join(_SAMPLE_DATA.temp_path, _SAMPLE_TABLE_PATH)
+        with open(path, 'rb') as file:
+            page = Page(content=file.read(), encoding=None)
+        parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser())
+        from_file = parser.parse(page=path)
+        from_file = {'name': from_file['name'], 'stages': list(from_file['stages'])}
+        from_memory = parser.parse(page=page)
+        self.assertEqual(from_memory['name'], from_file['name'])
+        self.assertEqual(list(from_memory['stages']), from_file['stages'])
+        self.assertEqual(len(from_file['stages']), 9)
+
+    def test_streaming_parse_equals_parse(self):
+        path = os.path.join(_SAMPLE_DATA.temp_path, _SAMPLE_TABLE_PATH)
+        with open(path, 'rb') as file:
+            page = Page(content=file.read(), encoding=None)
+        parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser())
+        streaming_parser = PageParser(table_parser=TableParser(), description_parser=DescriptionParser(),
+                                      streaming=True)
+        expected = parser.parse(page=page)
+        expected = {'name': expected['name'], 'stages': list(expected['stages'])}
+        for source in (page, path):
+            actual = streaming_parser.parse(page=source)
+            self.assertEqual(actual['name'], expected['name'])
+            self.assertEqual(list(actual['stages']), expected['stages'])
+
+    @patch('caspr.geocachingdotcom.STREAM_CHUNK_SIZE', 16)
+    def test_stream_root_keeps_only_sections(self):
+        content = ('<html><head><title>GC0 name</title><script>var x = 1;</script></head><body>'
+                   '<div><span id="uxLatLon">N 47° 03.204 E 008° 18.557</span><ul><li>log</li></ul></div>'
+                   '<span id="ctl00_ContentBody_LongDescription"><p>A <span>= 1</span></p><svg><title>x</title></svg>'
+                   '</span><p>footer</p></body></html>').encode('utf-8')
+        root = PageParser._stream_root(Page(content=content, encoding='utf-8'))
+        self.assertEqual(html.tostring(root, encoding='unicode'),
+                         '<html><head><title>GC0 name</title></head><body>'
+                         '<span id="uxLatLon">N 47° 03.204 E 008° 18.557</span>'
+                         '<span id="ctl00_ContentBody_LongDescription"><p>A <span>= 1</span></p><svg><title>x</title>'
+                         '</svg></span></body></html>')
+
     # TODO(KNR): add test that description parser is called
 
     def test_single_iteration_if_table_empty(self):
@@ -127,34 +313,40 @@ class TestPageParser(unittest.TestCase):
 
 
 class TestTableParser(unittest.TestCase):
-    @patch('caspr.geocachingdotcom.html')
-    def test_parse_calls_html_xpath(self, html_mock):
-        root_mock = MagicMock()
-        table_parser = TableParser()
-        table_parser.parse(root=root_mock)
-        self.assertTrue(root_mock.xpath.called)
-
     def test_no_iteration_if_stages_empty(self):
         parser = TableParser()
-        stages = parser.parse(root=MagicMock())
+        stages = parser.parse(root=html.fromstring(_EMPTY_PAGE))
         self.assertEqual(len(list(stages)), 0)
 
+    def test_parse_keeps_waypoints_aligned_if_cells_are_empty(self):
+        rows = ('<tr>{0}<td>Stage 1</td><td>N 47° 03.204 E 008° 18.557</td><td></td></tr>'
+                '<tr><td></td><td></td><td>first note</td></tr>'
+                '<tr>{0}<td>Stage 2</td><td>???</td><td></td></tr>'
+                '<tr><td></td><td></td><td></td></tr>'
+                '<tr>{0}<td></td><td>N 47° 03.300 E 008° 18.600</td><td></td></tr>'
+                '<tr><td></td><td></td><td>third note</td></tr>').format('<td></td>' * 5)
+        root = html.fromstring('<html><body><table id="ctl00_ContentBody_Waypoints"><tbody>{0}</tbody></table>'
+                               '</body></html>'.format(rows))
+        stages = list(TableParser().parse(root=root))
+        self.assertEqual([(stage['name'], stage['coordinates'], stage['description']) for stage in stages],
+                         [('Stage 1', 'N 47° 03.204 E 008° 18.557', 'first note'),
+                          ('Stage 2', None, ''),
+                          ('', 'N 47° 03.300 E 008° 18.600', 'third note')])
+
     @patch('caspr.geocachingdotcom.StaticCoordinate')
-    def test_generator_calls_filter(self, coordinate_filter_mock):
-        table_parser = TableParser()
-        table_parser._names = ['irrelevant_name']
-        table_parser._coordinates = ['to_filter']
-        table_parser._descriptions = ['irrelevant_description']
-        generator = table_parser._generator()
-        list(generator)
+    def test_parse_calls_filter(self, coordinate_filter_mock):
+        root = html.fromstring('<html><body><table id="ctl00_ContentBody_Waypoints"><tbody><tr>{0}<td>name</td>'
+                               '<td>to_filter</td><td></td></tr></tbody></table></body></html>'.format('<td></td>' * 5))
+        list(TableParser().parse(root=root))
         coordinate_filter_mock.match.assert_called_with('to_filter')
 
-    def test_parse_sets_raw_coordinates_of_sample_file(self):
+    @patch('caspr.geocachingdotcom.StaticCoordinate')
+    def test_parse_returns_raw_coordinates_of_sample_file(self, coordinate_filter_mock):
+        coordinate_filter_mock.match.side_effect = lambda coordinates: coordinates
         path = os.path.join(_SAMPLE_DATA.temp_path, _SAMPLE_TABLE_PATH)
         root = html.parse(filename_or_url=path)
-        table_parser = TableParser()
-        table_parser.parse(root=root)
-        self.assertEqual(table_parser._names,
+        stages = list(TableParser().parse(root=root))
+        self.assertEqual([stage['name'] for stage in stages],
                          ['Stage 1: Schwanenplatz (Virtuelle Station)',
                           'Stage 2: Pavillion (Virtuelle Station)',
                           'Stage 3: Restaurant (Virtuelle Station)',
@@ -163,7 +355,7 @@ class TestTableParser(unittest.TestCase):
                           'Stage 6: Abkühlung (Virtuelle Station)',
                           'Stage 7: Dichter und Patriot (Virtuelle Station)',
                           'Stage 8: Guisan (Virtuelle Station)'])
-        self.assertEqual(table_parser._coordinates,
+        self.assertEqual([stage['coordinates'] for stage in stages],
                          ['\n                N 47° 03.204 E 008° 18.557\xa0\n                \n            ',
                           '\n                ???\xa0\n                \n            ',
                           '\n                ???\xa0\n                \n            ',
@@ -172,7 +364,7 @@ class TestTableParser(unittest.TestCase):
                           '\n                ???\xa0\n                \n            ',
                           '\n                ???\xa0\n                \n            ',
                           '\n                ???\xa0\n                \n            '])
-        self.assertEqual(table_parser._descriptions, [
+        self.assertEqual([stage['description'] for stage in stages], [
             'Halte nach einem grossen Schriftzug mit einer Krone Ausschau.\nA = wieviele Zacken hat die Krone?\nBCDEF = wandle den Namen nach dem System A=1, B=2... um\nLook out for a big lettering with a crown.\nA = amount of spikes of the crown\nBCDEF = transform the name according to the system A=1, B=2...\n__________________________________________\nRechne / calculate:\nN 47° [ B - C ].[ B x F - E x F - 3 x C ]\nE 008° [ B ].[ F x ( B + D + 2 ) + B + 2 ]',
             'G = zähle die Anzahl grüner Laternen?\nH = auf wie vielen Füssen stehen die beiden Springbrunnen insgesamt (Mittelsockel nicht mit gezählt)?\nG = number of green lamps?\nH = total amount of legs the two fountains are standing on (middle part not counted)?\n_____________________________________________\nRechne / calculate:\nN 47° [ B - G ].[ 2 x G x H + 2 x G + 8 ]\nE 008° [ B ].[ GH x E - 4 + 100 ]',
             'IJKL = Name des Restaurants\nIJKL = name of the restaurant\n_____________________________________________\nRechne / calculate:\nN 47° [ J - A ].[ 4 + 2 x G x 10 ]\nE 008° [ IJ + L ].[  IKL - A x E ]',
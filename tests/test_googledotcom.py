@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import re
+from unittest.mock import MagicMock, patch
+import gspread
+import os
+import shutil
+import tempfile
 import unittest
 
+from caspr.caches import Caches
 from caspr.casprexception import CasprException
-from caspr.googledotcom import FormulaConverter
+from caspr.googledotcom import _changed_blocks, _create_lexer, _grow, FormulaConverter, HEADROOM_COLUMNS, HEADROOM_ROWS
+from caspr.googledotcom import publish_as_sheet, SheetIndex, WorksheetFactory
+from caspr.gridstore import GridStore
+from caspr.ratelimit import Endpoint, RetryableStatus
 
 
 class Anything:
@@ -13,6 +21,24 @@ class Anything:
         return True
 
 
+class WorksheetFake:
+    ''' Records the range updates of a worksheet. '''
+
+    def __init__(self, rows=1000, columns=26):
+        self.updates = []
+        self.row_count = rows
+        self.col_count = columns
+
+    def update(self, range_name, values, raw):
+        self.updates.append((range_name, values))
+
+    def add_rows(self, rows):
+        self.row_count += rows
+
+    def add_cols(self, columns):
+        self.col_count += columns
+
+
 class TestFormulaConverter(unittest.TestCase):
     _SAMPLE_ADDRESSES = dict(zip(map(chr, range(ord('A'), ord('Z') + 1)), range(1, 27)))
 
@@ -64,86 +90,311 @@ class TestFormulaConverter(unittest.TestCase):
         actual = converter._resolve_formula(text='AB')
         self.assertEqual(actual, expected)
 
-    def test_matching_formulae(self):
-        given_formulae = [  # arbitrarily taken from GC2A62B
-            '[ B ]', '[ LR ]', '[ B - C ]', '[ B - G ]', '[ J - A ]', '[ C / E ]', '[ F - A ]', '[ O - L ]',
-            '[ D + K ]', '[ P - I ]', '[ IJ + L ]', '[ 2 x L + I ]', '[ T + K + 1 ]', '[ Q x LO + N ]',
-            '[  IKL - A x E ]', '[ N x B + O + P ]', '[ 3 x Q + N + R ]', '[ 4 + 2 x G x 10 ]', '[ GH x E - 4 + 100 ]',
-            '[ S x R + DR - 813 ]', '[ N x F + B x D - L ]', '[ B x F - E x F - 3 x C ]', '[ 2 x G x H + 2 x G + 8 ]',
-            '[ F x ( J + L + I ) - I ]', '[ F x ( B + D + 2 ) + B + 2 ]', '[ G x M x H + 2 x F + O + I ]',
-            '[ H x ( 2 x T + L ) + Q + K - 212 ]'
-        ]
-        formula = FormulaConverter._FORMULA.format(ws=FormulaConverter._WS,
-                                                   braces=FormulaConverter._BRACES,
-                                                   math_ops=FormulaConverter._MATH_OPS,
-                                                   casual_math_ops=FormulaConverter._CASUAL_MATH_OPS,
-                                                   variables='[ABCDEFGHIJKLMNOPQRST]')
-        for given in given_formulae:
-            self.assertTrue(re.match(formula, given), 'formula {0} not recognized'.format(given))
-
-    def test_matching_dynamic_dimension(self):
-        given_coordinates = [  # arbitrarily taken from GC2A62B
-            '|N| 47° [ B - C ].[ B x F - E x F - 3 x C ]', '|E| 008° [ B ].[ F x ( B + D + 2 ) + B + 2 ]',
-            '|N| 47° [ B - G ].[ 2 x G x H + 2 x G + 8 ]', '|E| 008° [ B ].[ GH x E - 4 + 100 ]',
-            '|N| 47° [ J - A ].[ 4 + 2 x G x 10 ]', '|E| 008° [ IJ + L ].[  IKL - A x E ]',
-            '|N| 47° [ C / E ].[ F x ( J + L + I ) - I ]', '|E| 008° [ F - A ].[ N x F + B x D - L ]',
-            '|N| 47° [ O - L ].[ N x B + O + P ]', '|E| 008° [ D + K ].[ G x M x H + 2 x F + O + I ]',
-            '|N| 47° [ P - I ].[ 3 x Q + N + R ]', '|E| 008° [ LR ].[ Q x LO + N ]',
-            '|N| 47° [ 2 x L + I ].[ H x ( 2 x T + L ) + Q + K - 212 ]', '|E| 008° [ T + K + 1 ].[ S x R + DR - 813 ]'
-        ]
-        formula = FormulaConverter._FORMULA.format(ws=FormulaConverter._WS,
-                                                   braces=FormulaConverter._BRACES,
-                                                   math_ops=FormulaConverter._MATH_OPS,
-                                                   casual_math_ops=FormulaConverter._CASUAL_MATH_OPS,
-                                                   variables='[ABCDEFGHIJKLMNOPQRST]')
-        dynamic_coordinates = FormulaConverter._DYNAMIC_DIMENSION.format(
-            ws=FormulaConverter._WS,
-            orientation=FormulaConverter._ORIENTATION,
-            formula=formula,
-            degree=FormulaConverter._DEGREE,
-            separator=FormulaConverter._DECIMAL_SEPARATOR)
-        for given in given_coordinates:
-            self.assertTrue(re.match(dynamic_coordinates, given),
-                            'dynamic coordinates {0} not recognized'.format(given))
-
     def test_match_static_coordinates(self):
         expected = []
         converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
         actual = converter.extract_formulae('N 47° 30.847')
         self.assertEqual(list(actual), expected)
 
-    def test_mask_doesnt_alter_if_no_match(self):
-        given = expected = 'Der Schatz liegt bei N 47 PQ.RST E 008 VW.XYZ, wobei'  # no match because missing °
-        converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
-        actual = converter._mask_orientation(given)
-        self.assertEqual(actual, expected)
+    # TODO(KNR): test the entire authentication
 
-    def test_mask_alters_single_dimension_match(self):
-        given = 'Der Schatz liegt bei N 47° PQ.RST, wobei'
-        expected = 'Der Schatz liegt bei |N| 47° PQ.RST, wobei'
-        converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
-        actual = converter._mask_orientation(given)
-        self.assertEqual(actual, expected)
 
-    def test_mask_alters_double_dimension_match(self):
-        given = 'Der Schatz liegt bei N 47° PQ.ABC E 008° VW.XYZ, wobei'
-        expected = 'Der Schatz liegt bei |N| 47° PQ.ABC |E| 008° VW.XYZ, wobei'
-        converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
-        actual = converter._mask_orientation(given)
-        self.assertEqual(actual, expected)
+class TestFormulaConverterLexerCache(unittest.TestCase):
+    def setUp(self):
+        _create_lexer.cache_clear()
 
-    def test_mask_ignores_variables_in_longitude_orientation(self):
-        given = 'Der Schatz liegt bei N 47° PQ.RST E 008° VW.XYZ, wobei'
-        expected = 'Der Schatz liegt bei |N| 47° PQ.RST |E| 008° VW.XYZ, wobei'
-        converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
-        actual = converter._mask_orientation(given)
-        self.assertEqual(actual, expected)
+    def test_converters_with_same_variables_share_lexer(self):
+        first = FormulaConverter(variable_addresses={'A': 0, 'B': 1})
+        second = FormulaConverter(variable_addresses={'B': 7, 'A': 9})
+        self.assertIs(first._lexer, second._lexer)
+        self.assertEqual(FormulaConverter.cache_info().misses, 1)
+        self.assertEqual(FormulaConverter.cache_info().hits, 1)
 
-    def test_mask_screws_up_static_coordinates(self):
-        given = 'Der Schatz liegt bei N 47° 12.345 E 008° 12.345, wobei'
-        expected = 'Der Schatz liegt bei |N| 47° 12.345 |E| 008° 12.345, wobei'
-        converter = FormulaConverter(variable_addresses=TestFormulaConverter._SAMPLE_ADDRESSES)
-        actual = converter._mask_orientation(given)
-        self.assertEqual(actual, expected)
+    def test_converters_with_different_variables_create_own_lexer(self):
+        first = FormulaConverter(variable_addresses={'A': 0})
+        second = FormulaConverter(variable_addresses={'A': 0, 'B': 1})
+        self.assertIsNot(first._lexer, second._lexer)
+        self.assertEqual(FormulaConverter.cache_info().misses, 2)
 
-    # TODO(KNR): test the entire authentication
+    def test_shared_lexer_resolves_own_addresses(self):
+        FormulaConverter(variable_addresses={'A': 0, 'B': 1})
+        converter = FormulaConverter(variable_addresses={'A': 5, 'B': 6})
+        self.assertEqual(converter._resolve_formula(text='AB + A'), '(10*C5+1*C6) + C5')
+
+    def test_preparing_stages_compiles_each_variable_set_once(self):
+        addresses = {'A': 3, 'B': 4}
+        for _ in range(10):
+            list(Caches._generate_formula(description='N 47° [ A ].[ B + 1 ]', variable_addresses=addresses))
+        self.assertEqual(FormulaConverter.cache_info().misses, 1)
+        self.assertEqual(FormulaConverter.cache_info().hits, 9)
+
+
+class TestPublishAsSheet(unittest.TestCase):
+    def setUp(self):
+        self._worksheet = WorksheetFake()
+        self._factory = MagicMock(grid_store=None, limiter=None)
+        self._factory.create = MagicMock(return_value=self._worksheet)
+
+    def test_publishes_all_rows_in_a_single_call(self):
+        rows = [['stage {0}'.format(row), 'N 47° 03.204 E 008° 18.557'] for row in range(40)]
+        calls = publish_as_sheet(name='irrelevant', rows=iter(rows), factory=self._factory)
+        self.assertEqual(calls, 1)
+        self.assertEqual(self._worksheet.updates, [('A1:B40', rows)])
+
+    def test_pads_rows_to_rectangular_range(self):
+        rows = [['name', 'coordinates'], ['description'], [None, 'v']]
+        publish_as_sheet(name='irrelevant', rows=rows, factory=self._factory)
+        self.assertEqual(self._worksheet.updates,
+                         [('A1:B3', [['name', 'coordinates'], ['description', ''], ['', 'v']])])
+
+    def test_accepts_generators_as_rows(self):
+        rows = [['name'], (formula for formula in ['=1', '=2'])]
+        publish_as_sheet(name='irrelevant', rows=rows, factory=self._factory)
+        self.assertEqual(self._worksheet.updates, [('A1:B2', [['name', ''], ['=1', '=2']])])
+
+    def test_publishes_large_sheets_in_chunks(self):
+        rows = [[str(row)] for row in range(25)]
+        calls = publish_as_sheet(name='irrelevant', rows=rows, factory=self._factory, max_rows=10)
+        self.assertEqual(calls, 3)
+        self.assertEqual([range_name for range_name, _ in self._worksheet.updates], ['A1:A10', 'A11:A20', 'A21:A25'])
+
+    def test_sizes_new_sheets_to_rows_with_headroom(self):
+        rows = [['stage {0}'.format(row), 'N 47° 03.204 E 008° 18.557'] for row in range(30)]
+        publish_as_sheet(name='irrelevant', rows=rows, factory=self._factory)
+        self._factory.create.assert_called_with(name='irrelevant', rows=30 + HEADROOM_ROWS,
+                                                columns=2 + HEADROOM_COLUMNS)
+
+    def test_grows_sheets_too_small_for_rows(self):
+        self._worksheet.row_count, self._worksheet.col_count = 5, 1
+        publish_as_sheet(name='irrelevant', rows=[['a', 'b']] * 8, factory=self._factory)
+        self.assertEqual(self._worksheet.row_count, 8 + HEADROOM_ROWS)
+        self.assertEqual(self._worksheet.col_count, 2 + HEADROOM_COLUMNS)
+
+    def test_does_not_shrink_sheets(self):
+        publish_as_sheet(name='irrelevant', rows=[['a']], factory=self._factory)
+        self.assertEqual((self._worksheet.row_count, self._worksheet.col_count), (1000, 26))
+
+    def test_creates_sheet_but_does_not_write_without_rows(self):
+        calls = publish_as_sheet(name='irrelevant', rows=[], factory=self._factory)
+        self.assertEqual(calls, 0)
+        self.assertTrue(self._factory.create.called)
+        self.assertEqual(self._worksheet.updates, [])
+
+    def test_retries_writes_throttled_by_google(self):
+        response = MagicMock(status_code=429, headers={'Retry-After': '0'})
+        response.json.return_value = {'error': {'code': 429, 'message': 'Quota exceeded',
+                                                'status': 'RESOURCE_EXHAUSTED'}}
+        self._worksheet.update = MagicMock(side_effect=[gspread.exceptions.APIError(response), None])
+        self._factory.limiter = Endpoint(name='sheets.googleapis.com', backoff=0)
+        self.assertEqual(publish_as_sheet(name='irrelevant', rows=[['a']], factory=self._factory), 1)
+        self.assertEqual(self._worksheet.update.call_count, 2)
+        self.assertEqual(self._factory.limiter.counters()['throttled'], 1)
+
+    def test_raises_writes_throttled_by_google_without_limiter(self):
+        response = MagicMock(status_code=503, headers={})
+        response.json.return_value = {'error': {'code': 503, 'message': 'Unavailable', 'status': 'UNAVAILABLE'}}
+        self._worksheet.update = MagicMock(side_effect=gspread.exceptions.APIError(response))
+        with self.assertRaises(RetryableStatus):
+            publish_as_sheet(name='irrelevant', rows=[['a']], factory=self._factory)
+
+    def test_does_not_retry_growing_on_server_errors(self):
+        response = MagicMock(status_code=503, headers={})
+        response.json.return_value = {'error': {'code': 503, 'message': 'Unavailable', 'status': 'UNAVAILABLE'}}
+        sheet = MagicMock(row_count=10, col_count=2)
+        sheet.add_rows = MagicMock(side_effect=[gspread.exceptions.APIError(response), None])
+        with self.assertRaises(gspread.exceptions.APIError):  # Google may have added the rows anyway
+            _grow(sheet, rows=20, columns=2, limiter=Endpoint(name='sheets.googleapis.com', backoff=0))
+        self.assertEqual(sheet.add_rows.call_count, 1)
+
+    def test_retries_growing_throttled_by_google(self):
+        response = MagicMock(status_code=429, headers={'Retry-After': '0'})
+        response.json.return_value = {'error': {'code': 429, 'message': 'Quota exceeded',
+                                                'status': 'RESOURCE_EXHAUSTED'}}
+        sheet = MagicMock(row_count=10, col_count=2)
+        sheet.add_rows = MagicMock(side_effect=[gspread.exceptions.APIError(response), None])
+        _grow(sheet, rows=20, columns=2, limiter=Endpoint(name='sheets.googleapis.com', backoff=0))
+        self.assertEqual(sheet.add_rows.call_count, 2)
+
+
+class TestIncrementalPublishAsSheet(unittest.TestCase):
+    _ROWS = [['name', 'N 47° 03.204 E 008° 18.557'], ['description'], ['number of spikes', 'A'], ['="N 47° "&C3']]
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._worksheet = WorksheetFake()
+        self._factory = MagicMock(grid_store=GridStore(directory=self._directory), limiter=None)
+        self._factory.create = MagicMock(return_value=self._worksheet)
+        self._factory.open = MagicMock(return_value=self._worksheet)
+        publish_as_sheet(name='GC2A62B', rows=TestIncrementalPublishAsSheet._ROWS, factory=self._factory)
+        self._factory.create.reset_mock()
+        self._worksheet.updates = []
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_skips_unchanged_sheets(self):
+        self._factory.reset_mock()
+        calls = publish_as_sheet(name='GC2A62B', rows=TestIncrementalPublishAsSheet._ROWS, factory=self._factory)
+        self.assertEqual(calls, 0)
+        self.assertEqual(self._factory.mock_calls, [])
+
+    def test_writes_only_changed_cells_to_existing_sheet(self):
+        rows = [list(row) for row in TestIncrementalPublishAsSheet._ROWS]
+        rows[2][0] = 'number of crown spikes'
+        calls = publish_as_sheet(name='GC2A62B', rows=rows, factory=self._factory)
+        self.assertEqual(calls, 1)
+        self.assertFalse(self._factory.create.called)
+        self.assertEqual(self._worksheet.updates, [('A3:A3', [['number of crown spikes']])])
+
+    def test_clears_cells_of_removed_rows(self):
+        calls = publish_as_sheet(name='GC2A62B', rows=TestIncrementalPublishAsSheet._ROWS[:2], factory=self._factory)
+        self.assertEqual(calls, 1)
+        self.assertEqual(self._worksheet.updates, [('A3:B4', [['', ''], ['', '']])])
+
+    def test_creates_sheet_if_not_found(self):
+        self._factory.open = MagicMock(return_value=None)
+        rows = TestIncrementalPublishAsSheet._ROWS + [['new']]
+        publish_as_sheet(name='GC2A62B', rows=rows, factory=self._factory)
+        self.assertTrue(self._factory.create.called)
+        self.assertEqual(self._worksheet.updates[0][0], 'A1:B5')
+
+    def test_creates_sheets_not_published_before(self):
+        publish_as_sheet(name='GC397CZ', rows=[['other']], factory=self._factory)
+        self._factory.create.assert_called_with(name='GC397CZ', rows=1 + HEADROOM_ROWS, columns=1 + HEADROOM_COLUMNS)
+        self.assertEqual(self._worksheet.updates, [('A1:A1', [['other']])])
+
+
+class TestChangedBlocks(unittest.TestCase):
+    def test_no_blocks_for_equal_grids(self):
+        self.assertEqual(_changed_blocks([['a', 'b']], [['a', 'b']]), [])
+
+    def test_blocks_of_consecutive_changed_rows_span_their_changed_columns(self):
+        previous = [['a', 'b', 'c'], ['d', 'e', 'f'], ['g', 'h', 'i'], ['j', 'k', 'l']]
+        grid = [['a', 'B', 'c'], ['d', 'e', 'F'], ['g', 'h', 'i'], ['J', 'k', 'l']]
+        self.assertEqual(_changed_blocks(previous, grid), [(1, 2, [['B', 'c'], ['e', 'F']]), (4, 1, [['J']])])
+
+    def test_wider_grids_add_columns(self):
+        self.assertEqual(_changed_blocks([['a']], [['a', 'b']]), [(1, 2, [['b']])])
+
+    def test_narrower_grids_clear_columns(self):
+        self.assertEqual(_changed_blocks([['a', 'b']], [['a']]), [(1, 2, [['']])])
+        self.assertEqual(_changed_blocks([['a', 'b']], []), [(1, 1, [['', '']])])
+
+
+class SpreadsheetFake:
+    def __init__(self, key, title):
+        self.id = key
+        self.title = title
+
+
+class TestSheetIndex(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'caspr', 'sheet_ids.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_get_returns_none_if_unknown(self):
+        self.assertIsNone(SheetIndex(path=self._path).get('GC2A62B'))
+
+    def test_ids_are_persisted(self):
+        SheetIndex(path=self._path).put('GC2A62B', 'id1')
+        index = SheetIndex(path=self._path)
+        self.assertEqual(index.get('GC2A62B'), 'id1')
+        index.remove('GC2A62B')
+        self.assertIsNone(SheetIndex(path=self._path).get('GC2A62B'))
+
+    def test_broken_index_is_empty(self):
+        os.makedirs(os.path.dirname(self._path))
+        with open(self._path, 'w') as file:
+            file.write('{')
+        self.assertIsNone(SheetIndex(path=self._path).get('GC2A62B'))
+
+
+class TestWorksheetFactorySheetIndex(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._index = SheetIndex(path=os.path.join(self._directory, 'sheet_ids.json'))
+        self._factory = WorksheetFactory.__new__(WorksheetFactory)  # without authenticating
+        self._factory.sheet_index = self._index
+        self._factory._spreadsheets = MagicMock()
+        self._factory._spreadsheets.open = MagicMock(return_value=SpreadsheetFake('listed', 'GC2A62B'))
+        self._factory._service = MagicMock()
+        self._factory._http = None
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_opens_known_sheets_by_id_without_listing(self):
+        self._index.put('GC2A62B', 'id1')
+        self._factory._spreadsheets.open_by_key = MagicMock(return_value=SpreadsheetFake('id1', 'GC2A62B'))
+        self.assertEqual(self._factory._get_sheet('GC2A62B').id, 'id1')
+        self.assertFalse(self._factory._spreadsheets.open.called)
+
+    def test_lists_unknown_sheets_and_remembers_their_id(self):
+        self.assertEqual(self._factory._get_sheet('GC2A62B').id, 'listed')
+        self.assertEqual(self._index.get('GC2A62B'), 'listed')
+        self.assertFalse(self._factory._spreadsheets.open_by_key.called)
+
+    def test_lists_sheets_with_stale_id(self):
+        for stale in (MagicMock(side_effect=gspread.SpreadsheetNotFound),
+                      MagicMock(return_value=SpreadsheetFake('id1', 'renamed'))):
+            self._index.put('GC2A62B', 'id1')
+            self._factory._spreadsheets.open_by_key = stale
+            self.assertEqual(self._factory._get_sheet('GC2A62B').id, 'listed')
+            self.assertEqual(self._index.get('GC2A62B'), 'listed')
+
+    def test_returns_none_for_missing_sheets(self):
+        self._factory._spreadsheets.open = MagicMock(side_effect=gspread.SpreadsheetNotFound)
+        self.assertIsNone(self._factory._get_sheet('GC2A62B'))
+        self.assertIsNone(self._index.get('GC2A62B'))
+
+    def test_create_new_sheet_records_id(self):
+        self._factory._service.files.return_value.insert.return_value.execute.return_value = {'id': 'created'}
+        self._factory._spreadsheets.open_by_key = MagicMock(return_value=SpreadsheetFake('created', 'GC2A62B'))
+        self.assertEqual(self._factory._create_new_sheet('GC2A62B').id, 'created')
+        self.assertFalse(self._factory._spreadsheets.open.called)
+
+    def test_create_new_sheet_serialises_drive_calls(self):
+        def execute(http):
+            self.assertTrue(self._factory._drive_lock.locked())  # httplib2 is not thread-safe
+            return {'id': 'created'}
+
+        self._factory._service.files.return_value.insert.return_value.execute.side_effect = execute
+        self._factory._spreadsheets.open_by_key = MagicMock(return_value=SpreadsheetFake('created', 'GC2A62B'))
+        self._factory._create_new_sheet('GC2A62B')
+
+
+@patch('gspread.authorize')
+@patch('apiclient.discovery.build')
+@patch('caspr.googledotcom.WorksheetFactory._get_credentials')
+class TestWorksheetFactoryConnect(unittest.TestCase):
+    def test_constructing_does_not_connect(self, get_credentials, build, authorize):
+        WorksheetFactory(keyfile='keyfile.json')
+        get_credentials.assert_not_called()
+        build.assert_not_called()
+        authorize.assert_not_called()
+
+    def test_connects_once(self, get_credentials, build, authorize):
+        factory = WorksheetFactory(keyfile='keyfile.json')
+        factory.connect()
+        factory.connect()
+        get_credentials.assert_called_once_with('keyfile.json')
+        build.assert_called_once_with('drive', 'v2', http=Anything())
+        authorize.assert_called_once_with(get_credentials.return_value)
+
+    def test_open_connects(self, get_credentials, build, authorize):
+        authorize.return_value.open.side_effect = gspread.SpreadsheetNotFound
+        self.assertIsNone(WorksheetFactory(keyfile='keyfile.json').open(name='GC2A62B'))
+        authorize.return_value.open.assert_called_once_with('GC2A62B')
+
+    def test_unchanged_sheet_does_not_connect(self, get_credentials, build, authorize):
+        directory = tempfile.mkdtemp()
+        try:
+            factory = WorksheetFactory(keyfile='keyfile.json', grid_store=GridStore(directory=directory))
+            factory.grid_store.put('GC2A62B', [['a', 'b']])
+            self.assertEqual(publish_as_sheet(name='GC2A62B', rows=[['a', 'b']], factory=factory), 0)
+        finally:
+            shutil.rmtree(directory)
+        get_credentials.assert_not_called()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from caspr.gridstore import digest, GridStore, Published
+
+_NAME = 'GC2A62B Seepromenade Luzern [DE_EN] (Multi-cache) in Zentralschweiz (ZG_SZ_LU_UR_OW_NW), Switzerland'
+_GRID = [['name', 'N 47° 03.204 E 008° 18.557'], ['="N 47° "&C3', '']]
+
+
+class TestGridStore(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_get_returns_none_if_unknown(self):
+        self.assertIsNone(GridStore(directory=self._directory).get(_NAME))
+
+    def test_get_returns_stored_grid(self):
+        store = GridStore(directory=self._directory)
+        store.put(_NAME, _GRID)
+        self.assertEqual(store.get(_NAME), Published(digest=digest(_GRID), grid=_GRID))
+
+    def test_remove_forgets_grid(self):
+        store = GridStore(directory=self._directory)
+        store.put(_NAME, _GRID)
+        store.remove(_NAME)
+        store.remove(_NAME)
+        self.assertIsNone(store.get(_NAME))
+
+    def test_broken_entries_are_unknown(self):
+        store = GridStore(directory=self._directory)
+        store.put(_NAME, _GRID)
+        for name in os.listdir(self._directory):
+            with open(os.path.join(self._directory, name), 'w') as file:
+                file.write('{"grid": ')
+        self.assertIsNone(store.get(_NAME))
+
+    def test_digest_depends_on_all_cells(self):
+        self.assertEqual(digest(_GRID), digest([list(row) for row in _GRID]))
+        self.assertNotEqual(digest(_GRID), digest([_GRID[0], ['="N 47° "&C4', '']]))
+        self.assertNotEqual(digest([['a', ''], ['b', '']]), digest([['a'], ['b']]))
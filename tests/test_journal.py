@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from caspr.journal import FAILED, FETCHED, Journal, page_digest, PUBLISHED
+from caspr.page import Page
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'journal', 'batch.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_state_is_none_if_unknown(self):
+        self.assertIsNone(Journal(path=self._path).state('GC1'))
+
+    def test_reopened_journal_keeps_last_state(self):
+        journal = Journal(path=self._path)
+        journal.record('GC1', FETCHED, digest='abc')
+        journal.record('GC1', PUBLISHED)
+        journal.record('GC2', FAILED, error='not found')
+
+        journal = Journal(path=self._path)
+        self.assertEqual(journal.state('GC1'), PUBLISHED)
+        self.assertEqual(journal.digest('GC1'), 'abc')
+        self.assertEqual(journal.state('GC2'), FAILED)
+
+    def test_skips_broken_lines(self):
+        journal = Journal(path=self._path)
+        journal.record('GC1', PUBLISHED)
+        with open(self._path, 'a') as file:
+            file.write('{"code": "GC2", "sta')  # cut short by a crash
+        self.assertEqual(Journal(path=self._path).state('GC1'), PUBLISHED)
+
+    def test_pending_skips_published_caches(self):
+        journal = Journal(path=self._path)
+        journal.record('GC1', PUBLISHED)
+        journal.record('GC2', FAILED)
+        self.assertEqual(list(journal.pending(['GC1', 'GC2', 'GC3'])), ['GC2', 'GC3'])
+
+    def test_remove_forgets_all_caches(self):
+        journal = Journal(path=self._path)
+        journal.record('GC1', PUBLISHED)
+        journal.remove()
+        self.assertIsNone(journal.state('GC1'))
+        self.assertIsNone(Journal(path=self._path).state('GC1'))
+        journal.remove()  # nothing recorded
+
+    def test_batches_have_their_own_journal(self):
+        Journal.for_batch(directory=self._directory, batch=[None, ['GC1']]).record('GC1', PUBLISHED)
+        self.assertEqual(Journal.for_batch(directory=self._directory, batch=[None, ['GC1']]).state('GC1'), PUBLISHED)
+        self.assertIsNone(Journal.for_batch(directory=self._directory, batch=[None, ['GC1', 'GC2']]).state('GC1'))
+
+    def test_page_digest_hashes_content(self):
+        self.assertEqual(page_digest(Page(content=b'<html></html>', encoding='utf-8')),
+                         page_digest(Page(content=b'<html></html>', encoding=None)))
+        self.assertNotEqual(page_digest(Page(content=b'<html></html>', encoding='utf-8')),
+                            page_digest(Page(content=b'<html>2</html>', encoding='utf-8')))
+        self.assertIsNone(page_digest('<html></html>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from io import BytesIO
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from caspr.casprexception import CasprException
+from caspr.localsite import LocalSite, STDIN
+from caspr.main import _parse_args
+from caspr.page import Page, Validators
+
+_PAGES = {'GC2A62B Seepromenade Luzern.html': b'<html>GC2A62B</html>',
+          'gc397cz.htm': b'<html>GC397CZ</html>',
+          'GC1000.html': b'<html>GC1000</html>'}
+_IGNORED = {'GC2A62B Seepromenade Luzern_files/container.html': b'<html>frame</html>',
+            '._GC2A62B Seepromenade Luzern.html': b'resource fork',
+            'notes.txt': b'GC397CZ'}
+
+
+class TestLocalSite(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._pages = os.path.join(self._directory, 'pages')
+        for name, content in dict(_PAGES, **_IGNORED).items():
+            path = os.path.join(self._pages, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _tar(self, mode='w:bz2'):
+        path = os.path.join(self._directory, 'pages.tar.bz2')
+        with tarfile.open(path, mode) as archive:
+            for name in sorted(dict(_PAGES, **_IGNORED)):
+                archive.add(os.path.join(self._pages, name), arcname=name)
+        return path
+
+    def _zip(self):
+        path = os.path.join(self._directory, 'pages.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name in sorted(dict(_PAGES, **_IGNORED)):
+                archive.write(os.path.join(self._pages, name), arcname=name)
+        return path
+
+    def _assert_serves_pages(self, site):
+        codes = list(site.codes())
+        self.assertEqual(sorted(codes), ['GC1000', 'GC2A62B', 'GC397CZ'])
+        for code in codes:
+            self.assertEqual(site.fetch(code), Page(content='<html>{0}</html>'.format(code).encode('ascii'),
+                                                    encoding=None))
+
+    def test_serves_pages_of_directory(self):
+        self._assert_serves_pages(LocalSite(source=self._pages))
+
+    def test_serves_pages_of_tar_archive(self):
+        self._assert_serves_pages(LocalSite(source=self._tar()))
+
+    def test_serves_pages_of_zip_archive(self):
+        self._assert_serves_pages(LocalSite(source=self._zip()))
+
+    def test_serves_page_of_stdin(self):
+        site = LocalSite(source=STDIN, stdin=BytesIO(b'<html>GC2A62B</html>'))
+        self.assertEqual(list(site.codes()), [STDIN])
+        self.assertEqual(site.fetch(STDIN).content, b'<html>GC2A62B</html>')
+        self.assertEqual(site.fetch(STDIN).content, b'<html>GC2A62B</html>')
+
+    def test_serves_page_of_stdin_given_with_code(self):
+        arguments = _parse_args(['--input', STDIN, 'GC2A62B'], {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+        site = LocalSite(source=arguments.input, stdin=BytesIO(b'<html>GC2A62B</html>'))
+        self.assertEqual([list(site.codes(patterns=codes)) for codes in arguments.cache_codes], [[STDIN]])
+
+    def test_serves_all_pages_without_codes(self):
+        arguments = _parse_args(['--input', self._pages], {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+        site = LocalSite(source=arguments.input)
+        self.assertEqual([sorted(site.codes(patterns=codes)) for codes in arguments.cache_codes],
+                         [['GC1000', 'GC2A62B', 'GC397CZ']])
+
+    def test_codes_match_patterns_regardless_of_case(self):
+        for source in (self._pages, self._tar(), self._zip()):
+            site = LocalSite(source=source)
+            self.assertEqual(sorted(site.codes(patterns=['gc2*', 'GC39?CZ'])), ['GC2A62B', 'GC397CZ'])
+
+    def test_fetches_codes_in_any_order(self):
+        for source in (self._pages, self._tar(), self._zip()):
+            site = LocalSite(source=source)
+            self.assertEqual(site.fetch('gc397cz').content, b'<html>GC397CZ</html>')
+            self.assertEqual(site.fetch('GC2A62B').content, b'<html>GC2A62B</html>')
+
+    def test_tar_archive_is_read_while_iterating_codes(self):
+        site = LocalSite(source=self._tar())
+        codes = site.codes()
+        code = next(codes)
+        self.assertEqual(list(site._pending), [code])
+        site.fetch(code)
+        self.assertEqual(site._pending, {})
+
+    def test_fetch_if_modified_always_returns_page(self):
+        site = LocalSite(source=self._pages)
+        page, validators = site.fetch_if_modified('GC1000', etag='"1234"')
+        self.assertEqual(page.content, b'<html>GC1000</html>')
+        self.assertEqual(validators, Validators(etag=None, last_modified=None))
+
+    def test_raises_for_unknown_codes(self):
+        with self.assertRaises(CasprException):
+            LocalSite(source=self._pages).fetch('GC0')
+
+    def test_raises_for_missing_source(self):
+        with self.assertRaises(CasprException):
+            LocalSite(source=os.path.join(self._directory, 'missing'))
+
+    def test_raises_for_other_files(self):
+        with self.assertRaises(CasprException):
+            list(LocalSite(source=os.path.join(self._pages, 'notes.txt')).codes())
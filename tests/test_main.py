@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 
 
-from caspr.main import _parse_args
+from caspr.caches import DEFAULT_FETCHERS
+from caspr.casprexception import CasprException
+from caspr.main import _parse_args, _run_concurrently
 from contextlib import contextmanager
 from io import StringIO
 import sys
+import threading
+import time
 import unittest
 
 
@@ -28,3 +32,65 @@ class TestCaspr(unittest.TestCase):
 
         self.assertEqual(argparse_exception.exception.code, 2)
         self.assertIn("the following arguments are required: -u/--user, -p/--password, -k/--keyfile, cache_codes", stderr_mock.getvalue())
+
+    def test_parse_args_refresh_and_offline_are_exclusive(self):
+        stderr_mock = StringIO()
+        with mock_stderr(stderr_mock):
+            with self.assertRaises(SystemExit):
+                _parse_args(['--refresh', '--offline', 'GC2A62B'], {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+
+        self.assertIn("not allowed with argument", stderr_mock.getvalue())
+
+    def test_parse_args_processes_exclude_threads(self):
+        stderr_mock = StringIO()
+        with mock_stderr(stderr_mock):
+            with self.assertRaises(SystemExit):
+                _parse_args(['--processes', '2', '--parsers', '2', 'GC2A62B'],
+                            {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+
+        self.assertIn("--processes cannot be combined with", stderr_mock.getvalue())
+
+    def test_parse_args_fetchers_default_to_those_of_caches(self):
+        arguments = _parse_args(['GC2A62B'], {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+        self.assertEqual(arguments.fetchers, DEFAULT_FETCHERS)
+        arguments = _parse_args(['--processes', '2', 'GC2A62B'], {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+        self.assertEqual(arguments.processes, 2)
+
+    def test_parse_args_input_takes_code_patterns(self):
+        arguments = _parse_args(['--input', 'pages.tar.bz2', 'GC2*', 'GC397CZ'],
+                                {'user': 'u', 'password': 'p', 'keyfile': 'k'})
+        self.assertEqual(arguments.input, 'pages.tar.bz2')
+        self.assertEqual(arguments.cache_codes, [['GC2*', 'GC397CZ']])
+
+
+class TestRunConcurrently(unittest.TestCase):
+    def test_returns_results_in_order(self):
+        self.assertEqual(_run_concurrently([('first', lambda: 1), ('second', lambda: 2)], timeout=5), [1, 2])
+
+    def test_tasks_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)  # only passed if both tasks run at the same time
+        results = _run_concurrently([('first', barrier.wait), ('second', barrier.wait)], timeout=5)
+        self.assertEqual(sorted(results), [0, 1])
+
+    def test_names_failed_task(self):
+        def fail():
+            raise CasprException('wrong password')
+
+        with self.assertRaisesRegex(CasprException, '^logging in failed: wrong password$') as context:
+            _run_concurrently([('logging in', fail), ('connecting', lambda: None)], timeout=5)
+        self.assertIsInstance(context.exception.__cause__, CasprException)
+
+    def test_names_all_failed_tasks(self):
+        def fail():
+            raise ValueError('broken')
+
+        with self.assertRaisesRegex(CasprException, '^first failed: broken; second failed: broken$'):
+            _run_concurrently([('first', fail), ('second', fail)], timeout=5)
+
+    def test_deadline_is_shared(self):
+        released = threading.Event()
+        start = time.monotonic()
+        with self.assertRaisesRegex(CasprException, '^first did not finish within 0.2 s; second did not finish'):
+            _run_concurrently([('first', released.wait), ('second', released.wait)], timeout=0.2)
+        self.assertLess(time.monotonic() - start, 0.4)  # not one deadline after the other
+        released.set()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from caspr.casprexception import CasprException
+from caspr.page import Page, Validators
+from caspr.pagecache import AsyncCachingSite, CachingSite, PageCache
+
+_PAGE = Page(content=b'<html>page</html>', encoding='utf-8')
+_VALIDATORS = Validators(etag='"1234"', last_modified='Wed, 07 Sep 2016 19:54:00 GMT')
+_NO_VALIDATORS = Validators(etag=None, last_modified=None)
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_get_returns_none_if_not_cached(self):
+        cache = PageCache(directory=self._directory)
+        self.assertIsNone(cache.get('GC2A62B'))
+
+    def test_get_returns_stored_page(self):
+        cache = PageCache(directory=self._directory)
+        cache.put('GC2A62B', _PAGE, _VALIDATORS)
+        entry = cache.get('GC2A62B')
+        self.assertEqual(entry.page, _PAGE)
+        self.assertEqual(entry.validators, _VALIDATORS)
+
+    def test_codes_are_case_insensitive(self):
+        cache = PageCache(directory=self._directory)
+        cache.put('gc2a62b', _PAGE, _VALIDATORS)
+        self.assertEqual(cache.get('GC2A62B').page, _PAGE)
+
+    def test_creates_missing_directory(self):
+        directory = os.path.join(self._directory, 'pages')
+        PageCache(directory=directory)
+        self.assertTrue(os.path.isdir(directory))
+
+    @patch('caspr.pagecache.time')
+    def test_confirm_updates_fetch_time(self, time_mock):
+        cache = PageCache(directory=self._directory)
+        time_mock.time.return_value = 1000
+        cache.put('GC2A62B', _PAGE, _VALIDATORS)
+        time_mock.time.return_value = 2000
+        cache.confirm('GC2A62B', _NO_VALIDATORS)
+        entry = cache.get('GC2A62B')
+        self.assertEqual(entry.fetched, 2000)
+        self.assertEqual(entry.validators, _VALIDATORS)
+
+    @patch('caspr.pagecache.time')
+    def test_evicts_least_recently_used_pages(self, time_mock):
+        cache = PageCache(directory=self._directory, max_bytes=2 * len(_PAGE.content))
+        time_mock.time.return_value = 1
+        cache.put('GC1', _PAGE, _VALIDATORS)
+        time_mock.time.return_value = 2
+        cache.put('GC2', _PAGE, _VALIDATORS)
+        time_mock.time.return_value = 3
+        cache.get('GC1')
+        time_mock.time.return_value = 4
+        cache.put('GC3', _PAGE, _VALIDATORS)
+        self.assertIsNotNone(cache.get('GC1'))
+        self.assertIsNone(cache.get('GC2'))
+        self.assertIsNotNone(cache.get('GC3'))
+
+    def test_confirm_returns_false_if_evicted(self):
+        cache = PageCache(directory=self._directory)
+        self.assertFalse(cache.confirm('GC2A62B', _VALIDATORS))
+        cache.put('GC2A62B', _PAGE, _VALIDATORS)
+        self.assertTrue(cache.confirm('GC2A62B', _NO_VALIDATORS))
+
+    def test_lists_pages_only_when_full(self):
+        cache = PageCache(directory=self._directory, max_bytes=2 * len(_PAGE.content))
+        with patch('caspr.pagecache.os.listdir', wraps=os.listdir) as listdir:
+            cache.put('GC1', _PAGE, _VALIDATORS)
+            cache.put('GC2', _PAGE, _VALIDATORS)
+            cache.put('GC1', _PAGE, _VALIDATORS)  # replaces the page of the same size
+            self.assertEqual(listdir.call_count, 1)
+            cache.put('GC3', _PAGE, _VALIDATORS)
+            self.assertEqual(listdir.call_count, 2)
+
+    def test_leaves_no_temporary_files(self):
+        cache = PageCache(directory=self._directory)
+        cache.put('GC1', _PAGE, _VALIDATORS)
+        cache.get('GC1')
+        cache.confirm('GC1', _VALIDATORS)
+        self.assertEqual(sorted(os.listdir(self._directory)), ['GC1.html', 'GC1.json'])
+
+
+class TestCachingSite(unittest.TestCase):
+    def setUp(self):
+        self._site = MagicMock()
+        self._site.fetch_if_modified = MagicMock(return_value=(_PAGE, _VALIDATORS))
+        self._cache = MagicMock()
+        self._cache.get = MagicMock(return_value=None)
+
+    def _cached(self, age):
+        entry = MagicMock()
+        entry.page = Page(content=b'cached', encoding=None)
+        entry.validators = _VALIDATORS
+        entry.fetched = 10000 - age
+        self._cache.get = MagicMock(return_value=entry)
+        return entry
+
+    def test_fetches_and_stores_uncached_page(self):
+        site = CachingSite(site=self._site, cache=self._cache)
+        self.assertEqual(site.fetch('GC2A62B'), _PAGE)
+        self._site.fetch_if_modified.assert_called_with(code='GC2A62B', etag=None, last_modified=None)
+        self._cache.put.assert_called_with('GC2A62B', _PAGE, _VALIDATORS)
+
+    @patch('caspr.pagecache.time')
+    def test_serves_fresh_page_from_cache(self, time_mock):
+        time_mock.time.return_value = 10000
+        entry = self._cached(age=10)
+        site = CachingSite(site=self._site, cache=self._cache, ttl=60)
+        self.assertEqual(site.fetch('GC2A62B'), entry.page)
+        self.assertFalse(self._site.fetch_if_modified.called)
+
+    @patch('caspr.pagecache.time')
+    def test_revalidates_expired_page(self, time_mock):
+        time_mock.time.return_value = 10000
+        entry = self._cached(age=100)
+        self._site.fetch_if_modified = MagicMock(return_value=(None, _NO_VALIDATORS))
+        site = CachingSite(site=self._site, cache=self._cache, ttl=60)
+        self.assertEqual(site.fetch('GC2A62B'), entry.page)
+        self._site.fetch_if_modified.assert_called_with(code='GC2A62B',
+                                                        etag=_VALIDATORS.etag,
+                                                        last_modified=_VALIDATORS.last_modified)
+        self._cache.confirm.assert_called_with('GC2A62B', _NO_VALIDATORS)
+        self.assertFalse(self._cache.put.called)
+
+    @patch('caspr.pagecache.time')
+    def test_stores_revalidated_page_again_if_evicted(self, time_mock):
+        time_mock.time.return_value = 10000
+        entry = self._cached(age=100)
+        self._cache.confirm = MagicMock(return_value=False)
+        self._site.fetch_if_modified = MagicMock(return_value=(None, _NO_VALIDATORS))
+        site = CachingSite(site=self._site, cache=self._cache, ttl=60)
+        self.assertEqual(site.fetch('GC2A62B'), entry.page)
+        self._cache.put.assert_called_with('GC2A62B', entry.page, _VALIDATORS)
+
+    @patch('caspr.pagecache.time')
+    def test_stores_modified_page(self, time_mock):
+        time_mock.time.return_value = 10000
+        self._cached(age=100)
+        site = CachingSite(site=self._site, cache=self._cache, ttl=60)
+        self.assertEqual(site.fetch('GC2A62B'), _PAGE)
+        self._cache.put.assert_called_with('GC2A62B', _PAGE, _VALIDATORS)
+
+    @patch('caspr.pagecache.time')
+    def test_refresh_fetches_unconditionally(self, time_mock):
+        time_mock.time.return_value = 10000
+        self._cached(age=10)
+        site = CachingSite(site=self._site, cache=self._cache, ttl=60, refresh=True)
+        self.assertEqual(site.fetch('GC2A62B'), _PAGE)
+        self._site.fetch_if_modified.assert_called_with(code='GC2A62B', etag=None, last_modified=None)
+
+    def test_offline_serves_expired_page_from_cache(self):
+        entry = self._cached(age=10 ** 6)
+        site = CachingSite(site=None, cache=self._cache, offline=True)
+        self.assertEqual(site.fetch('GC2A62B'), entry.page)
+
+    def test_offline_raises_if_not_cached(self):
+        site = CachingSite(site=None, cache=self._cache, offline=True)
+        with self.assertRaises(CasprException):
+            site.fetch('GC2A62B')
+
+    def test_refresh_and_offline_are_exclusive(self):
+        with self.assertRaises(CasprException):
+            CachingSite(site=None, cache=self._cache, refresh=True, offline=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class TestAsyncCachingSite(unittest.TestCase):
+    def setUp(self):
+        self._site = MagicMock()
+        self._site.fetch_if_modified = AsyncMock(return_value=(_PAGE, _VALIDATORS))
+        self._cache = MagicMock()
+        self._cache.get = MagicMock(return_value=None)
+
+    def test_fetches_and_stores_uncached_page(self):
+        site = AsyncCachingSite(site=self._site, cache=self._cache)
+        self.assertEqual(asyncio.run(site.fetch('GC2A62B')), _PAGE)
+        self._site.fetch_if_modified.assert_awaited_with(code='GC2A62B', etag=None, last_modified=None)
+        self._cache.put.assert_called_with('GC2A62B', _PAGE, _VALIDATORS)
+
+    @patch('caspr.pagecache.time')
+    def test_revalidates_expired_page(self, time_mock):
+        time_mock.time.return_value = 10000
+        entry = MagicMock(page=Page(content=b'cached', encoding=None), validators=_VALIDATORS, fetched=9900)
+        self._cache.get = MagicMock(return_value=entry)
+        self._site.fetch_if_modified = AsyncMock(return_value=(None, _NO_VALIDATORS))
+        site = AsyncCachingSite(site=self._site, cache=self._cache, ttl=60)
+        self.assertEqual(asyncio.run(site.fetch('GC2A62B')), entry.page)
+        self._cache.confirm.assert_called_with('GC2A62B', _NO_VALIDATORS)
+
+    def test_offline_serves_page_from_cache(self):
+        entry = MagicMock(page=Page(content=b'cached', encoding=None), validators=_VALIDATORS, fetched=0)
+        self._cache.get = MagicMock(return_value=entry)
+        site = AsyncCachingSite(site=None, cache=self._cache, offline=True)
+        self.assertEqual(asyncio.run(site.fetch('GC2A62B')), entry.page)
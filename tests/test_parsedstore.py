@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest.mock import MagicMock, patch
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+
+from caspr.geocachingdotcom import GeocachingSite, TableParser
+from caspr.page import Page
+from caspr.parsedstore import CachingParser, parser_version, ParsedStore
+from caspr.stage import Stage, Task
+
+_PAGE = Page(content=b'<html>page</html>', encoding='utf-8')
+_CACHE = {'name': 'GC2A62B Seepromenade',
+          'stages': [Stage(name='GC2A62B Seepromenade', coordinates='N 47° 03.204 E 008° 18.557', description='A =',
+                           tasks=[Task(description='number of spikes', variables='A')])]}
+
+
+class TestParsedStore(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_get_returns_none_if_not_stored(self):
+        store = ParsedStore(directory=self._directory)
+        self.assertIsNone(store.get(store.key(_PAGE)))
+
+    def test_get_returns_stored_cache(self):
+        store = ParsedStore(directory=self._directory)
+        store.put(store.key(_PAGE), _CACHE)
+        self.assertEqual(store.get(store.key(_PAGE)), _CACHE)
+
+    def test_keys_depend_on_content_encoding_and_version(self):
+        store = ParsedStore(directory=self._directory)
+        keys = {store.key(_PAGE),
+                store.key(Page(content=b'<html>other page</html>', encoding='utf-8')),
+                store.key(Page(content=_PAGE.content, encoding=None)),
+                ParsedStore(directory=self._directory, version='other parser').key(_PAGE)}
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(store.key(Page(content=b'<html>page</html>', encoding='utf-8')), store.key(_PAGE))
+
+    def test_parser_version_is_a_hash_of_the_parser_code(self):
+        self.assertEqual(len(parser_version()), 64)
+        self.assertEqual(ParsedStore(directory=self._directory).key(_PAGE),
+                         ParsedStore(directory=self._directory, version=parser_version()).key(_PAGE))
+
+    def _version_with_changed(self, changed_class):
+        ''' Returns the parser version computed as if the source of the class had changed. '''
+
+        source = inspect.getsource
+        original = source(changed_class)
+        changed = original + '    # changed\n'
+
+        def changed_source(code):
+            text = source(code)
+            return changed if code is changed_class else text.replace(original, changed)
+
+        with patch('inspect.getsource', side_effect=changed_source):
+            return parser_version.__wrapped__()
+
+    def test_parser_version_ignores_networking_code(self):
+        self.assertEqual(self._version_with_changed(GeocachingSite), parser_version())
+        self.assertNotEqual(self._version_with_changed(TableParser), parser_version())
+
+    def test_broken_entries_are_misses(self):
+        store = ParsedStore(directory=self._directory)
+        with open(os.path.join(self._directory, store.key(_PAGE) + '.pickle'), 'wb') as file:
+            file.write(b'broken')
+        self.assertIsNone(store.get(store.key(_PAGE)))
+
+    def test_evicts_least_recently_used_entries(self):
+        store = ParsedStore(directory=self._directory)
+        store.put('first', _CACHE)
+        size = os.path.getsize(os.path.join(self._directory, 'first.pickle'))
+        store = ParsedStore(directory=self._directory, max_bytes=2 * size)
+        store.put('second', _CACHE)
+        os.utime(os.path.join(self._directory, 'first.pickle'), (1000, 1000))
+        os.utime(os.path.join(self._directory, 'second.pickle'), (2000, 2000))
+        store.get('first')  # now the most recently used entry
+        store.put('third', _CACHE)
+        self.assertEqual(sorted(os.listdir(self._directory)), ['first.pickle', 'third.pickle'])
+
+    def test_lists_entries_only_when_full(self):
+        store = ParsedStore(directory=self._directory)
+        store.put('first', _CACHE)
+        size = os.path.getsize(os.path.join(self._directory, 'first.pickle'))
+        store = ParsedStore(directory=self._directory, max_bytes=2 * size)
+        with patch('caspr.parsedstore.os.listdir', wraps=os.listdir) as listdir:
+            store.put('second', _CACHE)
+            store.put('first', _CACHE)  # replaces the entry of the same size
+            self.assertEqual(listdir.call_count, 1)
+            store.put('third', _CACHE)
+            self.assertEqual(listdir.call_count, 2)
+        self.assertEqual(len([name for name in os.listdir(self._directory) if name.endswith('.pickle')]), 2)
+
+
+class TestCachingParser(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._parser = MagicMock()
+        self._parser.parse = MagicMock(return_value={'name': _CACHE['name'], 'stages': iter(_CACHE['stages'])})
+        self._caching_parser = CachingParser(parser=self._parser, store=ParsedStore(directory=self._directory))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_parses_and_stores_unknown_pages(self):
+        self.assertEqual(self._caching_parser.parse(page=_PAGE), _CACHE)
+        self.assertEqual(len(os.listdir(self._directory)), 1)
+
+    def test_does_not_parse_stored_pages(self):
+        self._caching_parser.parse(page=_PAGE)
+        self.assertEqual(self._caching_parser.parse(page=_PAGE), _CACHE)
+        self.assertEqual(self._parser.parse.call_count, 1)
+
+    def test_parses_changed_pages(self):
+        self._caching_parser.parse(page=_PAGE)
+        self._parser.parse.return_value = {'name': 'changed', 'stages': iter([])}
+        self.assertEqual(self._caching_parser.parse(page=Page(content=b'<html>changed</html>', encoding='utf-8')),
+                         {'name': 'changed', 'stages': []})
+        self.assertEqual(self._parser.parse.call_count, 2)
+
+    def test_always_parses_page_files(self):
+        self._caching_parser.parse(page='page.html')
+        self._caching_parser.parse(page='page.html')
+        self.assertEqual(self._parser.parse.call_count, 2)
+        self.assertEqual(os.listdir(self._directory), [])
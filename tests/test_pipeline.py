@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from caspr.casprexception import CasprException
+from caspr.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_constructor_raises_if_no_stages(self):
+        with self.assertRaises(CasprException):
+            Pipeline(stages=[])
+
+    def test_constructor_raises_if_stage_without_workers(self):
+        with self.assertRaises(CasprException):
+            Pipeline(stages=[(str, 0)])
+
+    def test_runs_items_through_all_stages(self):
+        pipeline = Pipeline(stages=[(lambda x: x + 1, 1), (lambda x: x * 2, 1)])
+        self.assertEqual(list(pipeline.run(range(5))), [2, 4, 6, 8, 10])
+
+    def test_yields_results_in_input_order(self):
+        def sleep_inversely(x):
+            time.sleep(0.01 * (5 - x))
+            return x
+
+        pipeline = Pipeline(stages=[(sleep_inversely, 5), (str, 3)])
+        self.assertEqual(list(pipeline.run(range(5))), ['0', '1', '2', '3', '4'])
+
+    def test_runs_workers_of_a_stage_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def wait_for_others(x):
+            barrier.wait()
+            return x
+
+        pipeline = Pipeline(stages=[(wait_for_others, 3)])
+        self.assertEqual(list(pipeline.run(range(3))), [0, 1, 2])
+
+    def test_raises_exception_of_first_failing_item(self):
+        def fail_on_odd(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+
+        pipeline = Pipeline(stages=[(fail_on_odd, 2), (str, 1)])
+        results = []
+        with self.assertRaises(ValueError) as context:
+            for result in pipeline.run(range(10)):
+                results.append(result)
+        self.assertEqual(context.exception.args, (1,))
+        self.assertEqual(results, ['0'])
+
+    def test_failed_item_skips_later_stages(self):
+        later_stage_items = []
+
+        def fail(x):
+            raise ValueError(x)
+
+        pipeline = Pipeline(stages=[(fail, 1), (later_stage_items.append, 1)])
+        with self.assertRaises(ValueError):
+            list(pipeline.run([1]))
+        self.assertEqual(later_stage_items, [])
+
+    def test_bounded_queues_throttle_the_first_stage(self):
+        started = []
+        release = threading.Event()
+
+        def block(x):
+            release.wait(timeout=5)
+            return x
+
+        pipeline = Pipeline(stages=[(lambda x: started.append(x) or x, 1), (block, 1)], queue_size=1)
+        results = pipeline.run(range(100))
+        consumer = threading.Thread(target=lambda: list(results))
+        consumer.start()
+        time.sleep(0.1)
+        started_while_blocked = len(started)
+        release.set()
+        consumer.join()
+        self.assertLess(started_while_blocked, 10)
+        self.assertEqual(len(started), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import random
+import threading
+import unittest
+
+from caspr.casprexception import CasprException
+from caspr.ratelimit import AimdLimit, check_status, Endpoint, RateLimits, RetryableStatus, TokenBucket
+
+
+class Clock:
+    ''' A clock advanced by sleeping. '''
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestCheckStatus(unittest.TestCase):
+    def test_raises_on_retryable_status(self):
+        for status in (429, 500, 503):
+            with self.assertRaises(RetryableStatus):
+                check_status(status)
+
+    def test_accepts_other_status(self):
+        for status in (200, 304, 404):
+            check_status(status)
+
+    def test_parses_retry_after(self):
+        self.assertEqual(RetryableStatus(429, retry_after='3').retry_after, 3.0)
+        self.assertIsNone(RetryableStatus(429, retry_after='Wed, 21 Oct 2015 07:28:00 GMT').retry_after)
+        self.assertIsInstance(RetryableStatus(503), CasprException)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_allows_burst(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=Clock())
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0])
+
+    def test_spaces_requests_after_burst(self):
+        bucket = TokenBucket(rate=2, burst=1, clock=Clock())
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0.5, 1.0])
+
+    def test_refills_over_time(self):
+        clock = Clock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock)
+        bucket.reserve()
+        bucket.reserve()
+        clock.now = 10
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+    def test_requires_positive_rate(self):
+        with self.assertRaises(CasprException):
+            TokenBucket(rate=0, burst=1)
+
+
+class TestAimdLimit(unittest.TestCase):
+    def test_increases_additively(self):
+        limit = AimdLimit(initial=2, maximum=3)
+        for _ in range(4):
+            limit.acquire()
+            limit.release(latency=0.1)
+        self.assertEqual(limit.limit, 3)
+        for _ in range(10):
+            limit.acquire()
+            limit.release(latency=0.1)
+        self.assertEqual(limit.limit, 3)
+
+    def test_decreases_multiplicatively(self):
+        limit = AimdLimit(initial=8, latency_target=1.0)
+        limit.acquire()
+        limit.release(latency=0.1, throttled=True)
+        self.assertEqual(limit.limit, 4)
+        limit.acquire()
+        limit.release(latency=2.0)  # slower than the target
+        self.assertEqual(limit.limit, 2)
+        for _ in range(3):
+            limit.acquire()
+            limit.release(latency=0.1, throttled=True)
+        self.assertEqual(limit.limit, 1)
+
+    def test_blocks_beyond_limit(self):
+        limit = AimdLimit(initial=1)
+        limit.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limit.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limit.release(latency=0.1)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_wakes_waiting_coroutines(self):
+        limit = AimdLimit(initial=1)
+        order = []
+
+        async def request(name):
+            await limit.acquire_async()
+            order.append(name)
+            await asyncio.sleep(0.01)
+            limit.release(latency=0.01)
+
+        async def requests():
+            await asyncio.gather(*(request(name) for name in 'ABC'))
+
+        asyncio.run(requests())
+        self.assertEqual(order, ['A', 'B', 'C'])
+
+    def test_cancelled_coroutine_gives_up_its_turn(self):
+        limit = AimdLimit(initial=1)
+
+        async def requests():
+            await limit.acquire_async()
+            waiting = asyncio.ensure_future(limit.acquire_async())
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            limit.release(latency=0.01)
+            await asyncio.wait_for(limit.acquire_async(), timeout=1)
+
+        asyncio.run(requests())
+
+    def test_requires_initial_within_bounds(self):
+        with self.assertRaises(CasprException):
+            AimdLimit(initial=0)
+
+
+class TestEndpoint(unittest.TestCase):
+    def setUp(self):
+        self._clock = Clock()
+
+    def _endpoint(self, **kwargs):
+        return Endpoint(name='test', clock=self._clock, sleep=self._clock.sleep, randomness=random.Random(1),
+                        **kwargs)
+
+    def test_returns_result(self):
+        endpoint = self._endpoint()
+        self.assertEqual(endpoint.call(lambda: 'page'), 'page')
+        self.assertEqual(endpoint.counters()['calls'], 1)
+
+    def test_retries_with_jittered_backoff(self):
+        statuses = [429, 503]
+
+        def call():
+            if statuses:
+                check_status(statuses.pop(0))
+            return 'page'
+
+        endpoint = self._endpoint(backoff=1, max_backoff=10)
+        self.assertEqual(endpoint.call(call), 'page')
+        backoffs = [sleep for sleep in self._clock.sleeps if sleep]
+        self.assertEqual(len(backoffs), 2)
+        self.assertLessEqual(backoffs[0], 1)
+        self.assertLessEqual(backoffs[1], 2)
+        counters = endpoint.counters()
+        self.assertEqual((counters['calls'], counters['retries'], counters['throttled'], counters['failed']),
+                         (1, 2, 1, 1))
+
+    def test_honours_retry_after(self):
+        statuses = [429]
+
+        def call():
+            if statuses:
+                raise RetryableStatus(statuses.pop(), retry_after='7')
+            return 'page'
+
+        self._endpoint(backoff=1).call(call)
+        self.assertIn(7, self._clock.sleeps)
+
+    def test_gives_up_after_retries(self):
+        def call():
+            check_status(500)
+
+        endpoint = self._endpoint(retries=2)
+        with self.assertRaises(RetryableStatus):
+            endpoint.call(call)
+        counters = endpoint.counters()
+        self.assertEqual((counters['failed'], counters['retries'], counters['given_up']), (3, 2, 1))
+
+    def test_does_not_retry_other_errors(self):
+        def call():
+            raise CasprException('not found')
+
+        endpoint = self._endpoint(concurrency=1)
+        with self.assertRaises(CasprException):
+            endpoint.call(call)
+        self.assertEqual(endpoint.call(lambda: 'page'), 'page')  # the slot was released
+        self.assertEqual(endpoint.counters()['retries'], 0)
+
+    def test_throttles_by_rate(self):
+        endpoint = self._endpoint(rate=2, burst=1)
+        for _ in range(3):
+            endpoint.call(lambda: None)
+        self.assertEqual(self._clock.now, 1.0)
+        self.assertEqual(endpoint.counters()['waited'], 1.0)
+
+    def test_throttling_decreases_concurrency(self):
+        statuses = [429]
+
+        def call():
+            if statuses:
+                check_status(statuses.pop())
+
+        endpoint = self._endpoint(concurrency=4)
+        endpoint.call(call)
+        self.assertEqual(endpoint.counters()['concurrency'], 2)
+
+    def test_retries_coroutines(self):
+        statuses = [503]
+
+        async def call():
+            if statuses:
+                check_status(statuses.pop())
+            return 'page'
+
+        endpoint = Endpoint(name='test', backoff=0.01)
+        self.assertEqual(asyncio.run(endpoint.call_async(call)), 'page')
+        self.assertEqual(endpoint.counters()['retries'], 1)
+
+
+class TestRateLimits(unittest.TestCase):
+    def test_shares_endpoints_by_name(self):
+        limits = RateLimits()
+        self.assertIs(limits.endpoint('geocaching.com'), limits.endpoint('geocaching.com'))
+        self.assertIsNot(limits.endpoint('geocaching.com'), limits.endpoint('sheets.googleapis.com'))
+
+    def test_applies_known_limits(self):
+        limits = RateLimits(endpoints={'example.com': dict(concurrency=3)})
+        self.assertEqual(limits.endpoint('example.com').counters()['concurrency'], 3)
+        self.assertIsNone(limits.endpoint('unknown.com').counters()['concurrency'])
+
+    def test_reports_counters_by_name(self):
+        limits = RateLimits(endpoints={})
+        limits.endpoint('example.com').call(lambda: None)
+        self.assertEqual(limits.counters()['example.com']['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
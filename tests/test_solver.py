@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+import numpy
+
+from caspr.casprexception import CasprException
+from caspr.evaluator import DimensionFormula, PositionFormula
+from caspr.solver import solve
+
+_VARIABLES = 'ABCDEFGHIJKL'
+_ORIGIN = 'N 47° 03.204 E 008° 18.557'
+
+
+def _position(latitude, longitude):
+    return PositionFormula(DimensionFormula(latitude, _VARIABLES), DimensionFormula(longitude, _VARIABLES))
+
+
+def _assignments(values):
+    return sorted(zip(*[values[variable] for variable in sorted(values)]))
+
+
+def _distances(latitudes, longitudes):
+    ''' Returns the distances to the origin in meters with a plain haversine formula. '''
+
+    latitude, longitude = numpy.radians(47 + 3.204 / 60), numpy.radians(8 + 18.557 / 60)
+    latitudes, longitudes = numpy.radians(latitudes), numpy.radians(longitudes)
+    haversine = (numpy.sin((latitudes - latitude) / 2) ** 2 +
+                 numpy.cos(latitude) * numpy.cos(latitudes) * numpy.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * 6371000 * numpy.arcsin(numpy.sqrt(haversine))
+
+
+class TestSolve(unittest.TestCase):
+    def test_finds_all_valid_solutions(self):
+        solutions = solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'))
+        self.assertEqual(_assignments(solutions.values), [(a, b) for a in range(6) for b in range(10)])
+        self.assertIsNone(solutions.distances)
+
+    def test_known_variables_are_not_searched(self):
+        solutions = solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'), known={'A': 3})
+        self.assertEqual(list(solutions.values), ['B'])
+        numpy.testing.assert_allclose(solutions.latitudes, 47 + 31.2 / 60)
+
+    def test_solves_with_all_variables_known(self):
+        solutions = solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'), known={'A': 3, 'B': 4})
+        self.assertEqual(solutions.values, {})
+        numpy.testing.assert_allclose(solutions.latitudes, [47 + 31.2 / 60])
+        numpy.testing.assert_allclose(solutions.longitudes, [8 + 14.345 / 60])
+
+    def test_solves_formula_without_variables(self):
+        solutions = solve(_position('|N| 47° 31.2', '|E| 008° 14.345'))
+        self.assertEqual(solutions.values, {})
+        numpy.testing.assert_allclose(solutions.latitudes, [47 + 31.2 / 60])
+        numpy.testing.assert_allclose(solutions.longitudes, [8 + 14.345 / 60])
+
+    def test_restricts_variables_to_ranges(self):
+        solutions = solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'), ranges={'A': (2, 3), 'B': (7, 7)})
+        self.assertEqual(_assignments(solutions.values), [(2, 7), (3, 7)])
+
+    def test_raises_if_range_empty(self):
+        with self.assertRaises(CasprException):
+            solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'), ranges={'A': (3, 2)})
+
+    def test_raises_if_origin_without_max_distance(self):
+        with self.assertRaises(CasprException):
+            solve(_position('|N| 47° A1.2', '|E| 008° 1B.345'), origin=_ORIGIN)
+
+    def test_matches_brute_force_within_max_distance(self):
+        position = _position('|N| 47° A(B*C).D(E-F)', '|E| 008° 1(F:2).A(B+5)')
+        solutions = solve(position, origin=_ORIGIN, max_distance=30000)
+        values, latitudes, longitudes = position.brute_force()
+        feasible = numpy.isfinite(latitudes) & numpy.isfinite(longitudes)
+        feasible[feasible] = _distances(latitudes[feasible], longitudes[feasible]) <= 30000
+        self.assertEqual(_assignments(solutions.values), _assignments({variable: values[variable][feasible]
+                                                                       for variable in values}))
+        self.assertTrue(all(solutions.distances <= 30000))
+
+    def test_prunes_many_unknowns(self):
+        position = _position('|N| 4A° (B+C)D.EF(G-1)', '|E| 00H° 1I.JKL')
+        start = time.perf_counter()
+        solutions = solve(position, origin=_ORIGIN, max_distance=300)
+        self.assertLess(time.perf_counter() - start, 5)  # enumerating 10^12 combinations would take hours
+        self.assertEqual(len(solutions.values), 12)
+        self.assertTrue(len(solutions.latitudes) > 0)
+        self.assertTrue(all(solutions.distances <= 300))
+
+
+if __name__ == "__main__":
+    unittest.main()
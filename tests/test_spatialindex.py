@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from caspr.casprexception import CasprException
+from caspr.spatialindex import SpatialIndex
+from caspr.stage import Stage
+from caspr.staticcoordinate import Coordinate
+
+_ORIGIN = Coordinate(47.0534, 8.30928)
+_ONE_KILOMETER_NORTH = 1000 / 111195.0  # degrees of latitude
+
+
+def _north_of_origin(kilometers):
+    return Coordinate(_ORIGIN.latitude + kilometers * _ONE_KILOMETER_NORTH, _ORIGIN.longitude)
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        self._index = SpatialIndex()
+        for kilometers in [0.2, 5, 0.4, 1.5, 30]:
+            self._index.add(_north_of_origin(kilometers), kilometers)
+
+    def test_constructor_raises_if_cell_size_invalid(self):
+        with self.assertRaises(CasprException):
+            SpatialIndex(cell_size=0)
+
+    def test_within_returns_nearest_first(self):
+        self.assertEqual([item for _, item in self._index.within(_ORIGIN, 2000)], [0.2, 0.4, 1.5])
+
+    def test_within_returns_distances(self):
+        distance, _ = self._index.within(_ORIGIN, 300)[0]
+        self.assertAlmostEqual(distance, 200, delta=1)
+
+    def test_within_empty_index(self):
+        self.assertEqual(SpatialIndex().within(_ORIGIN, 500), [])
+
+    def test_nearest(self):
+        self.assertEqual([item for _, item in self._index.nearest(_north_of_origin(4), 2)], [5, 1.5])
+
+    def test_nearest_returns_all_if_count_exceeds_size(self):
+        self.assertEqual([item for _, item in self._index.nearest(_ORIGIN, 10)], [0.2, 0.4, 1.5, 5, 30])
+
+    def test_nearest_far_away_from_all_items(self):
+        self.assertEqual([item for _, item in self._index.nearest(Coordinate(-33.9, 151.2), 1)], [30])
+
+    def test_incremental_insertion(self):
+        self._index.add(_north_of_origin(0.1), 'new')
+        self.assertEqual(len(self._index), 6)
+        self.assertEqual(self._index.nearest(_ORIGIN, 1)[0][1], 'new')
+
+    def test_across_the_antimeridian(self):
+        index = SpatialIndex()
+        index.add(Coordinate(0, 179.999), 'east')
+        self.assertEqual([item for _, item in index.within(Coordinate(0, -179.999), 500)], ['east'])
+
+    def test_close_pairs(self):
+        pairs = sorted((first, second) for _, first, second in self._index.close_pairs(300))
+        self.assertEqual(pairs, [(0.2, 0.4)])
+
+    def test_add_stages(self):
+        index = SpatialIndex()
+        stages = [Stage(name='Parking', coordinates='N 47° 03.204 E 008° 18.557', description='', tasks=[]),
+                  Stage(name='Final', coordinates=None, description='', tasks=[])]
+        self.assertEqual(index.add_stages('GC2A62B', stages), 1)
+        self.assertEqual(index.within(_ORIGIN, 100)[0][1], {'cache': 'GC2A62B', 'stage': 'Parking'})
+
+
+class TestSpatialIndexFile(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_save_and_load(self):
+        index = SpatialIndex(cell_size=0.1)
+        index.add(_ORIGIN, {'cache': 'GC2A62B', 'stage': 'Parking'})
+        index.save(self._path)
+        loaded = SpatialIndex.load(self._path)
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(loaded.within(_ORIGIN, 1), [(0.0, {'cache': 'GC2A62B', 'stage': 'Parking'})])
+
+    def test_load_raises_if_invalid(self):
+        with open(self._path, 'w') as file:
+            file.write('{"entries": []}')
+        with self.assertRaises(CasprException):
+            SpatialIndex.load(self._path)
+
+
+if __name__ == "__main__":
+    unittest.main()
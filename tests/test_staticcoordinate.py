@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from caspr.staticcoordinate import StaticCoordinate
+from caspr.staticcoordinate import bearing, Coordinate, haversine, StaticCoordinate
+import math
+import numpy
 import unittest
 
 
@@ -41,6 +43,64 @@ class TestStaticCoordinate(unittest.TestCase):
         actual = StaticCoordinate.filter(given)
         self.assertEqual(actual, expected)
 
+    def test_parse_returns_decimal_degrees(self):
+        coordinate = StaticCoordinate.parse('bei N 47° 03.204 E 008° 18.557\xa0')
+        self.assertAlmostEqual(coordinate.latitude, 47 + 3.204 / 60)
+        self.assertAlmostEqual(coordinate.longitude, 8 + 18.557 / 60)
+
+    def test_parse_south_and_west_are_negative(self):
+        coordinate = StaticCoordinate.parse('S 33° 51.567 W 151° 12.345')
+        self.assertLess(coordinate.latitude, 0)
+        self.assertLess(coordinate.longitude, 0)
+
+    def test_parse_non_coordinates_yield_none(self):
+        self.assertIsNone(StaticCoordinate.parse('N 47° 03.204'))
+
+    def test_parse_all_returns_arrays(self):
+        given = ['N 47° 03.204 E 008° 18.557', '???', 'a\nN 47° 03.204 E 008° 18.557 b S 1° 2.345 W 3° 4.567', '']
+        latitudes, longitudes = StaticCoordinate.parse_all(given * 1000)
+        self.assertEqual(latitudes.shape, (4000,))
+        expected = StaticCoordinate.parse(given[0])
+        numpy.testing.assert_allclose(latitudes[[0, 2, 3996, 3998]], expected.latitude)
+        numpy.testing.assert_allclose(longitudes[[0, 2, 3996, 3998]], expected.longitude)
+        self.assertTrue(all(math.isnan(latitude) for latitude in latitudes[1::2]))
+
+    def test_parse_all_without_coordinates(self):
+        latitudes, longitudes = StaticCoordinate.parse_all(['no', 'coordinates'])
+        self.assertTrue(numpy.isnan(latitudes).all() and numpy.isnan(longitudes).all())
+
+
+class TestCoordinate(unittest.TestCase):
+    def test_str_is_geocaching_format(self):
+        for given in ['N 47° 03.204 E 008° 18.557', 'S 01° 59.999 W 151° 00.001']:
+            self.assertEqual(str(StaticCoordinate.parse(given)), given)
+
+    def test_equality(self):
+        self.assertEqual(Coordinate(1.5, 2.5), Coordinate(latitude=1.5, longitude=2.5))
+        self.assertNotEqual(Coordinate(1.5, 2.5), Coordinate(2.5, 1.5))
+
+    def test_has_no_instance_dictionary(self):
+        with self.assertRaises(AttributeError):
+            Coordinate(1, 2).altitude = 3
+
+    def test_distance(self):
+        # one minute of latitude is about one nautical mile
+        self.assertAlmostEqual(Coordinate(47, 8).distance(Coordinate(47 + 1 / 60, 8)), 1853, delta=2)
+
+    def test_bearing(self):
+        origin = Coordinate(47, 8)
+        self.assertAlmostEqual(origin.bearing(Coordinate(48, 8)), 0)
+        self.assertAlmostEqual(origin.bearing(Coordinate(47, 9)), 90, delta=1)
+        self.assertAlmostEqual(origin.bearing(Coordinate(46, 8)), 180)
+        self.assertAlmostEqual(origin.bearing(Coordinate(47, 7)), 270, delta=1)
+
+    def test_haversine_and_bearing_broadcast(self):
+        latitudes = numpy.array([47, 48, 47])
+        longitudes = numpy.array([8, 8, 9])
+        self.assertEqual(haversine(47, 8, latitudes, longitudes).shape, (3,))
+        numpy.testing.assert_allclose(haversine(47, 8, latitudes, longitudes)[0], 0)
+        self.assertEqual(bearing(47, 8, latitudes, longitudes).shape, (3,))
+
 
 # TESTLIST:
 # - coordinates_in_wgs84_decimal